@@ -0,0 +1,82 @@
+"""
+Split-balance accounts.
+
+A very hot account can have its balance spread over N bucket documents in
+`account_buckets`, sharded on a hashed `bucketKey` ("<accountNumber>:<i>"),
+so its postings are spread over the shards instead of all writing the one
+account document. The account document is flagged with `buckets: N` and its
+own `balance` stays at 0; the balance is the sum of the buckets.
+
+The transaction service credits a random bucket and debits by reserving
+from the fullest buckets first (see transaction-service/app/buckets.py).
+Here we only split accounts and read their totals. Totals are cached for a
+few seconds, since summing N buckets on every balance read of a hot account
+would bring back the load the split removed.
+"""
+from fastapi import HTTPException
+from .db import accounts, account_buckets, client
+from .cache import cache
+import os
+
+BUCKETS_MAX = int(os.getenv("BUCKETS_MAX", 64))
+BUCKET_TOTAL_TTL = int(os.getenv("BUCKET_TOTAL_TTL", 2))
+
+
+def bucket_keys(account_number: str, buckets: int) -> list:
+    return [f"{account_number}:{i}" for i in range(buckets)]
+
+
+async def bucket_total(account: dict) -> float:
+    """Balance of an account; the (cached) bucket sum for split accounts"""
+    if not account.get("buckets"):
+        return account.get("balance", 0.0)
+
+    cache_key = f"balance:buckets:{account['accountNumber']}"
+    total = cache.get(cache_key)
+    if total is None:
+        total = 0.0
+        keys = bucket_keys(account["accountNumber"], account["buckets"])
+        async for b in account_buckets.find({"bucketKey": {"$in": keys}}, {"balance": 1}):
+            total += b.get("balance", 0.0)
+        cache.set(cache_key, total, ttl=BUCKET_TOTAL_TTL)
+    return total
+
+
+async def with_totals(account_list: list) -> list:
+    """Replace the balance of split accounts with their bucket total"""
+    for a in account_list:
+        if a.get("buckets"):
+            a["balance"] = await bucket_total(a)
+    return account_list
+
+
+async def split_account(account_number: str, buckets: int) -> dict:
+    """Spread an account's balance over `buckets` bucket documents (or add buckets to a split one)"""
+    if not 2 <= buckets <= BUCKETS_MAX:
+        raise HTTPException(400, f"buckets must be between 2 and {BUCKETS_MAX}")
+
+    async with await client.start_session() as session:
+        async with session.start_transaction():
+            a = await accounts.find_one({"accountNumber": account_number}, session=session)
+            if not a:
+                raise HTTPException(404, "account not found")
+            current = a.get("buckets", 0)
+            if buckets <= current:
+                raise HTTPException(400, f"account already has {current} buckets")
+
+            # An unsplit account's balance moves into bucket 0; new buckets start empty
+            await account_buckets.insert_many([
+                {
+                    "bucketKey": key,
+                    "accountNumber": account_number,
+                    "index": i,
+                    "balance": a.get("balance", 0.0) if current == 0 and i == 0 else 0.0,
+                }
+                for i, key in enumerate(bucket_keys(account_number, buckets)) if i >= current
+            ], session=session)
+            await accounts.update_one(
+                {"_id": a["_id"]},
+                {"$set": {"buckets": buckets, "balance": 0.0}},
+                session=session
+            )
+    return a
@@ -9,6 +9,9 @@ from functools import wraps
 import redis
 from redis.exceptions import RedisError
 
+# Pub/sub channel for "this user's data changed" events (consumed by the API gateway cache)
+EVENTS_CHANNEL = os.getenv("EVENTS_CHANNEL", "banking:events")
+
 class CacheManager:
     def __init__(self):
         self.redis_host = os.getenv("REDIS_HOST", "redis")
@@ -87,6 +90,18 @@ class CacheManager:
             print(f"Cache delete pattern error for {pattern}: {e}")
             return False
     
+    def publish(self, channel: str, message: Any) -> bool:
+        """Publish a JSON message on a pub/sub channel"""
+        if not self.redis_client:
+            return False
+        
+        try:
+            self.redis_client.publish(channel, json.dumps(message, default=str))
+            return True
+        except (RedisError, TypeError) as e:
+            print(f"Cache publish error for {channel}: {e}")
+            return False
+    
     def is_connected(self) -> bool:
         """Check if Redis is connected"""
         if not self.redis_client:
@@ -138,4 +153,14 @@ def invalidate_cache(pattern: str):
     Usage:
         invalidate_cache("user:123:*")
     """
-    return cache.delete_pattern(pattern)
\ No newline at end of file
+    return cache.delete_pattern(pattern)
+
+
+def publish_event(user_id: str, resources: list, **data):
+    """
+    Announce that a user's data changed so listeners can drop cached copies
+    
+    Usage:
+        publish_event(user_id, ["accounts", "transactions"])
+    """
+    return cache.publish(EVENTS_CHANNEL, {"userId": str(user_id), "resources": resources, **data})
\ No newline at end of file
@@ -5,4 +5,5 @@ MONGO_URI = os.getenv("MONGO_URI", "mongodb://mongos:27017")
 client = AsyncIOMotorClient(MONGO_URI)
 db = client.get_database("banking")
 accounts = db.accounts
-users = db.users
\ No newline at end of file
+users = db.users
+account_buckets = db.account_buckets
@@ -2,10 +2,11 @@ from fastapi import APIRouter, HTTPException, Query, Depends, Request
 from slowapi import Limiter
 from slowapi.util import get_remote_address
 from bson import ObjectId
-from ..db import accounts
+from ..db import accounts, account_buckets
+from ..buckets import BUCKET_TOTAL_TTL, bucket_keys, bucket_total, with_totals
 from ..schemas import AccountCreate, AccountOut, AccountUpdate
 from ..auth import verify_token
-from ..cache import cache, invalidate_cache
+from ..cache import cache, invalidate_cache, publish_event
 
 router = APIRouter(prefix="/api/accounts", tags=["accounts"])
 limiter = Limiter(key_func=get_remote_address)
@@ -37,6 +38,8 @@ async def create_account(request: Request, payload: AccountCreate, user=Depends(
     
     # Invalidate user's account list cache
     invalidate_cache(f"accounts:user:{payload.userId}:*")
+    invalidate_cache(f"ownership:user:{payload.userId}")
+    publish_event(payload.userId, ["accounts"], event="account.created", accountNumber=payload.accountNumber)
     
     return account_data
 
@@ -64,6 +67,7 @@ async def list_accounts(request: Request, user_id: str | None = None, user=Depen
         a["id"] = str(a["_id"])
         a.pop("_id", None)
         result.append(a)
+    await with_totals(result)
     
     # Cache the result
     cache.set(cache_key, result)
@@ -94,6 +98,7 @@ async def get_account(request: Request, account_id: str, user=Depends(verify_tok
         raise HTTPException(403, "Forbidden")
     
     account_data = {"id": str(a["_id"]), **{k:v for k,v in a.items() if k!="_id"}}
+    await with_totals([account_data])
     
     # Cache it
     cache.set(cache_key, account_data)
@@ -126,13 +131,13 @@ async def get_balance(request: Request, account_id: str, user=Depends(verify_tok
     balance_data = {
         "accountId": str(a["_id"]),
         "accountNumber": a.get("accountNumber"),
-        "balance": a.get("balance", 0.0),
+        "balance": await bucket_total(a),
         "currency": a.get("currency", "INR"),
         "userId": a.get("userId")
     }
     
-    # Cache with shorter TTL (5 minutes)
-    cache.set(cache_key, balance_data)
+    # Cache with shorter TTL (5 minutes; seconds for split accounts, whose total moves constantly)
+    cache.set(cache_key, balance_data, ttl=BUCKET_TOTAL_TTL if a.get("buckets") else 300)
     
     # Remove userId from response
     balance_data.pop("userId")
@@ -147,17 +152,21 @@ async def update_account(request: Request, account_id: str, payload: AccountUpda
         raise HTTPException(403, "Forbidden: admin only")
     
     upd = {k:v for k,v in payload.model_dump().items() if v is not None}
+    if "balance" in upd and await accounts.find_one({"_id": ObjectId(account_id), "buckets": {"$exists": True}}):
+        raise HTTPException(400, "balance of a split account is held in its buckets")
     res = await accounts.update_one({"_id": ObjectId(account_id)}, {"$set": upd})
     if res.matched_count == 0:
         raise HTTPException(404, "not found")
     
     a = await accounts.find_one({"_id": ObjectId(account_id)})
     account_data = {"id": str(a["_id"]), **{k:v for k,v in a.items() if k!="_id"}}
+    await with_totals([account_data])
     
     # Invalidate caches
     invalidate_cache(f"account:id:{account_id}")
     invalidate_cache(f"balance:account:{account_id}")
     invalidate_cache(f"accounts:user:{a.get('userId')}:*")
+    publish_event(a.get("userId"), ["accounts"], event="account.updated", accountNumber=a.get("accountNumber"))
     
     return account_data
 
@@ -177,11 +186,15 @@ async def delete_account(request: Request, account_id: str, user=Depends(verify_
     res = await accounts.delete_one({"_id": ObjectId(account_id)})
     if res.deleted_count == 0:
         raise HTTPException(404, "not found")
+    if a.get("buckets"):
+        await account_buckets.delete_many({"bucketKey": {"$in": bucket_keys(a["accountNumber"], a["buckets"])}})
     
     # Invalidate all related caches
     invalidate_cache(f"account:id:{account_id}")
     invalidate_cache(f"balance:account:{account_id}")
     invalidate_cache(f"accounts:user:{a.get('userId')}:*")
     invalidate_cache("accounts:all:*")
+    invalidate_cache(f"ownership:user:{a.get('userId')}")
+    publish_event(a.get("userId"), ["accounts"], event="account.deleted", accountNumber=a.get("accountNumber"))
     
     return {"message": "deleted"}
\ No newline at end of file
@@ -1,6 +1,8 @@
 from fastapi import APIRouter, HTTPException, Depends
 from ..db import accounts
 from ..auth import verify_token
+from ..cache import invalidate_cache, publish_event
+from ..buckets import split_account
 
 router = APIRouter(prefix="/api/admin", tags=["admin"])
 
@@ -11,11 +13,32 @@ async def freeze_account(accountNumber: str, freeze: bool = True, user=Depends(v
         raise HTTPException(403, "Forbidden: admin only")
     
     status = "frozen" if freeze else "active"
-    res = await accounts.update_one({"accountNumber": accountNumber}, {"$set": {"status": status}})
-    if res.matched_count == 0:
+    a = await accounts.find_one_and_update({"accountNumber": accountNumber}, {"$set": {"status": status}})
+    if not a:
         raise HTTPException(404, "account not found")
+    
+    invalidate_cache(f"account:number:{accountNumber}")
+    invalidate_cache(f"account:id:{a['_id']}")
+    invalidate_cache(f"accounts:user:{a.get('userId')}:*")
+    publish_event(a.get("userId"), ["accounts"], event="account.updated", accountNumber=accountNumber)
     return {"accountNumber": accountNumber, "status": status}
 
+@router.post("/split-account")
+async def split_balance(accountNumber: str, buckets: int, user=Depends(verify_token)):
+    # Only admin can split accounts
+    if user.get("role") != "admin":
+        raise HTTPException(403, "Forbidden: admin only")
+    
+    a = await split_account(accountNumber, buckets)
+    
+    invalidate_cache(f"account:number:{accountNumber}")
+    invalidate_cache(f"account:id:{a['_id']}")
+    invalidate_cache(f"balance:account:{a['_id']}")
+    invalidate_cache(f"accounts:user:{a.get('userId')}:*")
+    invalidate_cache("accounts:all:*")
+    publish_event(a.get("userId"), ["accounts"], event="account.updated", accountNumber=accountNumber)
+    return {"accountNumber": accountNumber, "buckets": buckets}
+
 @router.get("/stats")
 async def stats(user=Depends(verify_token)):
     # Only admin can view stats
@@ -11,6 +11,7 @@ class AccountCreate(BaseModel):
 
 class AccountOut(AccountCreate):
     id: str
+    buckets: Optional[int] = None
 
 class AccountUpdate(BaseModel):
     balance: Optional[float]
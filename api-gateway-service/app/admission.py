@@ -0,0 +1,105 @@
+"""
+Adaptive admission control and load shedding for gateway upstreams.
+
+Each service has a concurrency limit that adapts to observed latency (AIMD):
+it grows by about one per round trip while calls are fast and successful,
+and shrinks by ADMISSION_DECREASE when latency rises past
+ADMISSION_LATENCY_TOLERANCE x the no-load latency or calls fail.
+
+Requests are admitted by priority class. Each class may only use a share of
+the current limit, so low-priority polling is shed first and money-movement
+POSTs last. A shed request gets an immediate 503 with Retry-After instead of
+queueing behind the backlog. Like the replica "outstanding" counters, a slot
+is held until the upstream answers with headers.
+"""
+import os
+import time
+from .resilience import UpstreamUnavailable
+from .upstreams import UPSTREAMS
+
+ADMISSION_INITIAL_LIMIT = float(os.getenv("ADMISSION_INITIAL_LIMIT", 50))
+ADMISSION_MIN_LIMIT = float(os.getenv("ADMISSION_MIN_LIMIT", 5))
+ADMISSION_MAX_LIMIT = float(os.getenv("ADMISSION_MAX_LIMIT", 500))
+ADMISSION_DECREASE = float(os.getenv("ADMISSION_DECREASE", 0.9))
+ADMISSION_LATENCY_TOLERANCE = float(os.getenv("ADMISSION_LATENCY_TOLERANCE", 2.0))
+# Minimum time between two decreases, so one slow burst does not collapse the limit
+ADMISSION_DECREASE_INTERVAL = float(os.getenv("ADMISSION_DECREASE_INTERVAL", 0.1))
+# Samples after which the no-load latency estimate is refreshed
+ADMISSION_RTT_WINDOW = int(os.getenv("ADMISSION_RTT_WINDOW", 500))
+ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", 1))
+
+# Share of the limit each priority class may fill
+PRIORITY_SHARES = {
+    "critical": 1.0,
+    "normal": 0.8,
+    "low": 0.5,
+}
+
+
+class Overloaded(UpstreamUnavailable):
+    """Raised without calling the upstream when a request is shed"""
+
+    def __init__(self, service: str, priority: str):
+        super().__init__(service, ADMISSION_RETRY_AFTER)
+        self.priority = priority
+
+
+class AdaptiveLimiter:
+    def __init__(self, service: str):
+        self.service = service
+        self.limit = ADMISSION_INITIAL_LIMIT
+        self.inflight = 0
+        self.min_rtt = None
+        self.window_min_rtt = None
+        self.window_samples = 0
+        self.last_decrease = 0.0
+        self.counters = {"admitted": 0, **{f"shed_{p}": 0 for p in PRIORITY_SHARES}}
+
+    def acquire(self, priority: str = "normal"):
+        """Take a slot or raise Overloaded"""
+        if self.inflight >= self.limit * PRIORITY_SHARES.get(priority, PRIORITY_SHARES["normal"]):
+            self.counters[f"shed_{priority}"] += 1
+            raise Overloaded(self.service, priority)
+        self.inflight += 1
+        self.counters["admitted"] += 1
+
+    def cancel(self):
+        """Give the slot back without a sample (the call never reached the upstream)"""
+        self.inflight -= 1
+
+    def release(self, latency: float, ok: bool):
+        """Give the slot back and adapt the limit to how the call went"""
+        self.inflight -= 1
+        self._observe_rtt(latency)
+
+        if not ok or latency > self.min_rtt * ADMISSION_LATENCY_TOLERANCE:
+            now = time.monotonic()
+            if now - self.last_decrease >= ADMISSION_DECREASE_INTERVAL:
+                self.limit = max(ADMISSION_MIN_LIMIT, self.limit * ADMISSION_DECREASE)
+                self.last_decrease = now
+        elif self.inflight + 1 >= self.limit / 2:
+            # Only grow when the limit is actually being used
+            self.limit = min(ADMISSION_MAX_LIMIT, self.limit + 1 / self.limit)
+
+    def _observe_rtt(self, latency: float):
+        """Track the no-load latency as the minimum of the previous window"""
+        self.window_min_rtt = latency if self.window_min_rtt is None else min(self.window_min_rtt, latency)
+        self.window_samples += 1
+        if self.min_rtt is None:
+            self.min_rtt = latency
+        if self.window_samples >= ADMISSION_RTT_WINDOW:
+            self.min_rtt = self.window_min_rtt
+            self.window_min_rtt = None
+            self.window_samples = 0
+        self.min_rtt = min(self.min_rtt, latency)
+
+    def stats(self) -> dict:
+        return {
+            "limit": round(self.limit, 1),
+            "inflight": self.inflight,
+            "min_rtt_ms": round(self.min_rtt * 1000, 1) if self.min_rtt is not None else None,
+            **self.counters,
+        }
+
+
+LIMITERS = {service: AdaptiveLimiter(service) for service in UPSTREAMS}
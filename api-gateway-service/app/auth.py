@@ -0,0 +1,97 @@
+"""
+Edge JWT verification for the API Gateway.
+
+The gateway verifies each bearer token once, keeps the verified claims in a
+bounded LRU keyed by the token digest until the token expires, and forwards
+a compact HMAC-signed identity header that the services accept instead of
+decoding the JWT again.
+"""
+from collections import OrderedDict
+from typing import Optional
+from jose import jwt, JWTError
+import base64
+import hashlib
+import hmac
+import os
+import time
+
+JWT_SECRET = os.getenv("JWT_SECRET", "your_super_secret_jwt_key_change_in_production")
+ALGO = "HS256"
+
+INTERNAL_IDENTITY_SECRET = os.getenv("INTERNAL_IDENTITY_SECRET", JWT_SECRET).encode()
+IDENTITY_HEADER = "x-internal-identity"
+
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", 10000))
+# Upper bound for tokens that carry no "exp" claim
+TOKEN_CACHE_MAX_TTL = int(os.getenv("TOKEN_CACHE_MAX_TTL", 300))
+
+
+def sign_identity(user_id: str, role: str, exp: int, email: str) -> str:
+    """Build the internal identity header: user_id:role:exp:email:signature"""
+    payload = f"{user_id}:{role}:{exp}:{email}"
+    sig = hmac.new(INTERNAL_IDENTITY_SECRET, payload.encode(), hashlib.sha256).digest()
+    return f"{payload}:{base64.urlsafe_b64encode(sig).rstrip(b'=').decode()}"
+
+
+class TokenCache:
+    """Bounded LRU of verified tokens: digest -> (expires_at, claims, identity header)"""
+
+    def __init__(self, maxsize: int = TOKEN_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: bytes):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry[0] <= time.time():
+            del self.entries[key]
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key: bytes, entry: tuple):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {"size": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+
+token_cache = TokenCache()
+
+
+def verify(authorization: Optional[str]):
+    """Return (claims, identity header) for a valid bearer token, or None"""
+    if not authorization or not authorization.startswith("Bearer "):
+        return None
+
+    token = authorization[7:].strip()
+    key = hashlib.sha256(token.encode()).digest()
+
+    entry = token_cache.get(key)
+    if entry:
+        return entry[1], entry[2]
+
+    try:
+        claims = jwt.decode(token, JWT_SECRET, algorithms=[ALGO])
+    except JWTError:
+        # Invalid tokens are left to the services so clients keep the same errors
+        return None
+
+    if not claims.get("user_id"):
+        return None
+
+    expires_at = int(claims.get("exp") or time.time() + TOKEN_CACHE_MAX_TTL)
+    identity = sign_identity(
+        str(claims["user_id"]), claims.get("role", "user"), expires_at, claims.get("email", "")
+    )
+    token_cache.put(key, (expires_at, claims, identity))
+    return claims, identity
@@ -0,0 +1,176 @@
+"""
+Per-user response cache for read routes proxied by the API Gateway.
+
+Entries are keyed by path, query string and user id. Upstream Cache-Control
+and ETag headers are honored. Entries are dropped when the services publish
+"user data changed" events on Redis (see publish_event in the services'
+cache.py) or when a write for the same user passes through the gateway.
+"""
+from collections import OrderedDict
+from typing import Optional
+from urllib.parse import parse_qsl
+import redis.asyncio as aioredis
+import asyncio
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+REDIS_HOST = os.getenv("REDIS_HOST", "redis")
+REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
+EVENTS_CHANNEL = os.getenv("EVENTS_CHANNEL", "banking:events")
+
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", 10000))
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", 60))
+RESPONSE_CACHE_MAX_BODY = int(os.getenv("RESPONSE_CACHE_MAX_BODY", 1024 * 1024))
+# Invalidation stamps kept per (user, resource); see ResponseCache
+RESPONSE_CACHE_GENERATIONS = int(os.getenv("RESPONSE_CACHE_GENERATIONS", 100000))
+
+
+def parse_cache_control(value: Optional[str]) -> dict:
+    """'private, max-age=30' -> {"private": None, "max-age": "30"}"""
+    directives = {}
+    for part in (value or "").split(","):
+        name, _, arg = part.strip().partition("=")
+        if name:
+            directives[name.lower()] = arg.strip('"') or None
+    return directives
+
+
+class ResponseCache:
+    """
+    Bounded LRU of upstream responses.
+
+    Invalidation is O(1): a counter is bumped on every invalidation and the
+    (user, resource) pair is stamped with it. An entry carries the counter
+    as it was when its fetch started, and is treated as a miss once its
+    pair has a later stamp. A response fetched while an invalidation
+    arrives is therefore never served as fresh.
+
+    Only the RESPONSE_CACHE_GENERATIONS most recently invalidated pairs keep
+    their own stamp. Evicting older ones raises a floor that every other
+    pair is stamped with, so entries fetched before an evicted invalidation
+    become misses instead of being served again.
+    """
+
+    def __init__(self, maxsize: int = RESPONSE_CACHE_SIZE, max_generations: int = RESPONSE_CACHE_GENERATIONS):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.max_generations = max_generations
+        self.generations = OrderedDict()  # (user, resource) -> stamp, oldest first
+        self.clock = 0
+        self.floor = 0
+        self.counters = {"hits": 0, "misses": 0, "revalidated": 0, "stored": 0, "invalidations": 0}
+        # Only cache while invalidation events are being received
+        self.enabled = False
+
+    @staticmethod
+    def key(path: str, query: str, user_id: str) -> tuple:
+        return (path, tuple(sorted(parse_qsl(query, keep_blank_values=True))), user_id)
+
+    def generation(self, user_id: str, resource: str) -> int:
+        """To pass to store() for a response about to be fetched"""
+        return self.clock
+
+    def stamp(self, user_id: str, resource: str) -> int:
+        return self.generations.get((user_id, resource), self.floor)
+
+    def get(self, key: tuple, resource: str) -> Optional[dict]:
+        """Return the entry (fresh or stale-but-revalidatable) or None"""
+        entry = self.entries.get(key) if self.enabled else None
+        if entry is None or entry["generation"] < self.stamp(key[2], resource):
+            self.entries.pop(key, None)
+            return None
+        self.entries.move_to_end(key)
+        return entry
+
+    @staticmethod
+    def is_fresh(entry: dict) -> bool:
+        return entry["expires"] > time.monotonic()
+
+    def store(self, key: tuple, resource: str, generation: int, status: int, headers: list, body: bytes, ttl: int):
+        if not self.enabled or generation < self.stamp(key[2], resource):
+            return
+        if len(body) > RESPONSE_CACHE_MAX_BODY:
+            return
+        self.entries[key] = {
+            "status": status,
+            "headers": headers,
+            "body": body,
+            "etag": dict(headers).get(b"etag"),
+            # Compressed variants, filled on first use (see compression.encode)
+            "encoded": {},
+            "generation": generation,
+            "expires": time.monotonic() + ttl,
+        }
+        self.entries.move_to_end(key)
+        self.counters["stored"] += 1
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def refresh(self, entry: dict, ttl: int):
+        entry["expires"] = time.monotonic() + ttl
+        self.counters["revalidated"] += 1
+
+    def invalidate(self, user_id: str, resources):
+        self.clock += 1
+        for resource in resources:
+            self.generations[(user_id, resource)] = self.clock
+            self.generations.move_to_end((user_id, resource))
+        while len(self.generations) > self.max_generations:
+            _, stamp = self.generations.popitem(last=False)
+            self.floor = max(self.floor, stamp)
+        self.counters["invalidations"] += 1
+
+    def stats(self) -> dict:
+        return {"enabled": self.enabled, "size": len(self.entries), "generations": len(self.generations),
+                **self.counters}
+
+
+def cache_ttl(route: dict, headers) -> Optional[int]:
+    """
+    How long an upstream response may be served without asking the upstream
+    again, or None if it must not be stored at all.
+    """
+    directives = parse_cache_control(headers.get("cache-control"))
+    if "no-store" in directives:
+        return None
+    if "no-cache" in directives:
+        # Stored, but every use is revalidated with the ETag
+        return 0 if headers.get("etag") else None
+    if directives.get("max-age", "").isdigit():
+        return min(int(directives["max-age"]), route.get("cache_ttl", RESPONSE_CACHE_TTL))
+    return route.get("cache_ttl", RESPONSE_CACHE_TTL)
+
+
+response_cache = ResponseCache()
+
+
+async def listen_for_invalidations():
+    """Apply invalidation events published by the services; reconnects forever"""
+    while True:
+        try:
+            async with aioredis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True) as client:
+                async with client.pubsub() as pubsub:
+                    await pubsub.subscribe(EVENTS_CHANNEL)
+                    response_cache.enabled = True
+                    logger.info(f"Listening for cache invalidations on '{EVENTS_CHANNEL}'")
+                    async for message in pubsub.listen():
+                        if message.get("type") != "message":
+                            continue
+                        try:
+                            event = json.loads(message["data"])
+                            response_cache.invalidate(str(event["userId"]), event.get("resources", []))
+                        except (ValueError, KeyError, TypeError) as e:
+                            logger.warning(f"Ignoring malformed invalidation event: {e}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Invalidation listener disconnected: {e}")
+
+        # Events may have been missed while disconnected: start from scratch
+        response_cache.enabled = False
+        response_cache.entries.clear()
+        await asyncio.sleep(2)
@@ -0,0 +1,116 @@
+"""
+Response compression and strong ETags for buffered gateway responses.
+
+Bodies above COMPRESS_MIN_SIZE are sent gzip or brotli encoded when the
+client accepts it (brotli only if the optional brotli package is installed).
+Compressed variants are memoized on the response, so a cached list is
+compressed once per encoding rather than once per poll.
+
+Every 200 gets a strong ETag (the upstream's, or a SHA-256 of the identity
+body). Encoded variants carry the same tag with an encoding suffix, as they
+are different representations. If-None-Match is matched against the tag
+with or without the suffix.
+"""
+from typing import Optional
+import gzip
+import hashlib
+import os
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", 1024))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", 6))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", 5))
+
+COMPRESSIBLE_TYPES = (b"application/json", b"text/", b"application/x-ndjson")
+
+ENCODERS = {"gzip": lambda body: gzip.compress(body, GZIP_LEVEL)}
+if brotli is not None:
+    ENCODERS["br"] = lambda body: brotli.compress(body, quality=BROTLI_QUALITY)
+
+# Server preference when the client accepts several encodings with equal q
+PREFERENCE = ["br", "gzip"]
+
+
+def strong_etag(body: bytes) -> bytes:
+    return b'"' + hashlib.sha256(body).hexdigest()[:32].encode() + b'"'
+
+
+def variant_etag(etag: bytes, encoding: Optional[str]) -> bytes:
+    """'"abc"' -> '"abc-gzip"' for an encoded representation"""
+    if not encoding or not etag.endswith(b'"'):
+        return etag
+    return etag[:-1] + f"-{encoding}".encode() + b'"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: Optional[bytes]) -> bool:
+    """Weak comparison (RFC 9110 13.1.2) against any representation of `etag`"""
+    if not if_none_match or not etag:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    base = etag.decode("latin-1").removeprefix("W/")
+    for tag in if_none_match.split(","):
+        tag = tag.strip().removeprefix("W/")
+        if tag == base or any(tag == variant_etag(etag, e).decode("latin-1").removeprefix("W/") for e in ENCODERS):
+            return True
+    return False
+
+
+def negotiate(accept_encoding: Optional[str]) -> Optional[str]:
+    """Best encoding the client accepts, or None for identity"""
+    accepted = {}
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.strip().partition(";")
+        name = name.strip().lower()
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name] = q
+
+    best, best_q = None, 0.0
+    for encoding in PREFERENCE:
+        if encoding not in ENCODERS:
+            continue
+        q = accepted.get(encoding, accepted.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def compressible(headers: list, body: bytes) -> bool:
+    if len(body) < COMPRESS_MIN_SIZE:
+        return False
+    values = dict(headers)
+    if b"content-encoding" in values:
+        return False
+    return values.get(b"content-type", b"").startswith(COMPRESSIBLE_TYPES)
+
+
+def encode(result: dict, accept_encoding: Optional[str]):
+    """
+    Pick the representation of a buffered 200 for this client.
+    Returns (headers, body) with Content-Encoding, Vary and the variant ETag set.
+    """
+    headers, body = result["headers"], result["body"]
+    if not compressible(headers, body):
+        return headers, body
+
+    encoding = negotiate(accept_encoding)
+    headers = [h for h in headers if h[0] not in (b"etag", b"vary")] + [(b"vary", b"Accept-Encoding")]
+    if encoding:
+        variants = result.setdefault("encoded", {})
+        if encoding not in variants:
+            variants[encoding] = ENCODERS[encoding](body)
+        body = variants[encoding]
+        headers.append((b"content-encoding", encoding.encode()))
+    if result.get("etag"):
+        headers.append((b"etag", variant_etag(result["etag"], encoding)))
+    return headers, body
@@ -0,0 +1,338 @@
+"""
+Streaming pass-through proxy for the API Gateway.
+
+Every public route is described by one entry in ROUTES. Request and response
+bodies are streamed between the client and the upstream service without
+being parsed, and upstream status codes and headers are preserved.
+
+Authenticated GETs on routes with a "cache" resource are buffered instead:
+they are answered from the per-user response cache when possible, and
+identical concurrent misses share one upstream call (single-flight). Routes
+with "invalidates" drop the caller's cached resources after a successful write.
+Buffered responses carry a strong ETag, answer If-None-Match with 304 and are
+compressed for clients that accept it (see compression.py).
+
+Every upstream call first passes admission control: under overload,
+"low" priority routes are shed first and "critical" ones last.
+"""
+from fastapi import HTTPException, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from .auth import IDENTITY_HEADER, verify
+from .cache import response_cache, cache_ttl
+from .compression import encode, etag_matches, strong_etag
+from .singleflight import singleflight
+from .resilience import UpstreamUnavailable, send
+from .admission import LIMITERS
+from .upstreams import UNHEALTHY_STATUSES
+import httpx
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# -------------------- ROUTE TABLE --------------------
+# "upstream_path" is only needed when the upstream path differs from the
+# public one. "cache" names the resource a cacheable GET reads, "invalidates"
+# lists the resources a write changes for the caller, "hedge" enables hedged
+# reads for latency-sensitive GETs. "priority" ("critical", "low"; default
+# "normal") decides how early a route is shed under overload.
+# IMPORTANT: more specific routes MUST come before general routes.
+ROUTES = [
+    # auth service
+    {"method": "POST", "path": "/api/auth/register", "service": "auth"},
+    {"method": "POST", "path": "/api/auth/login", "service": "auth"},
+    {"method": "GET", "path": "/api/auth/me", "service": "auth"},
+    {"method": "GET", "path": "/api/users", "service": "auth", "upstream_path": "/api/auth/users"},
+
+    # account service
+    {"method": "GET", "path": "/api/accounts", "service": "account", "cache": "accounts"},
+    {"method": "POST", "path": "/api/accounts", "service": "account", "invalidates": ["accounts"]},
+    {"method": "GET", "path": "/api/accounts/{account_id}", "service": "account"},
+    {"method": "DELETE", "path": "/api/accounts/{account_id}", "service": "account",
+     "invalidates": ["accounts"]},
+    {"method": "GET", "path": "/api/admin/stats", "service": "account"},
+    {"method": "POST", "path": "/api/admin/freeze-account", "service": "account"},
+    {"method": "POST", "path": "/api/admin/split-account", "service": "account"},
+
+    # transaction service
+    {"method": "POST", "path": "/api/transactions/transfer", "service": "transaction",
+     "invalidates": ["accounts", "transactions"], "priority": "critical"},
+    {"method": "POST", "path": "/api/transactions/deposit", "service": "transaction",
+     "invalidates": ["accounts", "transactions"], "priority": "critical"},
+    {"method": "POST", "path": "/api/transactions/withdraw", "service": "transaction",
+     "invalidates": ["accounts", "transactions"], "priority": "critical"},
+    # Streamed both ways: the file goes up and the per-row results come back as they are posted
+    {"method": "POST", "path": "/api/transactions/bulk", "service": "transaction",
+     "invalidates": ["accounts", "transactions"], "priority": "low"},
+    {"method": "GET", "path": "/api/transactions/bulk/{job_id}", "service": "transaction"},
+    {"method": "GET", "path": "/api/transactions/bulk/{job_id}/results", "service": "transaction",
+     "priority": "low"},
+    {"method": "POST", "path": "/api/transactions/schedules", "service": "transaction"},
+    {"method": "GET", "path": "/api/transactions/schedules", "service": "transaction"},
+    {"method": "GET", "path": "/api/transactions/schedules/{schedule_id}", "service": "transaction"},
+    {"method": "DELETE", "path": "/api/transactions/schedules/{schedule_id}", "service": "transaction"},
+    {"method": "GET", "path": "/api/transactions", "service": "transaction", "cache": "transactions"},
+    # Streamed (no "cache"): statements can be far larger than any buffer should be
+    {"method": "GET", "path": "/api/transactions/export", "service": "transaction", "priority": "low"},
+    {"method": "GET", "path": "/api/transactions/summary", "service": "transaction", "cache": "transactions"},
+    {"method": "GET", "path": "/api/transactions/balance-as-of", "service": "transaction",
+     "cache": "transactions"},
+    {"method": "GET", "path": "/api/transactions/{transaction_id}", "service": "transaction"},
+
+    # notification service
+    {"method": "GET", "path": "/api/notifications/unread-count", "service": "notification",
+     "cache": "notifications", "hedge": True, "fallback": {"count": 0}, "priority": "low"},
+    {"method": "POST", "path": "/api/notifications/mark-all-read", "service": "notification",
+     "invalidates": ["notifications"]},
+    {"method": "PATCH", "path": "/api/notifications/{notification_id}/mark-read", "service": "notification",
+     "invalidates": ["notifications"]},
+    {"method": "GET", "path": "/api/notifications", "service": "notification", "cache": "notifications",
+     "priority": "low"},
+]
+
+# Headers that only make sense for a single hop and must not be forwarded
+HOP_BY_HOP_HEADERS = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization",
+    "te", "trailers", "transfer-encoding", "upgrade",
+}
+
+# Request headers owned by the gateway -> upstream hop. A client must never be
+# able to send its own identity header.
+EXCLUDED_REQUEST_HEADERS = HOP_BY_HOP_HEADERS | {"host", IDENTITY_HEADER}
+
+# Request headers the gateway answers itself on buffered GETs: the upstream
+# always sends the full identity body, which is what gets cached and tagged
+BUFFERED_EXCLUDED_HEADERS = {b"if-none-match", b"if-modified-since", b"accept-encoding"}
+
+# Response headers the gateway sets itself (CORS is handled by the middleware)
+EXCLUDED_RESPONSE_HEADERS = {
+    h.encode() for h in HOP_BY_HOP_HEADERS | {"server", "date"}
+}
+
+
+ROUTE_INDEX = {(route["method"], route["path"]): route for route in ROUTES}
+
+
+def upstream_path(route: dict, request: Request) -> str:
+    path = route.get("upstream_path")
+    return path.format(**request.path_params) if path else request.url.path
+
+
+def forward_headers(request: Request) -> list:
+    """Client headers to send upstream (raw, so repeated headers survive)"""
+    headers = [
+        (k, v) for k, v in request.headers.raw
+        if k.decode("latin-1").lower() not in EXCLUDED_REQUEST_HEADERS
+    ]
+    identity = authenticate(request)
+    if identity:
+        headers.append((IDENTITY_HEADER.encode(), identity.encode()))
+    return headers
+
+
+def authenticate(request: Request):
+    """Verify the bearer token once per request; claims are kept on request.state.user"""
+    if not hasattr(request.state, "user"):
+        verified = verify(request.headers.get("authorization"))
+        request.state.user, request.state.identity = verified or (None, None)
+    return request.state.identity
+
+
+def response_headers(response: httpx.Response) -> list:
+    """Upstream headers to send back to the client"""
+    return [
+        (k.lower(), v) for k, v in response.headers.raw
+        if k.lower() not in EXCLUDED_RESPONSE_HEADERS
+        and not k.lower().startswith(b"access-control-")
+    ]
+
+
+def has_body(request: Request) -> bool:
+    return "content-length" in request.headers or "transfer-encoding" in request.headers
+
+
+async def stream_body(upstream: httpx.Response):
+    """Relay the raw upstream body and release the connection even if the client goes away"""
+    try:
+        async for chunk in upstream.aiter_raw():
+            yield chunk
+    finally:
+        await upstream.aclose()
+
+
+async def send_upstream(route: dict, method: str, path: str, query: str, headers: list, body=None) -> httpx.Response:
+    """
+    Open a streamed response through admission control and the service's
+    breaker, retry budget and balancer. Raises Overloaded (an
+    UpstreamUnavailable) when the request is shed.
+    """
+    limiter = LIMITERS[route["service"]]
+    limiter.acquire(route.get("priority", "normal"))
+    start = time.monotonic()
+    ok = False
+    try:
+        response = await send(route["service"], method, path, query, headers, body, hedge=route.get("hedge", False))
+        ok = response.status_code not in UNHEALTHY_STATUSES
+        return response
+    except UpstreamUnavailable:
+        # Breaker is open: nothing was measured
+        limiter.cancel()
+        start = None
+        raise
+    finally:
+        if start is not None:
+            limiter.release(time.monotonic() - start, ok)
+
+
+def upstream_failed(route: dict, request: Request, error: Exception):
+    """Answer with the route fallback if it has one, otherwise fail fast with a 5xx"""
+    logger.error(f"{request.method} {request.url.path} -> {route['service']} failed: {error}")
+    if "fallback" in route:
+        return JSONResponse(route["fallback"])
+    if isinstance(error, UpstreamUnavailable):
+        raise HTTPException(503, str(error), headers={"Retry-After": str(error.retry_after)})
+    if isinstance(error, httpx.TimeoutException):
+        raise HTTPException(504, f"{route['service']} service timed out")
+    raise HTTPException(502, str(error))
+
+
+async def read_raw(upstream: httpx.Response) -> bytes:
+    """Buffer the raw (still content-encoded) upstream body"""
+    try:
+        return b"".join([chunk async for chunk in upstream.aiter_raw()])
+    finally:
+        await upstream.aclose()
+
+
+def buffered_response(status: int, headers: list, body: bytes, extra: list = ()) -> Response:
+    response = Response(body, status_code=status)
+    response.raw_headers = [h for h in headers if h[0] != b"content-length"] + list(extra) + [
+        (b"content-length", str(len(body)).encode())
+    ]
+    return response
+
+
+async def proxy(route: dict, request: Request):
+    """Stream a request to its upstream service and stream the answer back"""
+    headers = forward_headers(request)
+    user = request.state.user
+
+    if request.method == "GET" and route.get("cache") and user:
+        return await buffered_get(route, request, headers)
+
+    try:
+        upstream = await send_upstream(
+            route, request.method, upstream_path(route, request), request.url.query, headers,
+            request.stream() if has_body(request) else None,
+        )
+    except (httpx.HTTPError, UpstreamUnavailable) as e:
+        return upstream_failed(route, request, e)
+
+    if route.get("invalidates") and user and upstream.status_code < 400:
+        response_cache.invalidate(str(user["user_id"]), route["invalidates"])
+
+    response = StreamingResponse(stream_body(upstream), status_code=upstream.status_code)
+    response.raw_headers = response_headers(upstream)
+    return response
+
+
+async def buffered_get(route: dict, request: Request, headers: list):
+    headers = [h for h in headers if h[0].lower() not in BUFFERED_EXCLUDED_HEADERS]
+    try:
+        result = await cached_get(
+            route, upstream_path(route, request), request.url.query, headers, request.state.user,
+            no_cache="no-cache" in request.headers.get("cache-control", ""),
+        )
+    except (httpx.HTTPError, UpstreamUnavailable) as e:
+        return upstream_failed(route, request, e)
+
+    return conditional_response(request, result, [(b"x-cache", result["cache"].encode())])
+
+
+def conditional_response(request: Request, result: dict, extra: list = ()) -> Response:
+    """304 if the client already has this body, otherwise the best encoding it accepts"""
+    if result["status"] != 200:
+        return buffered_response(result["status"], result["headers"], result["body"], extra)
+
+    headers, body = encode(result, request.headers.get("accept-encoding"))
+    if etag_matches(request.headers.get("if-none-match"), result.get("etag")):
+        kept = [h for h in headers if h[0] in (b"etag", b"vary", b"cache-control")]
+        response = Response(status_code=304)
+        response.raw_headers = kept + list(extra)
+        return response
+    return buffered_response(200, headers, body, extra)
+
+
+def tagged(status: int, headers: list, body: bytes) -> dict:
+    """A buffered result with its strong ETag (the upstream's, or computed from the body)"""
+    etag = dict(headers).get(b"etag")
+    if status == 200 and not etag:
+        etag = strong_etag(body)
+        headers = headers + [(b"etag", etag)]
+    return {"status": status, "headers": headers, "body": body, "etag": etag, "encoded": {}}
+
+
+async def cached_get(route: dict, path: str, query: str, headers: list, user: dict,
+                     no_cache: bool = False) -> dict:
+    """
+    Authenticated GET through the per-user response cache (admins bypass the
+    cache because their lists span users) and the single-flight layer.
+    Returns {"status", "headers", "body", "etag", "cache"}; raises
+    httpx.HTTPError or UpstreamUnavailable.
+    """
+    user_id = str(user["user_id"])
+    resource = route["cache"]
+    key = response_cache.key(path, query, user_id)
+
+    entry = None
+    if user.get("role") != "admin" and not no_cache:
+        entry = response_cache.get(key, resource)
+
+    if entry and response_cache.is_fresh(entry):
+        response_cache.counters["hits"] += 1
+        return {**entry, "cache": "HIT"}
+
+    response_cache.counters["misses"] += 1
+    generation = response_cache.generation(user_id, resource)
+    revalidate = entry["etag"] if entry and entry["etag"] else None
+    if revalidate:
+        headers = headers + [(b"if-none-match", revalidate)]
+
+    async def fetch():
+        upstream = await send_upstream(route, "GET", path, query, headers)
+        body = await read_raw(upstream)
+        return {
+            **tagged(upstream.status_code, response_headers(upstream), body),
+            "ttl": cache_ttl(route, upstream.headers),
+        }
+
+    # Conditional and unconditional requests must not share an answer
+    result = await singleflight.do(key + (revalidate,), fetch)
+
+    if result["status"] == 304 and revalidate:
+        response_cache.refresh(entry, result["ttl"] or 0)
+        return {**entry, "cache": "REVALIDATED"}
+
+    if result["status"] == 200 and result["ttl"] is not None and user.get("role") != "admin":
+        response_cache.store(key, resource, generation, 200, result["headers"], result["body"], result["ttl"])
+
+    return {**result, "cache": "MISS"}
+
+
+def make_handler(route: dict):
+    async def handler(request: Request):
+        return await proxy(route, request)
+
+    return handler
+
+
+def register_routes(app):
+    """Add every entry of ROUTES to the FastAPI app"""
+    for route in ROUTES:
+        app.add_api_route(
+            route["path"],
+            make_handler(route),
+            methods=[route["method"]],
+            name=f"{route['method'].lower()} {route['path']}",
+            tags=[route["service"]],
+        )
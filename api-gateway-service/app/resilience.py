@@ -0,0 +1,277 @@
+"""
+Circuit breakers, retry budgets and hedged reads for gateway upstreams.
+
+Every upstream call goes through send(). Each service has:
+  - a circuit breaker that fails fast (503 + Retry-After) once the recent
+    failure ratio is too high, and lets a few probes through after a pause;
+  - a retry budget: idempotent GETs that hit a transport error or a
+    502/503/504 are retried on another replica, but only while retries stay
+    within a fixed ratio of regular traffic, so retries cannot multiply the
+    load on a struggling service;
+  - a latency tracker whose p95 decides when a hedged read (a second copy of
+    a slow GET sent to another replica) is fired for routes flagged "hedge".
+"""
+from collections import deque
+import asyncio
+import logging
+import os
+import random
+import time
+import httpx
+from .upstreams import UPSTREAMS, UNHEALTHY_STATUSES
+
+logger = logging.getLogger(__name__)
+
+# -------------------- CIRCUIT BREAKER --------------------
+BREAKER_WINDOW = float(os.getenv("BREAKER_WINDOW", 10.0))
+BREAKER_MIN_REQUESTS = int(os.getenv("BREAKER_MIN_REQUESTS", 20))
+BREAKER_FAILURE_RATIO = float(os.getenv("BREAKER_FAILURE_RATIO", 0.5))
+BREAKER_OPEN_SECONDS = float(os.getenv("BREAKER_OPEN_SECONDS", 5.0))
+BREAKER_HALF_OPEN_PROBES = int(os.getenv("BREAKER_HALF_OPEN_PROBES", 3))
+
+# -------------------- RETRIES --------------------
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", 3))
+RETRY_BACKOFF = float(os.getenv("RETRY_BACKOFF", 0.05))
+# Retries (and hedges) allowed per regular request, plus a small floor per second
+RETRY_BUDGET_RATIO = float(os.getenv("RETRY_BUDGET_RATIO", 0.2))
+RETRY_BUDGET_PER_SECOND = float(os.getenv("RETRY_BUDGET_PER_SECOND", 5.0))
+RETRY_BUDGET_MAX = float(os.getenv("RETRY_BUDGET_MAX", 100.0))
+
+# -------------------- HEDGING --------------------
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", 0.01))
+LATENCY_SAMPLES = int(os.getenv("LATENCY_SAMPLES", 1000))
+
+
+class UpstreamUnavailable(Exception):
+    """Raised without calling the upstream while its circuit breaker is open"""
+
+    def __init__(self, service: str, retry_after: int):
+        super().__init__(f"{service} service unavailable")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    def __init__(self):
+        self.state = "closed"
+        self.outcomes = deque()  # (timestamp, ok) within BREAKER_WINDOW
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probes = 0
+        self.counters = {"opened": 0, "rejected": 0}
+
+    def allow(self) -> bool:
+        now = time.monotonic()
+        if self.state == "open":
+            if now - self.opened_at < BREAKER_OPEN_SECONDS:
+                self.counters["rejected"] += 1
+                return False
+            self.state, self.probes = "half_open", 0
+
+        if self.state == "half_open":
+            if self.probes >= BREAKER_HALF_OPEN_PROBES:
+                self.counters["rejected"] += 1
+                return False
+            self.probes += 1
+        return True
+
+    def record(self, ok: bool):
+        now = time.monotonic()
+        if self.state == "half_open":
+            if ok:
+                self.state = "closed"
+                self.outcomes.clear()
+                self.failures = 0
+            else:
+                self._open(now)
+            return
+
+        self.outcomes.append((now, ok))
+        self.failures += not ok
+        while self.outcomes and self.outcomes[0][0] < now - BREAKER_WINDOW:
+            self.failures -= not self.outcomes.popleft()[1]
+
+        if (self.state == "closed" and len(self.outcomes) >= BREAKER_MIN_REQUESTS
+                and self.failures / len(self.outcomes) >= BREAKER_FAILURE_RATIO):
+            self._open(now)
+
+    def _open(self, now: float):
+        self.state = "open"
+        self.opened_at = now
+        self.counters["opened"] += 1
+        logger.warning("Circuit breaker opened")
+
+    def retry_after(self) -> int:
+        return max(1, round(BREAKER_OPEN_SECONDS - (time.monotonic() - self.opened_at)))
+
+    def stats(self) -> dict:
+        return {"state": self.state, "window_requests": len(self.outcomes),
+                "window_failures": self.failures, **self.counters}
+
+
+class RetryBudget:
+    """Token bucket fed by regular traffic; every retry or hedge spends one token"""
+
+    def __init__(self):
+        self.tokens = RETRY_BUDGET_MAX
+        self.updated = time.monotonic()
+
+    def deposit(self):
+        now = time.monotonic()
+        refill = RETRY_BUDGET_RATIO + (now - self.updated) * RETRY_BUDGET_PER_SECOND
+        self.tokens = min(RETRY_BUDGET_MAX, self.tokens + refill)
+        self.updated = now
+
+    def withdraw(self) -> bool:
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class LatencyTracker:
+    """Recent time-to-headers samples; p95 is recomputed every 100 samples"""
+
+    def __init__(self):
+        self.samples = deque(maxlen=LATENCY_SAMPLES)
+        self.since_update = 0
+        self.cached_p95 = None
+
+    def add(self, seconds: float):
+        self.samples.append(seconds)
+        self.since_update += 1
+
+    def p95(self):
+        if self.cached_p95 is None or self.since_update >= 100:
+            if len(self.samples) < 20:
+                return None
+            ordered = sorted(self.samples)
+            self.cached_p95 = ordered[int(len(ordered) * 0.95) - 1]
+            self.since_update = 0
+        return self.cached_p95
+
+
+class Resilience:
+    """Breaker, budget, latency and counters of one service"""
+
+    def __init__(self, service: str):
+        self.service = service
+        self.upstream = UPSTREAMS[service]
+        self.breaker = CircuitBreaker()
+        self.budget = RetryBudget()
+        self.latency = LatencyTracker()
+        self.counters = {"retries": 0, "retries_denied": 0, "hedges": 0, "hedge_wins": 0}
+
+    def stats(self) -> dict:
+        p95 = self.latency.p95()
+        return {
+            "breaker": self.breaker.stats(),
+            "retry_tokens": round(self.budget.tokens, 1),
+            "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+            **self.counters,
+        }
+
+
+RESILIENCE = {service: Resilience(service) for service in UPSTREAMS}
+
+
+async def attempt(r: Resilience, replica, method, path, query, headers, body) -> httpx.Response:
+    start = time.monotonic()
+    response = await r.upstream.send(method, path, query, headers, body, replica=replica)
+    r.latency.add(time.monotonic() - start)
+    return response
+
+
+def healthy(task: asyncio.Task) -> bool:
+    return (not task.cancelled() and task.exception() is None
+            and task.result().status_code not in UNHEALTHY_STATUSES)
+
+
+def discard(task: asyncio.Task):
+    """Close the response of a hedge that lost the race"""
+    if not task.cancelled() and task.exception() is None:
+        asyncio.ensure_future(task.result().aclose())
+
+
+async def hedged(r: Resilience, replica, method, path, query, headers) -> httpx.Response:
+    """Send a GET; if it is slower than the service's p95, race a copy on another replica"""
+    first = asyncio.ensure_future(attempt(r, replica, method, path, query, headers, None))
+    pending = {first}
+    try:
+        p95 = r.latency.p95()
+        if p95 is not None:
+            await asyncio.wait(pending, timeout=max(p95, HEDGE_MIN_DELAY))
+        if first.done() or p95 is None or not r.budget.withdraw():
+            return await first
+
+        r.counters["hedges"] += 1
+        second = asyncio.ensure_future(
+            attempt(r, r.upstream.pick(exclude=[replica]), method, path, query, headers, None)
+        )
+        pending = {first, second}
+        while True:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            winner = next((t for t in done if healthy(t)), None)
+            if winner is None and not pending:
+                # Both failed: surface one outcome, close the other
+                winner = done.pop()
+            if winner:
+                if winner is second and healthy(winner):
+                    r.counters["hedge_wins"] += 1
+                for task in done - {winner}:
+                    discard(task)
+                return winner.result()
+            for task in done:
+                discard(task)
+    finally:
+        # Only still-running attempts: a finished one may be the response we return
+        for task in pending:
+            if not task.done():
+                task.cancel()
+                task.add_done_callback(discard)
+
+
+async def send(service: str, method: str, path: str, query: str, headers: list,
+               body=None, hedge: bool = False) -> httpx.Response:
+    """
+    Call a service through its breaker. Idempotent GETs without a body are
+    retried on other replicas within the retry budget, and hedged when asked.
+    """
+    r = RESILIENCE[service]
+    if not r.breaker.allow():
+        raise UpstreamUnavailable(service, r.breaker.retry_after())
+
+    r.budget.deposit()
+    idempotent = method == "GET" and body is None
+    tried = []
+
+    while True:
+        replica = r.upstream.pick(exclude=tried)
+        tried.append(replica)
+        try:
+            if hedge and idempotent:
+                response = await hedged(r, replica, method, path, query, headers)
+            else:
+                response = await attempt(r, replica, method, path, query, headers, body)
+        except httpx.TransportError:
+            r.breaker.record(ok=False)
+            if not await may_retry(r, idempotent, len(tried)):
+                raise
+            continue
+
+        ok = response.status_code not in UNHEALTHY_STATUSES
+        r.breaker.record(ok=ok)
+        if ok or not await may_retry(r, idempotent, len(tried)):
+            return response
+        await response.aclose()
+
+
+async def may_retry(r: Resilience, idempotent: bool, attempts: int) -> bool:
+    if not idempotent or attempts >= RETRY_MAX_ATTEMPTS:
+        return False
+    if not r.budget.withdraw():
+        r.counters["retries_denied"] += 1
+        return False
+    r.counters["retries"] += 1
+    # Jittered backoff so a burst of failures does not retry in lockstep
+    await asyncio.sleep(random.uniform(0, RETRY_BACKOFF * attempts))
+    return True
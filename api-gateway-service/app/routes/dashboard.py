@@ -0,0 +1,83 @@
+from fastapi import APIRouter, HTTPException, Query, Request
+from ..auth import IDENTITY_HEADER
+from ..proxy import ROUTE_INDEX, authenticate, cached_get, conditional_response, read_raw, send_upstream, tagged
+import asyncio
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/api/dashboard", tags=["dashboard"])
+
+# Per-call budget; a slow service only blanks its own section
+DASHBOARD_CALL_TIMEOUT = float(os.getenv("DASHBOARD_CALL_TIMEOUT", 2.0))
+
+# section -> (gateway route it reuses, upstream path)
+SECTIONS = {
+    "profile": (ROUTE_INDEX[("GET", "/api/auth/me")], "/api/auth/me"),
+    "accounts": (ROUTE_INDEX[("GET", "/api/accounts")], "/api/accounts"),
+    "transactions": (ROUTE_INDEX[("GET", "/api/transactions")], "/api/transactions"),
+    "unreadCount": (ROUTE_INDEX[("GET", "/api/notifications/unread-count")], "/api/notifications/unread-count"),
+}
+
+
+async def fetch_section(name: str, query: str, headers: list, user: dict):
+    """Fetch one section; returns (data, error message or None)"""
+    route, path = SECTIONS[name]
+    try:
+        if route.get("cache"):
+            call = cached_get(route, path, query, headers, user)
+        else:
+            call = uncached_get(route, path, query, headers)
+        result = await asyncio.wait_for(call, DASHBOARD_CALL_TIMEOUT)
+    except asyncio.TimeoutError:
+        return None, "timeout"
+    except Exception as e:
+        logger.warning(f"Dashboard section '{name}' failed: {e}")
+        return None, "unavailable"
+
+    if result["status"] != 200:
+        return None, f"upstream returned {result['status']}"
+    try:
+        return json.loads(result["body"]), None
+    except ValueError:
+        return None, "invalid upstream response"
+
+
+async def uncached_get(route: dict, path: str, query: str, headers: list) -> dict:
+    upstream = await send_upstream(route, "GET", path, query, headers)
+    return {"status": upstream.status_code, "body": await read_raw(upstream)}
+
+
+@router.get("")
+async def dashboard(request: Request, transactions_limit: int = Query(10, ge=1, le=200)):
+    """Profile, accounts, recent transactions and unread count in one round trip"""
+    identity = authenticate(request)
+    user = request.state.user
+    if not identity:
+        raise HTTPException(401, "Missing or invalid token")
+
+    # Only what the services need: no client encodings or conditional headers
+    headers = [
+        (b"authorization", request.headers["authorization"].encode()),
+        (IDENTITY_HEADER.encode(), identity.encode()),
+    ]
+    queries = {"transactions": f"limit={transactions_limit}"}
+
+    names = list(SECTIONS)
+    results = await asyncio.gather(
+        *(fetch_section(name, queries.get(name, ""), headers, user) for name in names)
+    )
+
+    body = {"errors": {}}
+    for name, (data, error) in zip(names, results):
+        if name == "unreadCount" and data is not None:
+            data = data.get("count", 0)
+        body[name] = data
+        if error:
+            body["errors"][name] = error
+
+    # Tagged and compressed like the proxied lists, so an unchanged dashboard polls as a 304
+    content = json.dumps(body, separators=(",", ":")).encode()
+    return conditional_response(request, tagged(200, [(b"content-type", b"application/json")], content))
@@ -0,0 +1,43 @@
+"""
+Request coalescing ("single-flight") for identical concurrent upstream GETs.
+
+The first caller for a key runs the upstream call; callers that arrive while
+it is in flight wait for the same result instead of sending their own.
+"""
+import asyncio
+
+
+class SingleFlight:
+    def __init__(self):
+        self.calls = {}
+        self.counters = {"requests": 0, "upstream_calls": 0, "coalesced": 0}
+
+    async def do(self, key, fn):
+        """Run fn() once per key at a time and share its result with every waiter"""
+        self.counters["requests"] += 1
+        task = self.calls.get(key)
+
+        if task is None:
+            self.counters["upstream_calls"] += 1
+            # A task of its own, so a leader whose client disconnects does not
+            # cancel the call for everybody else
+            task = asyncio.ensure_future(fn())
+            self.calls[key] = task
+            task.add_done_callback(lambda t: self._finish(key, t))
+        else:
+            self.counters["coalesced"] += 1
+
+        return await asyncio.shield(task)
+
+    def _finish(self, key, task):
+        if self.calls.get(key) is task:
+            del self.calls[key]
+        if not task.cancelled():
+            # Mark the exception as retrieved even if every waiter went away
+            task.exception()
+
+    def stats(self) -> dict:
+        return {"in_flight": len(self.calls), **self.counters}
+
+
+singleflight = SingleFlight()
@@ -0,0 +1,176 @@
+"""
+Upstream connection pools and replica load balancing for the API Gateway.
+
+Each service is a list of replica URLs ({NAME}_SERVICE_URLS, comma separated,
+falling back to the single {NAME}_SERVICE_URL). Every replica gets its own
+httpx connection pool, so one slow replica cannot exhaust the connections of
+the others. Requests go to the available replica with the fewest outstanding
+requests. A replica that keeps failing is ejected for a while (passive health
+checking), with the ejection time doubling on repeated ejections.
+"""
+import asyncio
+import logging
+import os
+import random
+import time
+import httpx
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_URLS = {
+    "auth": "http://auth-service:8000",
+    "account": "http://account-service:8001",
+    "transaction": "http://transaction-service:8002",
+    "notification": "http://notification-service:8003",
+}
+
+# -------------------- POOL SETTINGS --------------------
+UPSTREAM_TIMEOUT = float(os.getenv("UPSTREAM_TIMEOUT", 30.0))
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", 2.0))
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", 100))
+UPSTREAM_MAX_KEEPALIVE = int(os.getenv("UPSTREAM_MAX_KEEPALIVE", 20))
+UPSTREAM_KEEPALIVE_EXPIRY = float(os.getenv("UPSTREAM_KEEPALIVE_EXPIRY", 30.0))
+# HTTP/2 with prior knowledge (h2c). Only enable when the services run behind an
+# HTTP/2 capable server; uvicorn speaks HTTP/1.1 only.
+UPSTREAM_HTTP2 = os.getenv("UPSTREAM_HTTP2", "false").lower() == "true"
+# Keep-alive connections opened per replica at startup
+UPSTREAM_PREWARM = int(os.getenv("UPSTREAM_PREWARM", 4))
+
+# -------------------- PASSIVE HEALTH --------------------
+EJECT_AFTER_FAILURES = int(os.getenv("EJECT_AFTER_FAILURES", 5))
+EJECT_SECONDS = float(os.getenv("EJECT_SECONDS", 5.0))
+EJECT_MAX_SECONDS = float(os.getenv("EJECT_MAX_SECONDS", 60.0))
+
+# Upstream answers that say "this replica is unhealthy", not "bad request"
+UNHEALTHY_STATUSES = {502, 503, 504}
+
+
+def service_urls(name: str) -> list:
+    env = name.upper()
+    urls = os.getenv(f"{env}_SERVICE_URLS") or os.getenv(f"{env}_SERVICE_URL") or DEFAULT_URLS[name]
+    return [url.strip().rstrip("/") for url in urls.split(",") if url.strip()]
+
+
+class Replica:
+    def __init__(self, url: str):
+        self.url = url
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(UPSTREAM_TIMEOUT, connect=UPSTREAM_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=UPSTREAM_MAX_CONNECTIONS,
+                max_keepalive_connections=UPSTREAM_MAX_KEEPALIVE,
+                keepalive_expiry=UPSTREAM_KEEPALIVE_EXPIRY,
+            ),
+            http1=not UPSTREAM_HTTP2,
+            http2=UPSTREAM_HTTP2,
+        )
+        # Requests sent and not yet answered (headers received)
+        self.outstanding = 0
+        self.consecutive_failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+        self.counters = {"requests": 0, "failures": 0}
+
+    def available(self, now: float) -> bool:
+        return self.ejected_until <= now
+
+    def record(self, ok: bool):
+        if ok:
+            self.consecutive_failures = 0
+            self.ejections = 0
+            return
+
+        self.counters["failures"] += 1
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= EJECT_AFTER_FAILURES:
+            self.ejections += 1
+            duration = min(EJECT_SECONDS * 2 ** (self.ejections - 1), EJECT_MAX_SECONDS)
+            self.ejected_until = time.monotonic() + duration
+            self.consecutive_failures = 0
+            logger.warning(f"Ejecting upstream replica {self.url} for {duration:.0f}s")
+
+    def stats(self) -> dict:
+        return {
+            "url": self.url,
+            "outstanding": self.outstanding,
+            "ejected": not self.available(time.monotonic()),
+            "ejections": self.ejections,
+            **self.counters,
+        }
+
+
+class Upstream:
+    """All replicas of one service"""
+
+    def __init__(self, name: str, urls: list):
+        self.name = name
+        self.replicas = [Replica(url) for url in urls]
+
+    def pick(self, exclude=()) -> Replica:
+        """Least outstanding requests among healthy replicas, random among ties"""
+        now = time.monotonic()
+        candidates = [r for r in self.replicas if r.available(now) and r not in exclude]
+        if not candidates:
+            candidates = [r for r in self.replicas if r not in exclude] or self.replicas
+            # Everything is ejected: try the replica that comes back first
+            # rather than failing outright
+            return min(candidates, key=lambda r: r.ejected_until)
+        fewest = min(r.outstanding for r in candidates)
+        return random.choice([r for r in candidates if r.outstanding == fewest])
+
+    async def send(self, method: str, path: str, query: str, headers: list, body=None,
+                   replica: Replica = None) -> httpx.Response:
+        """Open a streamed response on one replica and feed its health tracking"""
+        replica = replica or self.pick()
+        request = replica.client.build_request(
+            method,
+            # An empty query would still add a trailing "?"
+            httpx.URL(f"{replica.url}{path}", query=query.encode("utf-8")) if query
+            else httpx.URL(f"{replica.url}{path}"),
+            headers=headers,
+            content=body,
+        )
+
+        replica.outstanding += 1
+        replica.counters["requests"] += 1
+        try:
+            response = await replica.client.send(request, stream=True)
+        except httpx.TransportError:
+            replica.record(ok=False)
+            raise
+        finally:
+            replica.outstanding -= 1
+
+        replica.record(ok=response.status_code not in UNHEALTHY_STATUSES)
+        return response
+
+    async def prewarm(self):
+        """Open keep-alive connections to every replica before traffic arrives"""
+        async def warm(replica: Replica):
+            try:
+                response = await replica.client.get(f"{replica.url}/")
+                await response.aclose()
+            except httpx.HTTPError as e:
+                logger.warning(f"Pre-warming {replica.url} failed: {e}")
+
+        await asyncio.gather(*(warm(r) for r in self.replicas for _ in range(UPSTREAM_PREWARM)))
+
+    async def aclose(self):
+        for replica in self.replicas:
+            await replica.client.aclose()
+
+    def stats(self) -> dict:
+        return {"replicas": [r.stats() for r in self.replicas]}
+
+
+UPSTREAMS = {name: Upstream(name, service_urls(name)) for name in DEFAULT_URLS}
+
+
+async def prewarm_all():
+    await asyncio.gather(*(u.prewarm() for u in UPSTREAMS.values()))
+    logger.info("Upstream connection pools pre-warmed")
+
+
+async def close_all():
+    for upstream in UPSTREAMS.values():
+        await upstream.aclose()
@@ -0,0 +1,163 @@
+"""
+Benchmark: streaming proxy vs. the old buffered JSON handlers.
+
+Starts a fake transaction-service and a gateway on localhost with uvicorn,
+then fires GET /api/transactions at the gateway and reports p50/p99 latency
+and peak RSS. Every (mode, payload size) pair runs in its own process so the
+RSS numbers do not leak into each other.
+
+Usage (from api-gateway-service/):
+    python benchmarks/bench_proxy.py [--requests 2000] [--concurrency 32]
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SIZES = {"1KB": 1024, "1MB": 1024 * 1024}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def serve(app, port):
+    """Run a uvicorn server in a daemon thread and wait until it accepts connections"""
+    import uvicorn
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+def make_upstream(size):
+    """Fake transaction-service returning a JSON list of roughly `size` bytes"""
+    from fastapi import FastAPI
+    from fastapi.responses import Response
+
+    item = {"txId": "TXN-000000000000", "fromAccount": "ACC1", "toAccount": "ACC2",
+            "amount": 10.0, "currency": "USD", "status": "SUCCESS", "type": "TRANSFER",
+            "createdAt": "2024-01-01T00:00:00"}
+    count = max(1, size // len(json.dumps(item)))
+    body = json.dumps([item] * count).encode()
+
+    upstream = FastAPI()
+
+    @upstream.get("/api/transactions")
+    async def transactions():
+        return Response(body, media_type="application/json")
+
+    return upstream
+
+
+def make_legacy_gateway(upstream_url):
+    """The pre-streaming handler, kept here only as the comparison baseline"""
+    import httpx
+    from fastapi import FastAPI, HTTPException, Request
+    from fastapi.responses import JSONResponse
+
+    gateway = FastAPI()
+    client = httpx.AsyncClient(timeout=30.0)
+
+    @gateway.get("/api/transactions")
+    async def list_transactions(request: Request):
+        try:
+            response = await client.get(
+                f"{upstream_url}/api/transactions",
+                headers=dict(request.headers)
+            )
+            return JSONResponse(response.json(), response.status_code)
+        except Exception as e:
+            raise HTTPException(500, str(e))
+
+    return gateway
+
+
+def make_streaming_gateway(upstream_url):
+    os.environ["TRANSACTION_SERVICE_URL"] = upstream_url
+    os.environ["UPSTREAM_PREWARM"] = "0"
+    sys.path.insert(0, ROOT)
+    from app.main import app
+
+    return app
+
+
+async def drive(url, total, concurrency):
+    import httpx
+
+    latencies = []
+    remaining = iter(range(total))
+
+    async with httpx.AsyncClient(timeout=60.0) as client:
+        async def worker():
+            for _ in remaining:
+                start = time.perf_counter()
+                response = await client.get(url)
+                await response.aread()
+                latencies.append(time.perf_counter() - start)
+                assert response.status_code == 200, response.status_code
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+    latencies.sort()
+    return latencies
+
+
+def run_case(mode, size, total, concurrency):
+    upstream_port, gateway_port = free_port(), free_port()
+    serve(make_upstream(SIZES[size]), upstream_port)
+    upstream_url = f"http://127.0.0.1:{upstream_port}"
+
+    gateway = make_legacy_gateway(upstream_url) if mode == "legacy" else make_streaming_gateway(upstream_url)
+    serve(gateway, gateway_port)
+
+    url = f"http://127.0.0.1:{gateway_port}/api/transactions"
+    asyncio.run(drive(url, min(total, 100), concurrency))  # warm-up
+    latencies = asyncio.run(drive(url, total, concurrency))
+
+    print(json.dumps({
+        "mode": mode,
+        "size": size,
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+        # ru_maxrss is KiB on Linux
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--case", nargs=2, metavar=("MODE", "SIZE"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        run_case(args.case[0], args.case[1], args.requests, args.concurrency)
+        return
+
+    print(f"{'mode':<10}{'payload':<10}{'p50 ms':>10}{'p99 ms':>10}{'max RSS MB':>12}")
+    for size in SIZES:
+        for mode in ("legacy", "stream"):
+            out = subprocess.run(
+                [sys.executable, __file__, "--case", mode, size,
+                 "--requests", str(args.requests), "--concurrency", str(args.concurrency)],
+                check=True, capture_output=True, text=True,
+            ).stdout
+            r = json.loads(out.strip().splitlines()[-1])
+            print(f"{r['mode']:<10}{r['size']:<10}{r['p50_ms']:>10.2f}{r['p99_ms']:>10.2f}{r['max_rss_mb']:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
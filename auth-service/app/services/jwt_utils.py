@@ -1,8 +1,11 @@
-import os, jwt, datetime
+import os, jwt, datetime, base64, hashlib, hmac, time
 
 SECRET = os.getenv("JWT_SECRET", "your_super_secret_jwt_key_change_in_production")
 ALGO = "HS256"
 
+# Shared with the API gateway, which signs the identity header after verifying the JWT
+INTERNAL_IDENTITY_SECRET = os.getenv("INTERNAL_IDENTITY_SECRET", SECRET).encode()
+
 def create_access_token(data: dict, expires_minutes: int = 60):
     payload = data.copy()
     payload.update({"exp": datetime.datetime.utcnow() + datetime.timedelta(minutes=expires_minutes)})
@@ -10,3 +13,20 @@ def create_access_token(data: dict, expires_minutes: int = 60):
 
 def decode_token(token: str):
     return jwt.decode(token, SECRET, algorithms=[ALGO])
+
+def decode_identity(value: str):
+    """Validate the gateway identity header (user_id:role:exp:email:signature), None if untrusted"""
+    payload, _, sig = value.rpartition(":")
+    expected = hmac.new(INTERNAL_IDENTITY_SECRET, payload.encode(), hashlib.sha256).digest()
+    if not hmac.compare_digest(sig, base64.urlsafe_b64encode(expected).rstrip(b"=").decode()):
+        return None
+
+    try:
+        user_id, role, exp, email = payload.split(":", 3)
+        exp = int(exp)
+    except ValueError:
+        return None
+
+    if exp <= time.time():
+        return None
+    return {"user_id": user_id, "role": role, "email": email, "exp": exp}
@@ -134,6 +134,20 @@ safeExecute("Sharding 'accounts' collection", function () {
     }
 });
 
+// Shard the account_buckets collection (by bucketKey "<accountNumber>:<i>")
+// Spreads the balance of split (very hot) accounts over the shards
+safeExecute("Sharding 'account_buckets' collection", function () {
+    try {
+        sh.shardCollection("banking.account_buckets", { bucketKey: "hashed" });
+        return "Account buckets collection sharded by bucketKey (hashed)";
+    } catch (e) {
+        if (e.message.includes("already sharded") || e.codeName === "AlreadyInitialized") {
+            return "Account buckets collection already sharded";
+        }
+        throw e;
+    }
+});
+
 // Shard the transactions collection (by txId)
 safeExecute("Sharding 'transactions' collection", function () {
     try {
@@ -147,6 +161,78 @@ safeExecute("Sharding 'transactions' collection", function () {
     }
 });
 
+// Shard the account_entries collection (by accountNumber, then createdAt)
+// An account's history is read from one shard; the createdAt suffix lets a
+// very busy account's history still be split into chunks
+safeExecute("Sharding 'account_entries' collection", function () {
+    try {
+        sh.shardCollection("banking.account_entries", { accountNumber: "hashed", createdAt: 1 });
+        return "Account entries collection sharded by accountNumber (hashed), createdAt";
+    } catch (e) {
+        if (e.message.includes("already sharded") || e.codeName === "AlreadyInitialized") {
+            return "Account entries collection already sharded";
+        }
+        throw e;
+    }
+});
+
+// Shard the account_daily collection (by accountNumber)
+// An account's rollups are read together, for statements and as-of balances
+safeExecute("Sharding 'account_daily' collection", function () {
+    try {
+        sh.shardCollection("banking.account_daily", { accountNumber: "hashed" });
+        return "Account daily rollups collection sharded by accountNumber (hashed)";
+    } catch (e) {
+        if (e.message.includes("already sharded") || e.codeName === "AlreadyInitialized") {
+            return "Account daily rollups collection already sharded";
+        }
+        throw e;
+    }
+});
+
+// Shard the bulk_results collection (by jobId, then row)
+// A job's results are read back in row order from one shard; the row suffix
+// lets the results of a very large file still be split into chunks
+safeExecute("Sharding 'bulk_results' collection", function () {
+    try {
+        sh.shardCollection("banking.bulk_results", { jobId: "hashed", row: 1 });
+        return "Bulk results collection sharded by jobId (hashed), row";
+    } catch (e) {
+        if (e.message.includes("already sharded") || e.codeName === "AlreadyInitialized") {
+            return "Bulk results collection already sharded";
+        }
+        throw e;
+    }
+});
+
+// Shard the schedules collection (by _id)
+// Due schedules are claimed and advanced by _id, each update on one shard
+safeExecute("Sharding 'schedules' collection", function () {
+    try {
+        sh.shardCollection("banking.schedules", { _id: "hashed" });
+        return "Schedules collection sharded by _id (hashed)";
+    } catch (e) {
+        if (e.message.includes("already sharded") || e.codeName === "AlreadyInitialized") {
+            return "Schedules collection already sharded";
+        }
+        throw e;
+    }
+});
+
+// Shard the ledger collection (by _id, the txId or idempotency id of the posting)
+// Entries are written and moved along by _id, so each step stays on one shard
+safeExecute("Sharding 'ledger' collection", function () {
+    try {
+        sh.shardCollection("banking.ledger", { _id: "hashed" });
+        return "Ledger collection sharded by _id (hashed)";
+    } catch (e) {
+        if (e.message.includes("already sharded") || e.codeName === "AlreadyInitialized") {
+            return "Ledger collection already sharded";
+        }
+        throw e;
+    }
+});
+
 // OPTIONAL: Shard the notifications collection (by userId)
 // This distributes user notifications across shards for better scalability
 safeExecute("Sharding 'notifications' collection", function () {
@@ -224,18 +310,60 @@ createIndexSafely("accounts", { "accountNumber": 1 }, { unique: true }, "account
 createIndexSafely("accounts", { "status": 1 }, {}, "status");
 createIndexSafely("accounts", { "createdAt": -1 }, {}, "createdAt");
 
+// Split-balance bucket indexes
+createIndexSafely("account_buckets", { "bucketKey": 1 }, { unique: true }, "bucketKey_unique");
+createIndexSafely("account_buckets", { "accountNumber": 1 }, {}, "accountNumber");
+
 // Transaction indexes
 createIndexSafely("transactions", { "fromAccount": 1, "createdAt": -1 }, {}, "fromAccount_createdAt");
 createIndexSafely("transactions", { "toAccount": 1, "createdAt": -1 }, {}, "toAccount_createdAt");
 createIndexSafely("transactions", { "txId": 1 }, { unique: true }, "txId_unique");
 createIndexSafely("transactions", { "status": 1 }, {}, "status");
 createIndexSafely("transactions", { "createdAt": -1 }, {}, "createdAt");
+createIndexSafely("transactions", { "createdAt": -1, "_id": -1 }, {}, "createdAt_id");
+
+// Per-account history, paged newest first on (createdAt, _id)
+createIndexSafely("account_entries", { "accountNumber": 1, "createdAt": -1, "_id": -1 }, {}, "accountNumber_createdAt_id");
+createIndexSafely("account_entries", { "accountNumber": 1, "direction": 1, "createdAt": -1, "_id": -1 }, {}, "accountNumber_direction_createdAt_id");
 
 // Notification indexes (optimized for sharded queries)
 createIndexSafely("notifications", { "userId": 1, "createdAt": -1 }, {}, "userId_createdAt");
 createIndexSafely("notifications", { "userId": 1, "delivered": 1 }, {}, "userId_delivered");
 createIndexSafely("notifications", { "userId": 1, "type": 1 }, {}, "userId_type");
 createIndexSafely("notifications", { "delivered": 1 }, {}, "delivered");
+// One notification per outbox message: concurrent redeliveries race on the upsert, so this must be unique
+db.notifications.getIndexes().forEach(function (idx) {
+    if (JSON.stringify(idx.key) === JSON.stringify({ "userId": 1, "messageId": 1 }) && !idx.unique) {
+        db.notifications.dropIndex(idx.name);
+        print(`  Dropped non-unique index on notifications: ${idx.name}`);
+    }
+});
+createIndexSafely("notifications", { "userId": 1, "messageId": 1 },
+    { unique: true, partialFilterExpression: { "messageId": { $exists: true } } }, "userId_messageId");
+
+// Transaction outbox (drained in _id order by the relay; sent messages expire after 7 days)
+createIndexSafely("outbox", { "status": 1, "_id": 1 }, {}, "status_id");
+createIndexSafely("outbox", { "sentAt": 1 }, { expireAfterSeconds: 604800 }, "sentAt_ttl");
+
+// Daily rollups (per account by day; the checkpointer looks for finished days without a closing balance)
+createIndexSafely("account_daily", { "accountNumber": 1, "day": 1 }, {}, "accountNumber_day");
+createIndexSafely("account_daily", { "day": 1, "closing": 1 }, {}, "day_closing");
+
+// Bulk transfer jobs and their row results, kept for 7 days
+createIndexSafely("bulk_jobs", { "userId": 1, "createdAt": -1 }, {}, "userId_createdAt");
+createIndexSafely("bulk_jobs", { "createdAt": 1 }, { expireAfterSeconds: 604800 }, "createdAt_ttl");
+createIndexSafely("bulk_results", { "jobId": 1, "row": 1 }, {}, "jobId_row");
+createIndexSafely("bulk_results", { "createdAt": 1 }, { expireAfterSeconds: 604800 }, "createdAt_ttl");
+
+// Scheduled transfers (the scheduler claims active ones by due time; users list their own)
+createIndexSafely("schedules", { "status": 1, "nextRunAt": 1 }, {}, "status_nextRunAt");
+createIndexSafely("schedules", { "userId": 1, "createdAt": -1 }, {}, "userId_createdAt");
+
+// Two-phase ledger entries (recovery worker looks for unfinished ones that stopped moving)
+createIndexSafely("ledger", { "status": 1, "updatedAt": 1 }, {}, "status_updatedAt");
+
+// Idempotency-Key records (_id is "<userId>:<key>"), kept for 24 hours
+createIndexSafely("idempotency", { "createdAt": 1 }, { expireAfterSeconds: 86400 }, "createdAt_ttl");
 
 print("\n=== Sharding Configuration Summary ===");
 print("┌─────────────────────────────────────────────────────┐");
@@ -257,6 +385,22 @@ print("│ banking.accounts                                    │");
 print("│   Shard Key: { accountNumber: 'hashed' }           │");
 print("│   Purpose: Distribute accounts evenly               │");
 print("│                                                     │");
+print("│ banking.account_buckets                             │");
+print("│   Shard Key: { bucketKey: 'hashed' }               │");
+print("│   Purpose: Spread balances of split hot accounts    │");
+print("│                                                     │");
+print("│ banking.account_entries                             │");
+print("│   Shard Key: { accountNumber: 'hashed', createdAt } │");
+print("│   Purpose: One-shard per-account history pages      │");
+print("│                                                     │");
+print("│ banking.bulk_results                                │");
+print("│   Shard Key: { jobId: 'hashed', row: 1 }           │");
+print("│   Purpose: Bulk job results read back in row order  │");
+print("│                                                     │");
+print("│ banking.schedules                                   │");
+print("│   Shard Key: { _id: 'hashed' }                     │");
+print("│   Purpose: Spread month-end claims over shards      │");
+print("│                                                     │");
 print("│ banking.transactions                                │");
 print("│   Shard Key: { txId: 'hashed' }                    │");
 print("│   Purpose: Distribute transactions evenly           │");
@@ -271,6 +415,9 @@ print("│ NON-SHARDED COLLECTIONS (Primary Shard)             │");
 print("├─────────────────────────────────────────────────────┤");
 print("│ banking.users                                       │");
 print("│   Reason: Small dataset, frequently joined          │");
+print("│                                                     │");
+print("│ banking.bulk_jobs                                   │");
+print("│   Reason: One small document per bulk file          │");
 print("└─────────────────────────────────────────────────────┘");
 print("\n=== Initialization Complete! ===\n");
 
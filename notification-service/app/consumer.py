@@ -1,7 +1,9 @@
 import os, pika, json, asyncio, time
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import DuplicateKeyError
 from datetime import datetime
 import threading
+from .cache import invalidate_cache, publish_event
 
 MONGO_URI = os.getenv("MONGO_URI", "mongodb://mongos:27017")
 
@@ -63,7 +65,32 @@ async def store_notification(data):
         "metadata": data.get("metadata", {})
     }
     
-    result = await notifications_collection.insert_one(notification_doc)
+    message_id = data.get("messageId")
+    if message_id:
+        # Outbox delivery is at-least-once: a redelivered message must not
+        # create a second notification
+        notification_doc["messageId"] = message_id
+        try:
+            result = await notifications_collection.update_one(
+                {"userId": notification_doc["userId"], "messageId": message_id},
+                {"$setOnInsert": notification_doc},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            # A concurrent redelivery inserted it first (unique userId_messageId index)
+            print(f"↩️ Duplicate notification {message_id} ignored")
+            return None
+        if result.upserted_id is None:
+            print(f"↩️ Duplicate notification {message_id} ignored")
+            return result
+    else:
+        result = await notifications_collection.insert_one(notification_doc)
+    
+    # Drop cached lists/counts so the new notification shows up immediately
+    user_id = data.get("userId")
+    invalidate_cache(f"notifications:user:{user_id}:*")
+    invalidate_cache(f"notifications:unread:user:{user_id}")
+    publish_event(user_id, ["notifications"])
     return result
 
 def callback(ch, method, properties, body):
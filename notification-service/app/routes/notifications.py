@@ -5,7 +5,7 @@ from bson import ObjectId
 from ..db import notifications
 from ..schemas import NotificationOut, NotificationSend
 from ..auth import verify_token
-from ..cache import cache, invalidate_cache
+from ..cache import cache, invalidate_cache, publish_event
 import datetime
 
 router = APIRouter(prefix="/api/notifications", tags=["notifications"])
@@ -138,6 +138,7 @@ async def mark_delivered(request: Request, notification_id: str, user=Depends(ve
     invalidate_cache(f"notification:id:{notification_id}")
     invalidate_cache(f"notifications:user:{user.get('user_id')}:*")
     invalidate_cache(f"notifications:unread:user:{user.get('user_id')}")
+    publish_event(user.get("user_id"), ["notifications"])
     
     return {"status": "success", "message": "Notification marked as delivered"}
 
@@ -174,6 +175,7 @@ async def mark_read(request: Request, notification_id: str, user=Depends(verify_
     invalidate_cache(f"notification:id:{notification_id}")
     invalidate_cache(f"notifications:user:{user.get('user_id')}:*")
     invalidate_cache(f"notifications:unread:user:{user.get('user_id')}")
+    publish_event(user.get("user_id"), ["notifications"])
     
     return {"status": "success", "message": "Notification marked as read"}
 
@@ -197,6 +199,7 @@ async def mark_all_read(request: Request, user=Depends(verify_token)):
     # Invalidate all notification caches for this user
     invalidate_cache(f"notifications:user:{user.get('user_id')}:*")
     invalidate_cache(f"notifications:unread:user:{user.get('user_id')}")
+    publish_event(user.get("user_id"), ["notifications"])
     
     return {
         "status": "success", 
@@ -226,6 +229,7 @@ async def delete_notification(request: Request, notification_id: str, user=Depen
     invalidate_cache(f"notification:id:{notification_id}")
     invalidate_cache(f"notifications:user:{user.get('user_id')}:*")
     invalidate_cache(f"notifications:unread:user:{user.get('user_id')}")
+    publish_event(user.get("user_id"), ["notifications"])
     
     return {"status": "success", "message": "Notification deleted"}
 
@@ -257,5 +261,6 @@ async def send_notification(request: Request, payload: NotificationSend, user=De
     # Invalidate user's notification caches
     invalidate_cache(f"notifications:user:{payload.userId}:*")
     invalidate_cache(f"notifications:unread:user:{payload.userId}")
+    publish_event(payload.userId, ["notifications"])
     
     return {"status": "success", "notification": notif}
\ No newline at end of file
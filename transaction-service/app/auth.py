@@ -1,13 +1,46 @@
 import os
 import jwt
+import base64
+import hashlib
+import hmac
+import time
 from fastapi import Header, HTTPException
 from typing import Optional
 
 JWT_SECRET = os.getenv("JWT_SECRET", "your_super_secret_jwt_key_change_in_production")
 ALGO = "HS256"
 
-async def verify_token(authorization: Optional[str] = Header(None)):
+# Shared with the API gateway, which signs the identity header after verifying the JWT
+INTERNAL_IDENTITY_SECRET = os.getenv("INTERNAL_IDENTITY_SECRET", JWT_SECRET).encode()
+
+def decode_identity(value: str) -> Optional[dict]:
+    """Validate the gateway identity header (user_id:role:exp:email:signature)"""
+    payload, _, sig = value.rpartition(":")
+    expected = hmac.new(INTERNAL_IDENTITY_SECRET, payload.encode(), hashlib.sha256).digest()
+    if not hmac.compare_digest(sig, base64.urlsafe_b64encode(expected).rstrip(b"=").decode()):
+        return None
+
+    try:
+        user_id, role, exp, email = payload.split(":", 3)
+        exp = int(exp)
+    except ValueError:
+        return None
+
+    if exp <= time.time():
+        return None
+    return {"user_id": user_id, "role": role, "email": email, "exp": exp}
+
+async def verify_token(
+    authorization: Optional[str] = Header(None),
+    x_internal_identity: Optional[str] = Header(None),
+):
     """Verify JWT token and return decoded payload"""
+    # Fast path: the gateway already verified the token
+    if x_internal_identity:
+        identity = decode_identity(x_internal_identity)
+        if identity:
+            return identity
+
     if not authorization:
         raise HTTPException(401, "Missing authorization header")
     
@@ -0,0 +1,67 @@
+"""
+Postings against split-balance accounts.
+
+An account flagged with `buckets: N` keeps its balance in N documents of
+`account_buckets` ("<accountNumber>:<i>", hashed on bucketKey) instead of on
+the account document; account-service splits accounts and sums them for
+reads. Inside the posting transaction:
+
+  - a credit goes to one random bucket, so concurrent credits to the account
+    land on different documents (and shards);
+  - a debit reserves from the fullest buckets first, each with a conditional
+    decrement (`balance >= take`), until the amount is covered. The
+    transaction makes the reservation all-or-nothing: if the buckets cannot
+    cover it the whole posting rolls back.
+
+The account document itself is only read, for its status and owner.
+"""
+from fastapi import HTTPException
+from .db import account_buckets
+import random
+
+
+def bucket_keys(account_number: str, buckets: int) -> list:
+    return [f"{account_number}:{i}" for i in range(buckets)]
+
+
+async def read_buckets(found: dict, session) -> dict:
+    """accountNumber -> bucket documents, for the split accounts in `found`"""
+    keys = [k for a in found.values() if a.get("buckets") for k in bucket_keys(a["accountNumber"], a["buckets"])]
+    split = {}
+    if keys:
+        async for b in account_buckets.find({"bucketKey": {"$in": keys}}, session=session):
+            split.setdefault(b["accountNumber"], []).append(b)
+    return split
+
+
+def total(buckets: list) -> float:
+    return sum(b.get("balance", 0) for b in buckets)
+
+
+async def apply(buckets: list, delta: float, session) -> float:
+    """Credit a random bucket or reserve a debit across buckets; returns the new total"""
+    if delta >= 0:
+        bucket = random.choice(buckets)
+        await account_buckets.update_one(
+            {"bucketKey": bucket["bucketKey"]}, {"$inc": {"balance": delta}}, session=session
+        )
+        bucket["balance"] = bucket.get("balance", 0) + delta
+        return total(buckets)
+
+    remaining = -delta
+    for bucket in sorted(buckets, key=lambda b: b.get("balance", 0), reverse=True):
+        take = min(bucket.get("balance", 0), remaining)
+        if take <= 0:
+            break
+        res = await account_buckets.update_one(
+            {"bucketKey": bucket["bucketKey"], "balance": {"$gte": take}},
+            {"$inc": {"balance": -take}},
+            session=session
+        )
+        if res.modified_count == 0:
+            raise HTTPException(409, "Account changed concurrently, please retry")
+        bucket["balance"] -= take
+        remaining -= take
+    if remaining > 0:
+        raise HTTPException(400, "Insufficient funds")
+    return total(buckets)
@@ -0,0 +1,321 @@
+"""
+Bulk transfers: a CSV or NDJSON file of transfers posted in one request.
+
+The request body is spooled first (memory, then a temporary file): a
+StreamingResponse listens for the client disconnecting while it runs, and
+that listener would swallow a body still being received. Rows are then read
+back one at a time and each is validated on its own (the fields of a single
+transfer: fromAccount, toAccount, amount, currency); a row that is not
+UTF-8, not JSON or missing a column gets its own error result.
+Valid rows are submitted to the posting engine, BULK_WINDOW rows at a time.
+The engine already queues postings per account, so a payroll file's rows
+pile up in the queue of its source account and are posted POSTING_BATCH_SIZE
+at a time, with one bulk_write and one Mongo transaction per batch.
+
+Results stream back as NDJSON, one line per row in file order ({"row": n,
+"status": "success" | "error", ...}), followed by a summary line. For files
+too large to wait on, ?async=true spools the body, returns a job id at
+once and keeps the results in `bulk_results` (see BulkJobs).
+
+With an Idempotency-Key header every row gets its own key ("<key>:<row>"),
+so a file that was cut off can be sent again: rows already posted are
+replayed instead of posted twice.
+"""
+from bson import ObjectId
+from collections import deque
+from fastapi import HTTPException
+from pydantic import ValidationError
+from typing import AsyncIterator
+from .db import bulk_jobs, bulk_results
+from .idempotency import Idempotency
+from .outbox import add_error, relay
+from .posting import Posting, posting_engine
+from .schemas import TransferIn
+from . import ids
+import asyncio
+import csv
+import datetime
+import json
+import os
+import tempfile
+
+BULK_WINDOW = int(os.getenv("BULK_WINDOW", 2000))  # rows submitted and not yet answered
+BULK_MAX_ROWS = int(os.getenv("BULK_MAX_ROWS", 1000000))
+BULK_SPOOL_MEMORY = int(os.getenv("BULK_SPOOL_MEMORY", 8 * 1024 * 1024))  # async jobs spill to disk beyond this
+BULK_RESULT_BATCH = int(os.getenv("BULK_RESULT_BATCH", 1000))
+
+MEDIA_TYPES = {"text/csv": "csv", "application/x-ndjson": "ndjson", "application/jsonl": "ndjson"}
+
+
+def format_of(content_type: str) -> str:
+    fmt = MEDIA_TYPES.get((content_type or "").split(";")[0].strip().lower())
+    if fmt is None:
+        raise HTTPException(415, f"Content-Type must be one of: {', '.join(MEDIA_TYPES)}")
+    return fmt
+
+
+async def lines(stream: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """Complete lines of a byte stream, undecoded; only each new chunk is split"""
+    partial = []  # pieces of the line still being received
+    async for chunk in stream:
+        *complete, rest = chunk.split(b"\n")
+        if complete:
+            complete[0] = b"".join(partial) + complete[0]
+            partial = []
+            for line in complete:
+                yield line.rstrip(b"\r")
+        if rest:
+            partial.append(rest)
+    last = b"".join(partial)
+    if last.strip():
+        yield last.rstrip(b"\r")
+
+
+async def records(stream: AsyncIterator[bytes], fmt: str) -> AsyncIterator[tuple]:
+    """(row number, dict) per data row, or (row number, error message) for rows that cannot be parsed"""
+    header = None
+    row = 0
+    async for raw in lines(stream):
+        if not raw.strip():
+            continue
+        try:
+            line = raw.decode("utf-8")
+        except UnicodeDecodeError as e:
+            if fmt == "csv" and header is None:
+                raise HTTPException(422, f"CSV header is not valid UTF-8: {e}")
+            row += 1
+            yield row, f"invalid UTF-8: {e}"
+            continue
+
+        if fmt == "csv":
+            values = next(csv.reader([line.lstrip("\ufeff")]))
+            if header is None:
+                header = [h.strip() for h in values]
+                continue
+            row += 1
+            if len(values) != len(header):
+                yield row, f"expected {len(header)} columns, got {len(values)}"
+                continue
+            # Empty cells fall back to the schema defaults
+            yield row, {k: v.strip() for k, v in zip(header, values) if v.strip()}
+        else:
+            row += 1
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield row, f"invalid JSON: {e}"
+                continue
+            yield row, record if isinstance(record, dict) else "expected a JSON object"
+
+
+def validate(record) -> TransferIn:
+    """The transfer of a row; raises HTTPException(422) when it is not one"""
+    if isinstance(record, str):
+        raise HTTPException(422, record)
+    try:
+        return TransferIn(**record)
+    except ValidationError as e:
+        raise HTTPException(422, "; ".join(
+            f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors()
+        ))
+
+
+class BulkRun:
+    """Posts the rows of one file and yields one result per row, in row order"""
+
+    def __init__(self, user: dict, key: str = None):
+        self.user = user
+        self.key = key
+        self.counters = {"rows": 0, "succeeded": 0, "failed": 0}
+
+    async def results(self, stream: AsyncIterator[bytes], fmt: str) -> AsyncIterator[dict]:
+        window = deque()
+        async for row, record in records(stream, fmt):
+            if row > BULK_MAX_ROWS:
+                window.append(asyncio.ensure_future(self.rejected(row, f"files are limited to {BULK_MAX_ROWS} rows")))
+                break
+            window.append(asyncio.ensure_future(self.post_row(row, record)))
+            if len(window) >= BULK_WINDOW:
+                yield await window.popleft()
+        while window:
+            yield await window.popleft()
+
+    def summary(self) -> dict:
+        return {"summary": self.counters}
+
+    async def rejected(self, row: int, detail: str) -> dict:
+        return self.result(row, HTTPException(422, detail))
+
+    def result(self, row: int, outcome) -> dict:
+        self.counters["rows"] += 1
+        if isinstance(outcome, HTTPException):
+            self.counters["failed"] += 1
+            return {"row": row, "status": "error", "code": outcome.status_code, "detail": outcome.detail}
+        self.counters["succeeded"] += 1
+        return {"row": row, **outcome}
+
+    async def post_row(self, row: int, record) -> dict:
+        try:
+            payload = validate(record)
+        except HTTPException as e:
+            return self.result(row, e)
+
+        idem = None
+        if self.key:
+            idem = Idempotency("bulk", self.user, f"{self.key}:{row}", payload.model_dump())
+            try:
+                await idem.begin()
+            except HTTPException as e:
+                return self.result(row, e)
+            if idem.replay is not None:
+                return self.result(row, {**json.loads(idem.replay.body), "replayed": True})
+
+        tx_id = ids.new_id("TXN")
+        try:
+            return self.result(row, await posting_engine.submit(Posting(
+                "TRANSFER", payload.fromAccount, payload.toAccount, payload.amount, payload.currency,
+                self.user, tx_id, idem=idem
+            )))
+        except HTTPException as e:
+            return self.result(row, e)
+        except Exception as e:
+            replay = await idem.recover(e) if idem else None
+            if replay is not None:
+                return self.result(row, {**json.loads(replay.body), "replayed": True})
+            print(f"⚠️ Bulk row {row} failed: {e}")
+            try:
+                await add_error({
+                    "txId": tx_id,
+                    "error": str(e),
+                    "type": "BULK_TRANSFER_FAILED",
+                    "timestamp": datetime.datetime.utcnow().isoformat(),
+                }, key=payload.fromAccount)
+                relay.wake()
+            except Exception:
+                pass
+            return self.result(row, HTTPException(500, f"Transfer failed: {e}"))
+        finally:
+            if idem:
+                idem.release()
+
+
+async def ndjson(results: AsyncIterator[dict], run: BulkRun) -> AsyncIterator[bytes]:
+    async for result in results:
+        yield (json.dumps(result, default=str) + "\n").encode()
+    yield (json.dumps(run.summary()) + "\n").encode()
+
+
+async def spool(stream: AsyncIterator[bytes]):
+    """The whole request body, in memory up to BULK_SPOOL_MEMORY and on disk beyond"""
+    file = tempfile.SpooledTemporaryFile(max_size=BULK_SPOOL_MEMORY)
+    async for chunk in stream:
+        file.write(chunk)
+    return file
+
+
+async def spooled(file, chunk_size: int = 64 * 1024) -> AsyncIterator[bytes]:
+    """Read a spooled body back; the file is closed once read (or abandoned)"""
+    try:
+        file.seek(0)
+        while True:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+    finally:
+        file.close()
+
+
+class BulkJobs:
+    """
+    Files posted in the background: the body is spooled (memory, then a
+    temporary file), the job is recorded in `bulk_jobs` and its results are
+    written to `bulk_results` BULK_RESULT_BATCH rows at a time, with the
+    job's counters. A job runs in the instance that received it; if that
+    instance stops, the job is left INTERRUPTED and the file can be sent
+    again with the same Idempotency-Key.
+    """
+
+    def __init__(self):
+        self.tasks = set()
+
+    async def create(self, stream: AsyncIterator[bytes], fmt: str, user: dict, key: str = None) -> dict:
+        file = await spool(stream)
+
+        now = datetime.datetime.utcnow()
+        job = {
+            "_id": ids.new_id("BULK"),
+            "userId": str(user.get("user_id")),
+            "format": fmt,
+            "status": "RUNNING",
+            "rows": 0,
+            "succeeded": 0,
+            "failed": 0,
+            "createdAt": now,
+            "updatedAt": now,
+        }
+        await bulk_jobs.insert_one(job)
+        task = asyncio.create_task(self.run(job["_id"], file, fmt, BulkRun(user, key)))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return job
+
+    async def run(self, job_id: str, file, fmt: str, run: BulkRun):
+        print(f"📦 Bulk job {job_id} started")
+        status, error = "DONE", None
+        try:
+            pending = []
+            async for result in run.results(spooled(file), fmt):
+                pending.append({"_id": ObjectId(), "jobId": job_id, "createdAt": datetime.datetime.utcnow(),
+                                **result})
+                if len(pending) >= BULK_RESULT_BATCH:
+                    await self.flush(job_id, pending, run)
+                    pending = []
+            await self.flush(job_id, pending, run)
+        except asyncio.CancelledError:
+            status = "INTERRUPTED"
+            raise
+        except Exception as e:
+            print(f"❌ Bulk job {job_id} failed: {e}")
+            status, error = "FAILED", str(e)
+        finally:
+            file.close()
+            await bulk_jobs.update_one({"_id": job_id}, {"$set": {
+                **run.counters, "status": status, "error": error,
+                "updatedAt": datetime.datetime.utcnow(), "finishedAt": datetime.datetime.utcnow(),
+            }})
+            print(f"📦 Bulk job {job_id} {status.lower()}: {run.counters}")
+
+    async def flush(self, job_id: str, results: list, run: BulkRun):
+        if results:
+            await bulk_results.insert_many(results, ordered=False)
+        await bulk_jobs.update_one({"_id": job_id}, {"$set": {**run.counters,
+                                                              "updatedAt": datetime.datetime.utcnow()}})
+
+    async def get(self, job_id: str, user: dict) -> dict:
+        job = await bulk_jobs.find_one({"_id": job_id})
+        if job is None:
+            raise HTTPException(404, "Bulk job not found")
+        if user.get("role") != "admin" and job["userId"] != str(user.get("user_id")):
+            raise HTTPException(403, "Forbidden")
+        job["jobId"] = job.pop("_id")
+        return job
+
+    async def results(self, job_id: str, after: int) -> AsyncIterator[bytes]:
+        cursor = bulk_results.find({"jobId": job_id, "row": {"$gt": after}},
+                                   {"_id": 0, "jobId": 0, "createdAt": 0}).sort("row", 1)
+        batch = []
+        async for doc in cursor.batch_size(BULK_RESULT_BATCH):
+            batch.append(json.dumps(doc, default=str) + "\n")
+            if len(batch) >= BULK_RESULT_BATCH:
+                yield "".join(batch).encode()
+                batch = []
+        if batch:
+            yield "".join(batch).encode()
+
+    async def stop(self):
+        for task in list(self.tasks):
+            task.cancel()
+
+
+job_runner = BulkJobs()
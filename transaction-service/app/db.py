@@ -5,4 +5,14 @@ MONGO_URI = os.getenv("MONGO_URI", "mongodb://mongos:27017")
 client = AsyncIOMotorClient(MONGO_URI)
 db = client.get_database("banking")
 accounts = db.accounts
-transactions = db.transactions
\ No newline at end of file
+transactions = db.transactions
+outbox = db.outbox
+leases = db.leases
+idempotency = db.idempotency
+account_buckets = db.account_buckets
+ledger = db.ledger
+account_entries = db.account_entries
+account_daily = db.account_daily
+bulk_jobs = db.bulk_jobs
+bulk_results = db.bulk_results
+schedules = db.schedules
@@ -0,0 +1,137 @@
+"""
+Streaming statement export.
+
+Rows come from a Mongo cursor with a bounded batch size and are encoded one
+batch at a time, so memory stays at about one batch however many rows are
+exported:
+
+  ndjson   one JSON object per line
+  csv      header line, then one line per row
+  parquet  one row group per batch (needs the optional pyarrow package)
+
+Each row is one account entry (see history.py): a transfer between two
+exported accounts appears once as a debit and once as a credit.
+"""
+from typing import AsyncIterator, Optional
+import csv
+import datetime
+import io
+import json
+import os
+
+try:
+    import pyarrow
+    import pyarrow.parquet as parquet
+except ImportError:
+    pyarrow = None
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", 1000))
+
+COLUMNS = ["createdAt", "accountNumber", "direction", "txId", "type", "fromAccount", "toAccount",
+           "amount", "currency", "status", "description"]
+PROJECTION = {c: 1 for c in COLUMNS}
+
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+def formats() -> list:
+    return [f for f in MEDIA_TYPES if f != "parquet" or pyarrow is not None]
+
+
+async def batches(cursor) -> AsyncIterator[list]:
+    """Rows of a Motor cursor, EXPORT_BATCH_SIZE at a time"""
+    batch = []
+    async for doc in cursor.batch_size(EXPORT_BATCH_SIZE):
+        batch.append([doc.get(c) for c in COLUMNS])
+        if len(batch) >= EXPORT_BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def encode_value(value):
+    return value.isoformat() if isinstance(value, datetime.datetime) else value
+
+
+async def ndjson(rows: AsyncIterator[list]) -> AsyncIterator[bytes]:
+    async for batch in rows:
+        yield "".join(
+            json.dumps(dict(zip(COLUMNS, map(encode_value, row))), default=str) + "\n" for row in batch
+        ).encode()
+
+
+async def csv_rows(rows: AsyncIterator[list]) -> AsyncIterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    async for batch in rows:
+        writer.writerows([list(map(encode_value, row)) for row in batch])
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()  # header of an empty export
+
+
+class ChunkSink(io.RawIOBase):
+    """Write-only file that hands back what was written since the last drain"""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self) -> bytes:
+        data, self.chunks = b"".join(self.chunks), []
+        return data
+
+
+async def parquet_rows(rows: AsyncIterator[list]) -> AsyncIterator[bytes]:
+    schema = pyarrow.schema([
+        ("createdAt", pyarrow.timestamp("ms")),
+        *[(c, pyarrow.string()) for c in COLUMNS[1:7]],
+        ("amount", pyarrow.float64()),
+        *[(c, pyarrow.string()) for c in COLUMNS[8:]],
+    ])
+    sink = ChunkSink()
+    writer = parquet.ParquetWriter(sink, schema)
+    async for batch in rows:
+        columns = list(zip(*batch))
+        writer.write_table(pyarrow.Table.from_arrays(
+            [pyarrow.array(col, type=field.type) for col, field in zip(columns, schema)], schema=schema
+        ))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+ENCODERS = {"ndjson": ndjson, "csv": csv_rows, "parquet": parquet_rows}
+
+
+def encode(fmt: str, cursor) -> AsyncIterator[bytes]:
+    return ENCODERS[fmt](batches(cursor))
+
+
+def date_range(start: Optional[datetime.date], end: Optional[datetime.date]) -> dict:
+    """createdAt clause for [start, end] in whole days"""
+    clause = {}
+    if start:
+        clause["$gte"] = datetime.datetime.combine(start, datetime.time.min)
+    if end:
+        clause["$lt"] = datetime.datetime.combine(end + datetime.timedelta(days=1), datetime.time.min)
+    return {"createdAt": clause} if clause else {}
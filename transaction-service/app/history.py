@@ -0,0 +1,77 @@
+"""
+Per-account transaction history with keyset pagination.
+
+`transactions` is sharded on hashed txId, so "the history of account X"
+scatters to every shard. Each posting therefore also writes one document per
+account leg to `account_entries`, sharded on accountNumber, so the history
+of an account lives on one shard and a page is a range scan of its
+(accountNumber, createdAt, _id) index.
+
+Pages are ordered newest first on (createdAt, _id) and continue from an
+opaque cursor, the position of the last entry returned, instead of an
+offset. Entry ids are "<txId>:debit" / "<txId>:credit", so writing an
+entry again (ledger recovery, the backfill) only hits a duplicate key.
+"""
+from bson import ObjectId
+from fastapi import HTTPException
+import base64
+import datetime
+import json
+
+CURSOR_HEADER = "X-Next-Cursor"
+
+
+def entries(tx: dict) -> list:
+    """The account_entries documents of a transaction document (one per account leg)"""
+    base = {k: v for k, v in tx.items() if k != "_id"}
+    base["transactionId"] = tx.get("_id")
+    legs = []
+    if tx.get("type") != "DEPOSIT":
+        legs.append(("debit", tx["fromAccount"]))
+    if tx.get("type") != "WITHDRAW":
+        legs.append(("credit", tx["toAccount"]))
+    return [
+        {**base, "_id": f"{tx['txId']}:{direction}", "accountNumber": number, "direction": direction}
+        for direction, number in legs
+    ]
+
+
+def encode_cursor(doc: dict) -> str:
+    position = [doc["createdAt"].isoformat(), str(doc["_id"]), isinstance(doc["_id"], ObjectId)]
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, _id, is_object_id = json.loads(raw)
+        return datetime.datetime.fromisoformat(created_at), ObjectId(_id) if is_object_id else _id
+    except Exception:
+        raise HTTPException(400, "Invalid cursor")
+
+
+def cursor_tx(cursor: str) -> str | None:
+    """txId of the entry a cursor points at (its other leg may open the next page)"""
+    _id = decode_cursor(cursor)[1]
+    return _id.rsplit(":", 1)[0] if isinstance(_id, str) else None
+
+
+def after(cursor: str | None) -> dict:
+    """Query clause for the entries that come after `cursor` in newest-first order"""
+    if not cursor:
+        return {}
+    created_at, _id = decode_cursor(cursor)
+    return {"$or": [
+        {"createdAt": {"$lt": created_at}},
+        {"createdAt": created_at, "_id": {"$lt": _id}},
+    ]}
+
+
+async def page(collection, query: dict, cursor: str | None, limit: int) -> tuple:
+    """One page newest first, and the cursor of the next page (None on the last one)"""
+    clause = after(cursor)
+    if clause:
+        query = {"$and": [query, clause]} if query else clause
+    docs = await collection.find(query).sort([("createdAt", -1), ("_id", -1)]).to_list(limit + 1)
+    next_cursor = encode_cursor(docs[limit - 1]) if len(docs) > limit else None
+    return docs[:limit], next_cursor
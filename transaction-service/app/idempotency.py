@@ -0,0 +1,132 @@
+"""
+Idempotency-Key support for money-moving endpoints.
+
+A request with an Idempotency-Key header is recorded in the `idempotency`
+collection together with its response. Idempotency only builds the record
+(see record()); the posting engine writes it. A batch's records are
+inserted by PostingEngine.record() with one insert_many inside the Mongo
+transaction that moves the money. With POSTING_MODE=ledger the record
+travels on the ledger entry, which is keyed by the idempotency id, and is
+written by finish() once the legs are applied (see ledger.py).
+
+A retry with the same key (per user) gets that response back from Redis or
+a single Mongo read, without posting again. Concurrent duplicates in the
+same process wait for the first attempt; across processes the unique _id
+(of the record, or of the ledger entry) makes the loser fail, after which
+it replays the winner's response.
+
+Reusing a key with a different request body is rejected with 422.
+"""
+from fastapi import Depends, HTTPException, Request
+from fastapi.responses import JSONResponse
+from pymongo.errors import DuplicateKeyError, PyMongoError
+from typing import Optional
+from .auth import verify_token
+from .cache import cache
+from .db import idempotency
+import asyncio
+import datetime
+import hashlib
+import json
+import os
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+# Records (and their Redis copies) are kept this long; see the TTL index in init-sharding.js
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", 24 * 3600))
+# How long a request that lost the race waits for the winner's commit
+IDEMPOTENCY_WAIT = float(os.getenv("IDEMPOTENCY_WAIT", 5.0))
+
+# (user, key) -> future resolved when the in-flight attempt finishes
+in_flight = {}
+
+
+class Idempotency:
+    def __init__(self, endpoint: str, user: dict, key: Optional[str], body):
+        self.endpoint = endpoint
+        self.key = key
+        self.id = f"{user.get('user_id')}:{key}" if key else None
+        self.request_hash = hashlib.sha256(
+            json.dumps([endpoint, body], sort_keys=True, default=str).encode()
+        ).hexdigest()
+        self.replay: Optional[JSONResponse] = None
+        self.future: Optional[asyncio.Future] = None
+
+    async def begin(self):
+        """Replay a finished request, or wait for an in-flight one, or claim the key"""
+        if not self.key:
+            return
+        while True:
+            self.replay = await self.lookup()
+            if self.replay is not None:
+                return
+            waiting = in_flight.get(self.id)
+            if waiting is None:
+                break
+            await asyncio.shield(waiting)
+
+        self.future = asyncio.get_running_loop().create_future()
+        in_flight[self.id] = self.future
+
+    def release(self):
+        if self.future is not None:
+            in_flight.pop(self.id, None)
+            self.future.set_result(None)
+            self.future = None
+
+    def record(self, response: dict) -> Optional[dict]:
+        """The idempotency document for this response (None without a key)"""
+        if not self.key:
+            return None
+        return {
+            "_id": self.id,
+            "endpoint": self.endpoint,
+            "requestHash": self.request_hash,
+            "response": response,
+            "createdAt": datetime.datetime.utcnow(),
+        }
+
+    async def recover(self, error: Exception) -> Optional[JSONResponse]:
+        """After a failed transaction: the response of a concurrent duplicate that won, if any"""
+        if not self.key:
+            return None
+        conflict = isinstance(error, DuplicateKeyError) or (
+            isinstance(error, PyMongoError) and error.has_error_label("TransientTransactionError")
+        )
+        deadline = asyncio.get_running_loop().time() + (IDEMPOTENCY_WAIT if conflict else 0)
+        while True:
+            replay = await self.lookup()
+            if replay is not None or asyncio.get_running_loop().time() >= deadline:
+                return replay
+            await asyncio.sleep(0.05)
+
+    async def lookup(self) -> Optional[JSONResponse]:
+        cache_key = f"idempotency:{self.id}"
+        record = cache.get(cache_key)
+        if record is None:
+            record = await idempotency.find_one({"_id": self.id})
+            if record is None:
+                return None
+            record = {"requestHash": record["requestHash"], "response": record["response"]}
+            cache.set(cache_key, record, ttl=IDEMPOTENCY_TTL)
+
+        if record["requestHash"] != self.request_hash:
+            raise HTTPException(422, f"{IDEMPOTENCY_HEADER} was already used for a different request")
+        return JSONResponse(record["response"], headers={"Idempotent-Replayed": "true"})
+
+
+def idempotent(endpoint: str):
+    """Dependency giving the route an Idempotency for this request (no-op without the header)"""
+    async def dependency(request: Request, user=Depends(verify_token)):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if key is not None and not 0 < len(key) <= IDEMPOTENCY_KEY_MAX_LENGTH:
+            raise HTTPException(400, f"{IDEMPOTENCY_HEADER} must be 1-{IDEMPOTENCY_KEY_MAX_LENGTH} characters")
+
+        idem = Idempotency(endpoint, user, key, await request.json() if key else None)
+        await idem.begin()
+        try:
+            yield idem
+        finally:
+            idem.release()
+
+    return dependency
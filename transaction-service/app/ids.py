@@ -0,0 +1,101 @@
+"""
+Time-ordered transaction ids.
+
+An id is a type prefix and 20 Crockford base32 characters ("TXN-01JA5Q...")
+encoding, from most to least significant:
+
+  48 bits  milliseconds since the Unix epoch
+  24 bits  node: NODE_ID, or derived from the host name and process id
+  24 bits  sequence: starts at a random value every millisecond, then counts up
+
+Ids of one process are strictly increasing, even when the clock steps back
+or more ids are needed in a millisecond than the sequence holds (the
+timestamp then runs a little ahead of the clock). Ids from different
+processes sort by millisecond, then node. Since the encoding has a fixed
+width, string order is time order: a range of txIds is a range of time (see
+bounds), and inserts into the txId index land at its right edge instead of
+at random pages. Ids issued before this scheme ("TXN-<12 hex>") carry no
+time; a range scan over older data has to skip them by length.
+"""
+import datetime
+import hashlib
+import os
+import random
+import threading
+import time
+
+ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"  # Crockford base32
+LENGTH = 20  # 96 bits in 5-bit characters (the top 4 bits are always 0)
+
+TIME_BITS, NODE_BITS, SEQUENCE_BITS = 48, 24, 24
+SEQUENCE_MAX = (1 << SEQUENCE_BITS) - 1
+
+
+def default_node() -> int:
+    node = os.getenv("NODE_ID")
+    if node is not None:
+        return int(node) & ((1 << NODE_BITS) - 1)
+    seed = f"{os.getenv('HOSTNAME', 'transaction-service')}:{os.getpid()}".encode()
+    return int.from_bytes(hashlib.sha256(seed).digest()[:3], "big")
+
+
+# Two characters (10 bits) per lookup: ids are made on every posting
+PAIRS = [a + b for a in ALPHABET for b in ALPHABET]
+PAIR_SHIFTS = tuple(range(5 * LENGTH - 10, -1, -10))
+
+
+def encode(value: int) -> str:
+    return "".join([PAIRS[(value >> shift) & 1023] for shift in PAIR_SHIFTS])
+
+
+def decode(text: str) -> int:
+    value = 0
+    for char in text.upper():
+        value = value * 32 + ALPHABET.index(char)
+    return value
+
+
+class IdGenerator:
+    def __init__(self, node: int = None):
+        self.node = default_node() if node is None else node
+        self.last_ms = 0
+        self.sequence = 0
+        self.lock = threading.Lock()  # scripts and benchmarks generate from threads
+
+    def next_value(self) -> int:
+        with self.lock:
+            now = int(time.time() * 1000)
+            if now > self.last_ms:
+                self.last_ms = now
+                # Random start leaves at least half the space to count up in
+                self.sequence = random.getrandbits(SEQUENCE_BITS - 1)
+            elif self.sequence < SEQUENCE_MAX:
+                self.sequence += 1
+            else:
+                self.last_ms += 1
+                self.sequence = 0
+            return (self.last_ms << (NODE_BITS + SEQUENCE_BITS)) | (self.node << SEQUENCE_BITS) | self.sequence
+
+    def new_id(self, prefix: str) -> str:
+        return f"{prefix}-{encode(self.next_value())}"
+
+
+generator = IdGenerator()
+
+
+def new_id(prefix: str) -> str:
+    return generator.new_id(prefix)
+
+
+def timestamp(tx_id: str) -> datetime.datetime:
+    """UTC creation time of an id"""
+    value = decode(tx_id.rsplit("-", 1)[-1])
+    return datetime.datetime.utcfromtimestamp((value >> (NODE_BITS + SEQUENCE_BITS)) / 1000)
+
+
+def bounds(prefix: str, start: datetime.datetime, end: datetime.datetime) -> dict:
+    """txId clause for ids of this prefix created in [start, end) (naive UTC datetimes)"""
+    def at(ts: datetime.datetime) -> str:
+        ms = int(ts.replace(tzinfo=datetime.timezone.utc).timestamp() * 1000)
+        return f"{prefix}-{encode(ms << (NODE_BITS + SEQUENCE_BITS))}"
+    return {"$gte": at(start), "$lt": at(end)}
@@ -0,0 +1,266 @@
+"""
+Two-phase ledger posting without distributed transactions (POSTING_MODE=ledger).
+
+`accounts` is hashed on accountNumber, so the two legs of a transfer usually
+live on different shards and the default posting path pays for a
+cross-shard transaction. In ledger mode a posting is instead:
+
+  1. an entry in the `ledger` collection, written once in PENDING state with
+     everything needed to finish it (transaction document, outbox messages);
+  2. the debit, then the credit, each a single-document conditional update
+     that also pushes the entry id onto the account's `pendingTx`, so a leg
+     can be told apart from one that was never applied and is never
+     applied twice;
+  3. the transaction, history, outbox and idempotency documents, inserted
+     with their ids from the entry (so repeating them only hits duplicate
+     keys), after which the markers are pulled and the entry is POSTED.
+
+Each step moves the entry along PENDING -> DEBITED -> CREDITED -> POSTED with
+a conditional update on its status. A credit that cannot be applied
+(account missing or not active) is compensated: CANCELLING, the debit is
+refunded, FAILED.
+
+The recovery worker picks up entries that have not moved for
+LEDGER_RECOVERY_AFTER seconds (a crashed or stuck request) and completes
+them from their current state, or compensates them. That window must be
+longer than any live request takes, as the live path and the worker do not
+otherwise coordinate. Split-balance accounts keep using the transactional
+path.
+"""
+from fastapi import HTTPException
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from .db import accounts, transactions, account_entries, outbox, idempotency, ledger
+from . import history, rollups
+import asyncio
+import datetime
+import os
+
+LEDGER_RECOVERY_AFTER = float(os.getenv("LEDGER_RECOVERY_AFTER", 30.0))
+LEDGER_RECOVERY_INTERVAL = float(os.getenv("LEDGER_RECOVERY_INTERVAL", 5.0))
+LEDGER_RECOVERY_BATCH = int(os.getenv("LEDGER_RECOVERY_BATCH", 100))
+
+PENDING, DEBITED, CREDITED, POSTED = "PENDING", "DEBITED", "CREDITED", "POSTED"
+CANCELLING, FAILED = "CANCELLING", "FAILED"
+
+
+class LedgerPoster:
+    def __init__(self):
+        self.task = None
+        self.counters = {"posted": 0, "failed": 0, "compensated": 0, "recovered": 0}
+
+    # ==================== Live path ====================
+
+    async def post(self, p, found: dict) -> dict:
+        """Post `p` leg by leg; `found` are the accounts read up front (for checks and notifications)"""
+        balances = {n: a.get("balance", 0) for n, a in found.items()}
+        error = p.check(found, balances)
+        if error:
+            raise error
+
+        p.doc = p.tx_doc()
+        entry = self.entry(p, found)
+        # Keyed requests use the idempotency id, so a concurrent duplicate fails here
+        try:
+            await ledger.insert_one(entry)
+        except DuplicateKeyError:
+            # ...but a retry of an attempt that failed may run again
+            if not await ledger.find_one_and_replace({"_id": entry["_id"], "status": FAILED}, entry):
+                raise
+
+        if p.debit:
+            a_from = await self.apply_leg(entry, p.debit, -p.amount, p.owner_filter())
+            if a_from is None:
+                await self.transition(entry, PENDING, FAILED, error="debit rejected")
+                self.counters["failed"] += 1
+                raise await self.rejection(p)
+            balances[p.debit] = a_from["balance"]
+        await self.transition(entry, PENDING, DEBITED)
+
+        if p.credit:
+            a_to = await self.apply_leg(entry, p.credit, p.amount, p.owner_filter() if not p.debit else {})
+            if a_to is None:
+                error = await self.rejection(p, debited=True)
+                await self.compensate(entry, DEBITED, reason=error.detail)
+                raise error
+            balances[p.credit] = a_to["balance"]
+
+        p.result = p.response(balances)
+        opening = {}
+        if p.debit:
+            opening[p.debit] = balances[p.debit] + p.amount
+        if p.credit:
+            opening[p.credit] = balances[p.credit] - p.amount
+        await self.transition(entry, DEBITED, CREDITED, response=p.result, opening=opening)
+        await self.finish(entry)
+        return p.result
+
+    def entry(self, p, found: dict) -> dict:
+        now = datetime.datetime.utcnow()
+        return {
+            "_id": p.idem.id if p.idem and p.idem.key else p.tx_id,
+            "txId": p.tx_id,
+            "status": PENDING,
+            "debit": p.debit,
+            "credit": p.credit,
+            "amount": p.amount,
+            "tx": p.doc,
+            "outbox": p.notifications(found),
+            "idempotency": p.idem.record(None) if p.idem else None,
+            "createdAt": now,
+            "updatedAt": now,
+        }
+
+    async def apply_leg(self, entry: dict, number: str, delta: float, owner: dict):
+        """One conditional, marked $inc on an account; None if it did not apply"""
+        condition = {"balance": {"$gte": -delta}} if delta < 0 else {}
+        return await accounts.find_one_and_update(
+            {"accountNumber": number, "status": "active", "buckets": {"$exists": False},
+             "pendingTx": {"$ne": entry["_id"]}, **condition, **owner},
+            {"$inc": {"balance": delta}, "$push": {"pendingTx": entry["_id"]}},
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def rejection(self, p, debited: bool = False) -> HTTPException:
+        found = {}
+        async for a in accounts.find({"accountNumber": {"$in": [n for n in (p.debit, p.credit) if n]}}):
+            found[a["accountNumber"]] = a
+        balances = {n: a.get("balance", 0) for n, a in found.items()}
+        if debited and p.debit in balances:
+            balances[p.debit] += p.amount
+        return p.check(found, balances) or HTTPException(409, "Account changed concurrently, please retry")
+
+    async def transition(self, entry: dict, current: str, new: str, **fields) -> bool:
+        res = await ledger.update_one(
+            {"_id": entry["_id"], "status": current},
+            {"$set": {"status": new, "updatedAt": datetime.datetime.utcnow(), **fields}}
+        )
+        if res.modified_count:
+            entry.update(status=new, **fields)
+        return bool(res.modified_count)
+
+    # ==================== Completion and compensation ====================
+
+    async def finish(self, entry: dict):
+        """CREDITED -> POSTED: side documents, then the account markers"""
+        await insert_ignoring_duplicates(transactions, [entry["tx"]])
+        await insert_ignoring_duplicates(account_entries, history.entries(entry["tx"]))
+        # $inc cannot be repeated safely: flag first, so a crash here loses the rollup rather than doubling it
+        flagged = await ledger.update_one(
+            {"_id": entry["_id"], "status": CREDITED, "rolledUp": {"$ne": True}}, {"$set": {"rolledUp": True}}
+        )
+        if flagged.modified_count:
+            await rollups.apply([entry["tx"]], entry.get("opening") or {}, {})
+        await insert_ignoring_duplicates(outbox, entry["outbox"])
+        if entry.get("idempotency"):
+            record = {**entry["idempotency"], "response": entry.get("response")}
+            await insert_ignoring_duplicates(idempotency, [record])
+
+        await self.clear_markers(entry)
+        if await self.transition(entry, CREDITED, POSTED, postedAt=datetime.datetime.utcnow()):
+            self.counters["posted"] += 1
+
+    async def compensate(self, entry: dict, current: str, reason: str):
+        """Refund an applied debit and fail the entry"""
+        if await self.transition(entry, current, CANCELLING, error=reason):
+            await self.refund(entry)
+
+    async def refund(self, entry: dict):
+        """CANCELLING -> FAILED; the marker makes the refund happen at most once"""
+        if entry.get("debit"):
+            await accounts.update_one(
+                {"accountNumber": entry["debit"], "pendingTx": entry["_id"]},
+                {"$inc": {"balance": entry["amount"]}, "$pull": {"pendingTx": entry["_id"]}}
+            )
+        if await self.transition(entry, CANCELLING, FAILED):
+            self.counters["compensated"] += 1
+
+    async def clear_markers(self, entry: dict):
+        numbers = [n for n in (entry.get("debit"), entry.get("credit")) if n]
+        await accounts.update_many(
+            {"accountNumber": {"$in": numbers}, "pendingTx": entry["_id"]},
+            {"$pull": {"pendingTx": entry["_id"]}}
+        )
+
+    async def applied(self, entry: dict, number: str) -> bool:
+        return await accounts.find_one({"accountNumber": number, "pendingTx": entry["_id"]}, {"_id": 1}) is not None
+
+    # ==================== Recovery worker ====================
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+
+    async def run(self):
+        print("✅ Ledger recovery worker started")
+        while True:
+            try:
+                await self.recover()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"⚠️ Ledger recovery error: {e}")
+            await asyncio.sleep(LEDGER_RECOVERY_INTERVAL)
+
+    async def recover(self):
+        """Complete or compensate entries that stopped moving"""
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=LEDGER_RECOVERY_AFTER)
+        stuck = await ledger.find(
+            {"status": {"$in": [PENDING, DEBITED, CREDITED, CANCELLING]}, "updatedAt": {"$lt": cutoff}}
+        ).to_list(LEDGER_RECOVERY_BATCH)
+
+        for entry in stuck:
+            if not await self.claim(entry):
+                continue
+            self.counters["recovered"] += 1
+            print(f"🔧 Recovering ledger entry {entry['_id']} ({entry['status']})")
+
+            if entry["status"] == PENDING:
+                if entry.get("debit") and not await self.applied(entry, entry["debit"]):
+                    await self.transition(entry, PENDING, FAILED, error="abandoned before debit")
+                    self.counters["failed"] += 1
+                    continue
+                await self.transition(entry, PENDING, DEBITED)
+
+            if entry["status"] == DEBITED:
+                credit = entry.get("credit")
+                if credit and not await self.applied(entry, credit) and \
+                        await self.apply_leg(entry, credit, entry["amount"], {}) is None:
+                    await self.compensate(entry, DEBITED, reason="credit rejected during recovery")
+                    continue
+                await self.transition(entry, DEBITED, CREDITED,
+                                      response={"status": "success", "txId": entry["txId"]})
+
+            if entry["status"] == CANCELLING:
+                await self.refund(entry)
+            elif entry["status"] == CREDITED:
+                await self.finish(entry)
+
+    async def claim(self, entry: dict) -> bool:
+        """Touch a stuck entry; another worker that read it at the same time loses this update"""
+        now = datetime.datetime.utcnow()
+        res = await ledger.update_one(
+            {"_id": entry["_id"], "status": entry["status"], "updatedAt": entry["updatedAt"]},
+            {"$set": {"updatedAt": now}}
+        )
+        entry["updatedAt"] = now
+        return bool(res.modified_count)
+
+
+async def insert_ignoring_duplicates(collection, docs: list):
+    """Insert documents that may already be there from an earlier attempt"""
+    if not docs:
+        return
+    try:
+        await collection.insert_many(docs, ordered=False)
+    except DuplicateKeyError:
+        pass
+    except BulkWriteError as e:
+        if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+            raise
+
+
+ledger_poster = LedgerPoster()
@@ -0,0 +1,260 @@
+"""
+Per-account and per-user velocity limits on money leaving an account.
+
+Every withdrawal and transfer by a non-admin user is charged, before it is
+posted, against two sliding-window counters in Redis: one for the account
+debited ("limits:account:<n>") and one for the user ("limits:user:<id>").
+The account counter is only charged when the user owns the account (see
+ownership.py); anyone else's attempt counts against their own user counter
+alone, so a stranger cannot use up an account's window.
+Each counter is a hash of per-bucket totals ("a:<bucket>" amount,
+"c:<bucket>" count) over the last LIMIT_WINDOW seconds in buckets of
+LIMIT_BUCKET seconds. One Lua script sums the buckets still in the window,
+drops older ones, and either refuses the posting or charges it to both
+counters, so the check and the charge are atomic and cost a single round
+trip with no Mongo read. A posting that is then rejected or fails has its
+charge released.
+
+A limit of 0 is no limit; the counters are kept either way, so a limit can
+be switched on without waiting for the window to fill.
+
+After Redis loses its data the script finds "limits:ready" missing: it
+still charges postings, but refuses none, and records when this started
+("limits:since"). One instance then rebuilds the counters from the debit
+entries in account_entries created before that moment and sets
+"limits:ready" again. Until then, and whenever Redis cannot be reached,
+the limits fail open.
+"""
+from fastapi import HTTPException
+from redis.exceptions import RedisError
+from .cache import cache
+from .db import accounts, account_entries
+from .ownership import ownership
+import redis.asyncio as aioredis
+import asyncio
+import datetime
+import os
+import time
+
+LIMIT_WINDOW = int(os.getenv("LIMIT_WINDOW", 24 * 3600))
+LIMIT_BUCKET = int(os.getenv("LIMIT_BUCKET", 3600))
+LIMIT_ACCOUNT_AMOUNT = float(os.getenv("LIMIT_ACCOUNT_AMOUNT", 0))
+LIMIT_ACCOUNT_COUNT = int(os.getenv("LIMIT_ACCOUNT_COUNT", 0))
+LIMIT_USER_AMOUNT = float(os.getenv("LIMIT_USER_AMOUNT", 0))
+LIMIT_USER_COUNT = int(os.getenv("LIMIT_USER_COUNT", 0))
+
+READY_KEY, SINCE_KEY, REBUILD_LOCK = "limits:ready", "limits:since", "limits:rebuilding"
+BUCKETS = -(-LIMIT_WINDOW // LIMIT_BUCKET)
+
+# KEYS: ready, since, counter hashes...   ARGV: bucket, buckets in window, amount, ttl, now,
+# then (max amount, max count) per counter hash
+CHARGE = """
+local bucket = tonumber(ARGV[1])
+local oldest = bucket - tonumber(ARGV[2]) + 1
+local amount = tonumber(ARGV[3])
+local warm = redis.call('EXISTS', KEYS[1]) == 1
+if not warm then
+  redis.call('SET', KEYS[2], ARGV[5], 'NX')
+end
+for i = 3, #KEYS do
+  local fields = redis.call('HGETALL', KEYS[i])
+  local total, count, stale = 0, 0, {}
+  for j = 1, #fields, 2 do
+    local kind, b = string.match(fields[j], '^(%a):(%d+)$')
+    if tonumber(b) < oldest then
+      stale[#stale + 1] = fields[j]
+    elseif kind == 'a' then
+      total = total + tonumber(fields[j + 1])
+    else
+      count = count + tonumber(fields[j + 1])
+    end
+  end
+  if #stale > 0 then
+    redis.call('HDEL', KEYS[i], unpack(stale))
+  end
+  local max_amount = tonumber(ARGV[6 + (i - 3) * 2])
+  local max_count = tonumber(ARGV[7 + (i - 3) * 2])
+  if warm and max_amount > 0 and total + amount > max_amount then
+    return {'amount', KEYS[i], tostring(total)}
+  end
+  if warm and max_count > 0 and count + 1 > max_count then
+    return {'count', KEYS[i], tostring(count)}
+  end
+end
+for i = 3, #KEYS do
+  redis.call('HINCRBYFLOAT', KEYS[i], 'a:' .. bucket, amount)
+  redis.call('HINCRBY', KEYS[i], 'c:' .. bucket, 1)
+  redis.call('EXPIRE', KEYS[i], ARGV[4])
+end
+if warm then
+  return {'ok'}
+end
+return {'cold'}
+"""
+
+# KEYS: counter hashes   ARGV: bucket, amount
+RELEASE = """
+for i = 1, #KEYS do
+  if redis.call('HEXISTS', KEYS[i], 'c:' .. ARGV[1]) == 1 then
+    redis.call('HINCRBYFLOAT', KEYS[i], 'a:' .. ARGV[1], -tonumber(ARGV[2]))
+    redis.call('HINCRBY', KEYS[i], 'c:' .. ARGV[1], -1)
+  end
+end
+return 1
+"""
+
+
+def account_key(number: str) -> str:
+    return f"limits:account:{number}"
+
+
+def user_key(user_id) -> str:
+    return f"limits:user:{user_id}"
+
+
+class Charge:
+    """A posting's charge against its counters, to release if the posting does not go through"""
+
+    def __init__(self, keys: list, bucket: int, amount: float):
+        self.keys = keys
+        self.bucket = bucket
+        self.amount = amount
+
+
+class Limits:
+    def __init__(self):
+        self.client = None
+        self.scripts = None
+        self.rebuilding = None
+        self.counters = {"charged": 0, "refused": 0, "released": 0, "failed_open": 0, "rebuilds": 0}
+
+    def load(self):
+        """Scripts on an asyncio client of the cache's Redis; None while Redis is not connected"""
+        if self.scripts is None and cache.redis_client is not None:
+            self.client = aioredis.Redis(host=cache.redis_host, port=cache.redis_port, decode_responses=True,
+                                         socket_connect_timeout=5, socket_timeout=5)
+            self.scripts = (self.client.register_script(CHARGE), self.client.register_script(RELEASE))
+        return self.scripts
+
+    async def charge(self, p):
+        """Charge a posting to its counters; raises HTTPException(429) over a limit, None when not charged"""
+        if not p.debit or p.is_admin:
+            return None
+        scripts = self.load()
+        if scripts is None:
+            self.counters["failed_open"] += 1
+            return None
+
+        now = time.time()
+        bucket = int(now // LIMIT_BUCKET)
+        user_id = p.user.get("user_id")
+        keys = [user_key(user_id)]
+        maxima = [LIMIT_USER_AMOUNT, LIMIT_USER_COUNT]
+        if await ownership.owns_any(user_id, [p.debit]):
+            keys.insert(0, account_key(p.debit))
+            maxima[:0] = [LIMIT_ACCOUNT_AMOUNT, LIMIT_ACCOUNT_COUNT]
+        try:
+            result = await scripts[0](
+                keys=[READY_KEY, SINCE_KEY, *keys],
+                args=[bucket, BUCKETS, p.amount, LIMIT_WINDOW + LIMIT_BUCKET, now, *maxima],
+            )
+        except RedisError as e:
+            print(f"⚠️ Limits unavailable, allowing {p.tx_id}: {e}")
+            self.counters["failed_open"] += 1
+            return None
+
+        if result[0] == "cold":
+            self.counters["failed_open"] += 1
+            self.start_rebuild()
+        elif result[0] != "ok":
+            self.counters["refused"] += 1
+            kind, key, _ = result
+            scope = "account" if key.startswith("limits:account:") else "user"
+            hours = LIMIT_WINDOW / 3600
+            if kind == "amount":
+                limit = LIMIT_ACCOUNT_AMOUNT if scope == "account" else LIMIT_USER_AMOUNT
+                detail = f"Limit exceeded: {scope} may move at most {limit:g} per {hours:g}h"
+            else:
+                limit = LIMIT_ACCOUNT_COUNT if scope == "account" else LIMIT_USER_COUNT
+                detail = f"Limit exceeded: {scope} may make at most {limit} debits per {hours:g}h"
+            raise HTTPException(429, detail, headers={"Retry-After": str(LIMIT_BUCKET)})
+
+        self.counters["charged"] += 1
+        return Charge(keys, bucket, p.amount)
+
+    async def release(self, charge):
+        if charge is None or self.scripts is None:
+            return
+        try:
+            await self.scripts[1](keys=charge.keys, args=[charge.bucket, charge.amount])
+            self.counters["released"] += 1
+        except RedisError as e:
+            print(f"⚠️ Could not release limit charge: {e}")
+
+    # ==================== Rebuild ====================
+
+    def start_rebuild(self):
+        if self.rebuilding is None or self.rebuilding.done():
+            self.rebuilding = asyncio.create_task(self.rebuild())
+
+    async def rebuild(self):
+        """Recount the window before `limits:since` from account_entries (one instance at a time)"""
+        client = self.client
+        try:
+            if not await client.set(REBUILD_LOCK, "1", nx=True, ex=600):
+                return
+            since = float(await client.get(SINCE_KEY) or time.time())
+            start = (int(since // LIMIT_BUCKET) - BUCKETS + 1) * LIMIT_BUCKET
+            print(f"🔄 Rebuilding limit counters from {datetime.datetime.utcfromtimestamp(start)}")
+
+            totals = {}  # (accountNumber, bucket) -> [amount, count]
+            async for g in account_entries.aggregate([
+                {"$match": {"direction": "debit", "createdAt": {
+                    "$gte": datetime.datetime.utcfromtimestamp(start),
+                    "$lt": datetime.datetime.utcfromtimestamp(since)}}},
+                {"$group": {
+                    "_id": {"accountNumber": "$accountNumber", "bucket": {"$floor": {"$divide": [
+                        {"$toLong": "$createdAt"}, LIMIT_BUCKET * 1000]}}},
+                    "amount": {"$sum": "$amount"},
+                    "count": {"$sum": 1},
+                }},
+            ], allowDiskUse=True):
+                totals[(g["_id"]["accountNumber"], int(g["_id"]["bucket"]))] = [g["amount"], g["count"]]
+
+            owners = {}
+            numbers = list({n for n, _ in totals})
+            async for a in accounts.find({"accountNumber": {"$in": numbers}}, {"accountNumber": 1, "userId": 1}):
+                owners[a["accountNumber"]] = str(a["userId"])
+
+            counters = {}  # (counter key, bucket) -> [amount, count], a user's accounts summed
+            for (number, bucket), (amount, count) in totals.items():
+                keys = [account_key(number)] + ([user_key(owners[number])] if number in owners else [])
+                for key in keys:
+                    c = counters.setdefault((key, bucket), [0, 0])
+                    c[0] += amount
+                    c[1] += count
+
+            # The bucket holding `since` also has live charges: add to it, overwrite the rest
+            since_bucket = int(since // LIMIT_BUCKET)
+            pipe = client.pipeline(transaction=False)
+            for (key, bucket), (amount, count) in counters.items():
+                if bucket == since_bucket:
+                    pipe.hincrbyfloat(key, f"a:{bucket}", amount)
+                    pipe.hincrby(key, f"c:{bucket}", count)
+                else:
+                    pipe.hset(key, mapping={f"a:{bucket}": amount, f"c:{bucket}": count})
+                pipe.expire(key, LIMIT_WINDOW + LIMIT_BUCKET)
+            pipe.set(READY_KEY, "1")
+            pipe.delete(SINCE_KEY, REBUILD_LOCK)
+            await pipe.execute()
+            self.counters["rebuilds"] += 1
+            print(f"✅ Limit counters rebuilt ({len(totals)} account buckets)")
+        except Exception as e:
+            print(f"⚠️ Limit counter rebuild failed: {e}")
+            try:
+                await client.delete(REBUILD_LOCK)
+            except Exception:
+                pass
+
+
+limits = Limits()
@@ -5,6 +5,16 @@ from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
 from .routes import transactions
 from .cache import cache
+from .publisher import publisher
+from .outbox import relay
+from .ledger import ledger_poster
+from .ownership import ownership
+from .rollups import checkpointer
+from .posting import POSTING_MODE, posting_engine
+from .txrunner import txrunner
+from .bulk import job_runner
+from .scheduler import scheduler
+from .limits import limits
 import os
 
 # Initialize rate limiter
@@ -28,10 +38,28 @@ app.add_middleware(
 # Startup event
 @app.on_event("startup")
 async def startup_event():
+    await publisher.start()
+    relay.start()
+    # Also in transaction mode, to finish entries left over from ledger mode
+    ledger_poster.start()
+    ownership.start()
+    checkpointer.start()
+    scheduler.start()
     print("✓ Transaction Service started")
     print(f"  - MongoDB: {os.getenv('MONGO_URI', 'Not configured')}")
     print(f"  - Redis Cache: {'✓ Connected' if cache.is_connected() else '✗ Disconnected'}")
     print(f"  - RabbitMQ: {os.getenv('RABBITMQ_HOST', 'Not configured')}")
+    print(f"  - Posting mode: {POSTING_MODE}")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await scheduler.stop()
+    await job_runner.stop()
+    await checkpointer.stop()
+    await ownership.stop()
+    await ledger_poster.stop()
+    await relay.stop()
+    await publisher.stop()
 
 # Health check
 @app.get("/")
@@ -40,7 +68,24 @@ def root():
     return {
         "message": "Transaction service running 💸",
         "status": "healthy",
-        "redis": cache.is_connected()
+        "redis": cache.is_connected(),
+        "rabbitmq": publisher.is_connected()
+    }
+
+# Counters of the posting pipeline and background workers
+@app.get("/stats")
+@limiter.exempt
+def stats():
+    return {
+        "transactions": txrunner.snapshot(),
+        "posting": posting_engine.counters,
+        "publisher": publisher.counters,
+        "relay": relay.counters,
+        "ledger": ledger_poster.counters,
+        "checkpointer": checkpointer.counters,
+        "scheduler": scheduler.counters,
+        "ownership": ownership.counters,
+        "limits": limits.counters,
     }
 
 # Include routers
@@ -0,0 +1,156 @@
+"""
+Transactional outbox for notification and error events.
+
+Route handlers insert messages into the `outbox` collection inside the same
+Mongo transaction as the balance change, so a committed transaction always
+has its notifications and a rolled-back one never does. The relay drains the
+outbox to RabbitMQ in the background:
+
+  - only the holder of the relay lease drains, so several service instances
+    can run it without publishing the same batch twice;
+  - messages are read in `_id` (creation) order and published in waves of at
+    most one message per account, so each account's messages are confirmed
+    by the broker in order. A failed message holds back the rest of its
+    account until the next pass;
+  - a message is marked sent only after the broker confirmed it, so delivery
+    is at-least-once. Each message carries a messageId for the consumer to
+    de-duplicate on.
+"""
+from collections import OrderedDict
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+from .db import outbox, leases
+from .publisher import publisher
+import asyncio
+import datetime
+import os
+import uuid
+
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", 200))
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", 1.0))
+OUTBOX_LEASE_SECONDS = float(os.getenv("OUTBOX_LEASE_SECONDS", 10.0))
+OUTBOX_PUBLISH_TIMEOUT = float(os.getenv("OUTBOX_PUBLISH_TIMEOUT", 5.0))
+
+
+def outbox_doc(queue: str, key: str, message: dict, priority: int = 0) -> dict:
+    _id = ObjectId()
+    return {
+        "_id": _id,
+        "queue": queue,
+        "key": key,
+        "message": {**message, "messageId": str(_id)},
+        "priority": priority,
+        "status": "pending",
+        "createdAt": datetime.datetime.utcnow(),
+    }
+
+
+def notification_doc(message: dict, key: str, queue="notifications", priority: str = "normal") -> dict:
+    """Outbox document for a notification about account `key`"""
+    message = {"priority": priority, "channel": "in-app", **message}
+    return outbox_doc(queue, key, message, 1 if message["priority"] == "high" else 0)
+
+
+async def add_message(queue: str, key: str, message: dict, priority: int = 0, session=None):
+    """Queue a message for the relay; pass the transaction's session to commit it atomically"""
+    await outbox.insert_one(outbox_doc(queue, key, message, priority), session=session)
+
+
+async def add_error(message: dict, key: str, queue="transaction_errors"):
+    """Outbox a transaction error; written on its own since the transaction was aborted"""
+    await add_message(queue, key, message)
+
+
+class Relay:
+    def __init__(self):
+        self.owner = f"{os.getenv('HOSTNAME', 'transaction-service')}:{uuid.uuid4().hex[:8]}"
+        self.wakeup = asyncio.Event()
+        self.task = None
+        self.counters = {"sent": 0, "failed": 0, "batches": 0}
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+        try:
+            await leases.delete_one({"_id": "outbox-relay", "owner": self.owner})
+        except Exception:
+            pass
+
+    def wake(self):
+        """Drain now instead of at the next poll (call after a commit)"""
+        self.wakeup.set()
+
+    async def run(self):
+        print(f"✅ Outbox relay started ({self.owner})")
+        while True:
+            try:
+                if publisher.is_connected() and await self.acquire_lease():
+                    if await self.drain() == OUTBOX_BATCH_SIZE:
+                        continue  # more is waiting
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), OUTBOX_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"⚠️ Outbox relay error: {e}")
+                await asyncio.sleep(OUTBOX_POLL_INTERVAL)
+
+    async def acquire_lease(self) -> bool:
+        """Take or renew the relay lease; False while another instance holds it"""
+        now = datetime.datetime.utcnow()
+        try:
+            await leases.find_one_and_update(
+                {"_id": "outbox-relay", "$or": [{"owner": self.owner}, {"until": {"$lt": now}}]},
+                {"$set": {"owner": self.owner,
+                          "until": now + datetime.timedelta(seconds=OUTBOX_LEASE_SECONDS)}},
+                upsert=True,
+            )
+            return True
+        except DuplicateKeyError:
+            return False
+
+    async def drain(self) -> int:
+        """Publish one batch of pending messages; returns how many were read"""
+        docs = await outbox.find({"status": "pending"}).sort("_id", 1).to_list(OUTBOX_BATCH_SIZE)
+        if not docs:
+            return 0
+
+        by_key = OrderedDict()
+        for doc in docs:
+            by_key.setdefault(doc["key"], []).append(doc)
+
+        self.counters["batches"] += 1
+        while by_key:
+            if not await self.acquire_lease():
+                break  # lease lost mid-batch: the new holder takes over from here
+            wave = [messages.pop(0) for messages in by_key.values()]
+            futures = [publisher.publish(d["queue"], d["message"], d["priority"]) for d in wave]
+            # Not cancelled on timeout: a late confirm only means a duplicate later
+            done, _ = await asyncio.wait(futures, timeout=OUTBOX_PUBLISH_TIMEOUT)
+            ok = [f in done and f.exception() is None for f in futures]
+
+            sent = [d["_id"] for d, confirmed in zip(wave, ok) if confirmed]
+            if sent:
+                await outbox.update_many(
+                    {"_id": {"$in": sent}},
+                    {"$set": {"status": "sent", "sentAt": datetime.datetime.utcnow()}},
+                )
+                self.counters["sent"] += len(sent)
+
+            for d, confirmed in zip(wave, ok):
+                if not confirmed:
+                    # Keep the account's order: retry from this message next pass
+                    self.counters["failed"] += 1
+                    by_key.pop(d["key"], None)
+            by_key = OrderedDict((k, v) for k, v in by_key.items() if v)
+
+        return len(docs)
+
+
+relay = Relay()
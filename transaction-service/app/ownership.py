@@ -0,0 +1,114 @@
+"""
+User -> account numbers index for authorizing transaction reads.
+
+`accounts` is sharded on accountNumber, so "which accounts does this user
+own" is a scatter-gather query. The answer is cached in two tiers:
+
+  - in-process, for OWNERSHIP_LOCAL_TTL seconds, but only while we are
+    subscribed to the account events on Redis (see publish_event in
+    cache.py): an account created, updated or deleted drops its owner's
+    entry here;
+  - in Redis ("ownership:user:<id>"), shared with the other instances and
+    dropped by account-service when an account is created or deleted.
+
+A request for an account that is not in the cached set re-reads the set
+from Mongo once before it is refused, so an account created a moment ago
+cannot be locked out by a stale copy.
+"""
+from .cache import cache, EVENTS_CHANNEL
+from .db import accounts
+import redis.asyncio as aioredis
+import asyncio
+import json
+import os
+import time
+
+OWNERSHIP_TTL = int(os.getenv("OWNERSHIP_TTL", 3600))
+OWNERSHIP_LOCAL_TTL = float(os.getenv("OWNERSHIP_LOCAL_TTL", 60))
+OWNERSHIP_LOCAL_SIZE = int(os.getenv("OWNERSHIP_LOCAL_SIZE", 100000))
+
+ACCOUNT_EVENTS = {"account.created", "account.updated", "account.deleted"}
+
+
+class OwnershipIndex:
+    def __init__(self):
+        self.local = {}  # user id -> (expires at, frozenset of account numbers)
+        self.enabled = False  # in-process tier only while events are received
+        self.task = None
+        self.counters = {"local_hits": 0, "redis_hits": 0, "mongo_reads": 0}
+
+    async def accounts_of(self, user_id, refresh: bool = False) -> frozenset:
+        user_id = str(user_id)
+        now = time.monotonic()
+        if not refresh and self.enabled:
+            entry = self.local.get(user_id)
+            if entry and entry[0] > now:
+                self.counters["local_hits"] += 1
+                return entry[1]
+
+        cache_key = f"ownership:user:{user_id}"
+        numbers = None if refresh else cache.get(cache_key)
+        if numbers is not None:
+            self.counters["redis_hits"] += 1
+        else:
+            self.counters["mongo_reads"] += 1
+            numbers = [a["accountNumber"] async for a in accounts.find({"userId": user_id}, {"accountNumber": 1})]
+            cache.set(cache_key, numbers, ttl=OWNERSHIP_TTL)
+
+        owned = frozenset(numbers)
+        if self.enabled:
+            if len(self.local) >= OWNERSHIP_LOCAL_SIZE:
+                self.local.clear()
+            self.local[user_id] = (now + OWNERSHIP_LOCAL_TTL, owned)
+        return owned
+
+    async def owns_any(self, user_id, numbers) -> bool:
+        if not self.owned_in(await self.accounts_of(user_id), numbers):
+            return self.owned_in(await self.accounts_of(user_id, refresh=True), numbers)
+        return True
+
+    @staticmethod
+    def owned_in(owned: frozenset, numbers) -> bool:
+        return any(n in owned for n in numbers)
+
+    def forget(self, user_id):
+        self.local.pop(str(user_id), None)
+
+    def start(self):
+        self.task = asyncio.create_task(self.listen())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+
+    async def listen(self):
+        """Drop entries on account events; reconnects forever"""
+        while True:
+            try:
+                async with aioredis.Redis(host=cache.redis_host, port=cache.redis_port,
+                                          decode_responses=True) as client:
+                    async with client.pubsub() as pubsub:
+                        await pubsub.subscribe(EVENTS_CHANNEL)
+                        self.enabled = True
+                        print(f"✅ Ownership index listening on '{EVENTS_CHANNEL}'")
+                        async for message in pubsub.listen():
+                            if message.get("type") != "message":
+                                continue
+                            try:
+                                event = json.loads(message["data"])
+                                if event.get("event") in ACCOUNT_EVENTS:
+                                    self.forget(event["userId"])
+                            except (ValueError, KeyError, TypeError) as e:
+                                print(f"⚠️ Ignoring malformed account event: {e}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"⚠️ Ownership index listener disconnected: {e}")
+
+            # Events may have been missed while disconnected: start from scratch
+            self.enabled = False
+            self.local.clear()
+            await asyncio.sleep(2)
+
+
+ownership = OwnershipIndex()
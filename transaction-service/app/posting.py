@@ -0,0 +1,411 @@
+"""
+In-process posting engine: per-account ordered queues with batched transactions.
+
+Every deposit, withdrawal and transfer is submitted to the queue of one
+account. A transfer joins the queue of whichever side already has one, so a
+hot merchant or payroll account collects its incoming and outgoing postings
+in a single queue. Each queue has one worker that posts what has piled up:
+
+  - a lone posting uses conditional updates (status, ownership and balance
+    in the update filter), as before;
+  - a batch reads every account involved once, applies the postings in queue
+    order in memory (each one is accepted or rejected on its own), writes one
+    net $inc per account, and inserts all transaction, outbox and
+    idempotency documents in the same Mongo transaction.
+
+One transaction per batch instead of one per request means the hot account
+document is written once per batch, so concurrent requests stop colliding
+on it with write conflicts. Every caller still gets its own response or
+error. Transactions run through txrunner.py, which retries transient errors
+with backoff; a batch that still fails is re-posted one posting at a time,
+so a single bad posting cannot fail its neighbours. A 5xx from the runner
+(deadline passed, too much contention) fails the whole batch instead.
+
+With POSTING_MODE=ledger, postings skip the queues and the Mongo transaction
+and are posted leg by leg through the ledger (see ledger.py), except for
+those touching split-balance accounts.
+
+Withdrawals and transfers are first charged against the velocity limits in
+Redis (see limits.py); a refused posting never reaches Mongo.
+
+Split-balance accounts (`buckets: N`, see buckets.py) never match the
+conditional updates; their legs go to the bucket documents instead, and in a
+batch their net change is applied to the buckets.
+"""
+from bson import ObjectId
+from collections import deque
+from fastapi import HTTPException
+from pymongo import ReturnDocument, UpdateOne
+from .db import accounts, transactions, account_entries, outbox, idempotency
+from .outbox import notification_doc, relay
+from .ledger import ledger_poster
+from . import buckets, history, rollups
+from .cache import cache, invalidate_cache, publish_event
+from .txrunner import txrunner
+from .limits import limits
+import asyncio
+import datetime
+import os
+
+POSTING_BATCH_SIZE = int(os.getenv("POSTING_BATCH_SIZE", 100))
+# "transaction" (queued, batched Mongo transactions) or "ledger" (two-phase, no distributed transaction)
+POSTING_MODE = os.getenv("POSTING_MODE", "transaction")
+
+# Account numbers used as the missing side of deposits and withdrawals
+DEPOSIT, WITHDRAW = "DEPOSIT", "WITHDRAW"
+
+
+class Posting:
+    """One deposit, withdrawal or transfer waiting for its account queue"""
+
+    def __init__(self, tx_type: str, from_account: str, to_account: str, amount: float, currency: str,
+                 user: dict, tx_id: str, description: str = None, idem=None):
+        self.tx_type = tx_type
+        self.from_account = from_account
+        self.to_account = to_account
+        self.amount = amount
+        self.currency = currency
+        self.user = user
+        self.tx_id = tx_id
+        self.description = description
+        self.idem = idem
+        self.doc = None
+        self.result = None
+        self.future = asyncio.get_running_loop().create_future()
+
+    @property
+    def debit(self):
+        return self.from_account if self.from_account != DEPOSIT else None
+
+    @property
+    def credit(self):
+        return self.to_account if self.to_account != WITHDRAW else None
+
+    @property
+    def is_admin(self) -> bool:
+        return self.user.get("role") == "admin"
+
+    def owner_filter(self) -> dict:
+        return {} if self.is_admin else {"userId": str(self.user.get("user_id"))}
+
+    def check(self, found: dict, balances: dict):
+        """Why this posting cannot be applied to the accounts as they are, or None"""
+        a_from, a_to = found.get(self.debit), found.get(self.credit)
+        if (self.debit and a_from is None) or (self.credit and a_to is None):
+            return HTTPException(404, "Account not found")
+
+        # Ownership applies to the account money leaves (or, for deposits, enters)
+        owned, preposition = (a_from, "from") if self.debit else (a_to, "to")
+        owner = str(owned.get("userId", ""))
+        if not self.is_admin and owner != str(self.user.get("user_id", "")):
+            return HTTPException(403, (
+                f"Forbidden: can only {self.tx_type.lower()} {preposition} your own account. "
+                f"Account '{owned['accountNumber']}' belongs to user '{owner}', "
+                f"but you are user '{self.user.get('user_id')}'"
+            ))
+        if self.is_admin and owner != str(self.user.get("user_id", "")):
+            print(f"⚠️ ADMIN {self.tx_type}: Admin {self.user.get('user_id')} on user {owner}'s account")
+
+        if self.debit and a_from.get("status") != "active":
+            return HTTPException(400, "Sender account not active" if self.credit else "Account not active")
+        if self.credit and a_to.get("status") != "active":
+            return HTTPException(400, "Receiver account not active" if self.debit else "Account not active")
+        if self.debit and balances[self.debit] < self.amount:
+            return HTTPException(400, "Insufficient funds")
+        return None
+
+    def tx_doc(self) -> dict:
+        doc = {
+            "_id": ObjectId(),
+            "txId": self.tx_id,
+            "fromAccount": self.from_account,
+            "toAccount": self.to_account,
+            "amount": self.amount,
+            "currency": self.currency,
+            "status": "SUCCESS",
+            "type": self.tx_type,
+            "createdAt": datetime.datetime.utcnow(),
+        }
+        if self.tx_type == DEPOSIT:
+            doc["description"] = self.description or "Account deposit"
+        elif self.tx_type == WITHDRAW:
+            doc["description"] = self.description or "Account withdrawal"
+        return doc
+
+    def notifications(self, found: dict) -> list:
+        now = datetime.datetime.utcnow().isoformat()
+        amount, currency = self.amount, self.currency
+        if self.tx_type == DEPOSIT:
+            return [notification_doc({
+                "userId": str(found[self.credit]["userId"]),
+                "type": "DEPOSIT_SUCCESS",
+                "payload": {
+                    "message": f"Successfully deposited {amount} {currency} to account {self.credit}",
+                    "txId": self.tx_id,
+                    "amount": amount,
+                    "currency": currency
+                },
+                "createdAt": now,
+                "priority": "normal"
+            }, key=self.credit)]
+        if self.tx_type == WITHDRAW:
+            return [notification_doc({
+                "userId": str(found[self.debit]["userId"]),
+                "type": "WITHDRAW_SUCCESS",
+                "payload": {
+                    "message": f"Successfully withdrew {amount} {currency} from account {self.debit}",
+                    "txId": self.tx_id,
+                    "amount": amount,
+                    "currency": currency
+                },
+                "createdAt": now,
+                "priority": "normal"
+            }, key=self.debit)]
+        return [
+            notification_doc({
+                "userId": str(found[self.debit]["userId"]),
+                "type": "TRANSACTION_SENT",
+                "payload": {"message": f"Sent {amount} {currency} to {self.credit}", "txId": self.tx_id},
+                "createdAt": now
+            }, key=self.debit),
+            notification_doc({
+                "userId": str(found[self.credit]["userId"]),
+                "type": "TRANSACTION_RECEIVED",
+                "payload": {"message": f"Received {amount} {currency} from {self.debit}", "txId": self.tx_id},
+                "createdAt": now
+            }, key=self.credit),
+        ]
+
+    def response(self, balances: dict) -> dict:
+        if self.tx_type == DEPOSIT:
+            return {"status": "success", "txId": self.tx_id,
+                    "message": f"Successfully deposited {self.amount} {self.currency}",
+                    "newBalance": balances[self.credit]}
+        if self.tx_type == WITHDRAW:
+            return {"status": "success", "txId": self.tx_id,
+                    "message": f"Successfully withdrew {self.amount} {self.currency}",
+                    "newBalance": balances[self.debit]}
+        return {"status": "success", "txId": self.tx_id, "newBalance": balances[self.debit]}
+
+
+class PostingEngine:
+    def __init__(self):
+        self.queues = {}  # accountNumber -> deque of Postings, present while its worker runs
+        self.workers = set()
+        self.counters = {"postings": 0, "batches": 0, "batched_postings": 0, "split_batches": 0}
+
+    async def submit(self, posting: Posting) -> dict:
+        """Queue a posting and wait for its response; raises HTTPException when rejected"""
+        # Velocity limits are checked in Redis before any Mongo work
+        charge = await limits.charge(posting)
+        try:
+            return await self.dispatch(posting)
+        except Exception:
+            # Rejected or failed. A cancelled caller keeps its charge: the posting
+            # is shielded and still goes through without it
+            await limits.release(charge)
+            raise
+
+    async def dispatch(self, posting: Posting) -> dict:
+        if POSTING_MODE == "ledger":
+            found = await self.read_accounts([posting], None)
+            if not any(a.get("buckets") for a in found.values()):
+                self.counters["postings"] += 1
+                result = await ledger_poster.post(posting, found)
+                self.committed([posting], found)
+                return result
+
+        key = self.route(posting)
+        queue = self.queues.get(key)
+        if queue is None:
+            queue = self.queues[key] = deque()
+            worker = asyncio.create_task(self.work(key, queue))
+            self.workers.add(worker)
+            worker.add_done_callback(self.workers.discard)
+        queue.append(posting)
+        self.counters["postings"] += 1
+        return await asyncio.shield(posting.future)
+
+    def route(self, posting: Posting) -> str:
+        """The busy side of a transfer, otherwise the account money leaves"""
+        sides = [n for n in (posting.debit, posting.credit) if n]
+        return next((n for n in sides if n in self.queues), sides[0])
+
+    async def work(self, key: str, queue: deque):
+        try:
+            while queue:
+                batch = [queue.popleft() for _ in range(min(len(queue), POSTING_BATCH_SIZE))]
+                await self.post(batch)
+        finally:
+            # Nothing awaited since the queue ran empty: no posting can be stranded
+            self.queues.pop(key, None)
+
+    async def post(self, batch: list):
+        """Post a batch and resolve its futures (transient errors are retried by the runner)"""
+        try:
+            if len(batch) == 1:
+                results = await self.post_one(batch[0])
+            else:
+                results = await self.post_batch(batch)
+        except Exception as e:
+            results = e
+
+        if isinstance(results, Exception):
+            if isinstance(results, HTTPException) and results.status_code >= 500:
+                # Deadline or overload (see txrunner.py): no one posting is to blame, and
+                # posting them one by one would only add load
+                results = [results] * len(batch)
+            elif len(batch) > 1:
+                # Find the posting that broke the batch by posting each on its own
+                self.counters["split_batches"] += 1
+                for posting in batch:
+                    await self.post([posting])
+                return
+            else:
+                results = [results]
+
+        for posting, result in zip(batch, results):
+            if posting.future.done():
+                continue
+            if isinstance(result, Exception):
+                posting.future.set_exception(result)
+            else:
+                posting.future.set_result(result)
+
+    async def post_one(self, p: Posting) -> list:
+        """Conditional updates; the accounts are read only for split accounts or to explain a rejection"""
+        async def callback(session):
+            balances, found = {}, {}
+            if p.debit:
+                a_from = await accounts.find_one_and_update(
+                    {"accountNumber": p.debit, "status": "active", "balance": {"$gte": p.amount},
+                     "buckets": {"$exists": False}, **p.owner_filter()},
+                    {"$inc": {"balance": -p.amount}},
+                    return_document=ReturnDocument.AFTER,
+                    session=session
+                )
+                if a_from is None:
+                    a_from = await self.fallback(p, p.debit, -p.amount, session)
+                found[p.debit], balances[p.debit] = a_from, a_from["balance"]
+
+            if p.credit:
+                a_to = await accounts.find_one_and_update(
+                    {"accountNumber": p.credit, "status": "active", "buckets": {"$exists": False},
+                     **(p.owner_filter() if not p.debit else {})},
+                    {"$inc": {"balance": p.amount}},
+                    return_document=ReturnDocument.AFTER,
+                    session=session
+                )
+                if a_to is None:
+                    a_to = await self.fallback(p, p.credit, p.amount, session)
+                found[p.credit], balances[p.credit] = a_to, a_to["balance"]
+
+            p.result = p.response(balances)
+            opening = {}
+            if p.debit:
+                opening[p.debit] = balances[p.debit] + p.amount
+            if p.credit:
+                opening[p.credit] = balances[p.credit] - p.amount
+            await self.record([p], found, session, opening)
+            return found
+
+        found = await txrunner.run(p.tx_type.lower(), callback)
+        self.committed([p], found)
+        return [p.result]
+
+    async def fallback(self, p: Posting, number: str, delta: float, session) -> dict:
+        """A conditional update matched nothing: post to the buckets of a split account, or reject"""
+        found = await self.read_accounts([p], session)
+        split = await buckets.read_buckets(found, session)
+        balances = self.balances(found, split)
+        if number == p.credit and p.debit:
+            balances[p.debit] += p.amount  # already debited in this transaction
+        error = p.check(found, balances)
+        if error:
+            raise error
+        if number not in split:
+            raise HTTPException(409, "Account changed concurrently, please retry")
+        return {**found[number], "balance": await buckets.apply(split[number], delta, session)}
+
+    def balances(self, found: dict, split: dict) -> dict:
+        """Account balances, summing the buckets of split accounts"""
+        return {n: buckets.total(split[n]) if n in split else a.get("balance", 0) for n, a in found.items()}
+
+    async def post_batch(self, batch: list) -> list:
+        """Net the accepted postings into one $inc per account, in one transaction"""
+        async def callback(session):
+            found = await self.read_accounts(batch, session)
+            split = await buckets.read_buckets(found, session)
+            balances = self.balances(found, split)
+            opening = dict(balances)
+            deltas, accepted, results = {}, [], []
+
+            for p in batch:
+                error = p.check(found, balances)
+                if error:
+                    results.append(error)
+                    continue
+                if p.debit:
+                    balances[p.debit] -= p.amount
+                    deltas[p.debit] = deltas.get(p.debit, 0) - p.amount
+                if p.credit:
+                    balances[p.credit] += p.amount
+                    deltas[p.credit] = deltas.get(p.credit, 0) + p.amount
+                p.result = p.response(balances)
+                accepted.append(p)
+                results.append(p.result)
+
+            updates = [UpdateOne({"accountNumber": n}, {"$inc": {"balance": d}})
+                       for n, d in deltas.items() if d and n not in split]
+            if updates:
+                await accounts.bulk_write(updates, ordered=False, session=session)
+            for n, d in deltas.items():
+                if d and n in split:
+                    await buckets.apply(split[n], d, session)
+            if accepted:
+                await self.record(accepted, found, session, opening)
+            return found, accepted, results
+
+        found, accepted, results = await txrunner.run("batch", callback)
+        self.counters["batches"] += 1
+        self.counters["batched_postings"] += len(batch)
+        self.committed(accepted, found)
+        return results
+
+    async def read_accounts(self, batch: list, session) -> dict:
+        numbers = list({n for p in batch for n in (p.debit, p.credit) if n})
+        found = {}
+        async for a in accounts.find({"accountNumber": {"$in": numbers}}, session=session):
+            found[a["accountNumber"]] = a
+        return found
+
+    async def record(self, postings: list, found: dict, session, opening: dict):
+        """Transaction, history, rollup, outbox and idempotency documents of the accepted postings"""
+        for p in postings:
+            p.doc = p.tx_doc()
+        await transactions.insert_many([p.doc for p in postings], ordered=False, session=session)
+        await account_entries.insert_many([e for p in postings for e in history.entries(p.doc)],
+                                          ordered=False, session=session)
+        await rollups.apply([p.doc for p in postings], opening, found, session)
+        await outbox.insert_many([n for p in postings for n in p.notifications(found)], session=session)
+
+        records = [p.idem.record(p.result) for p in postings if p.idem]
+        records = [r for r in records if r is not None]
+        if records:
+            await idempotency.insert_many(records, ordered=False, session=session)
+
+    def committed(self, postings: list, found: dict):
+        """Cache invalidation and change events, once per account and user"""
+        if not postings:
+            return
+        relay.wake()
+        touched = {n for p in postings for n in (p.debit, p.credit) if n}
+        for number in touched:
+            invalidate_cache(f"account:number:{number}")
+        for p in postings:
+            cache.set(f"transaction:id:{p.tx_id}", p.doc, ttl=600)
+        for user_id in {str(found[n]["userId"]) for n in touched}:
+            publish_event(user_id, ["accounts", "transactions"])
+
+
+posting_engine = PostingEngine()
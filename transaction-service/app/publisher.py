@@ -1,76 +1,154 @@
-import os, json, pika, time
+import os, json, asyncio
 from typing import Optional
+import aio_pika
 
 RABBIT_HOST = os.getenv("RABBITMQ_HOST", "rabbitmq")
 RABBIT_USER = os.getenv("RABBITMQ_USER", "guest")
 RABBIT_PASS = os.getenv("RABBITMQ_PASS", "guest")
 
-def get_channel():
-    """Get RabbitMQ channel with retry logic"""
-    max_retries = 5
-    retry_count = 0
-    
-    while retry_count < max_retries:
+# Confirm-mode channels publishing in parallel
+PUBLISH_CHANNELS = int(os.getenv("PUBLISH_CHANNELS", 4))
+# Messages sent together on one channel, and how long to wait to fill a batch
+PUBLISH_BATCH_SIZE = int(os.getenv("PUBLISH_BATCH_SIZE", 100))
+PUBLISH_BATCH_WINDOW = float(os.getenv("PUBLISH_BATCH_WINDOW_MS", 2)) / 1000
+# Messages buffered while RabbitMQ is slow or unreachable
+PUBLISH_QUEUE_MAX = int(os.getenv("PUBLISH_QUEUE_MAX", 10000))
+PUBLISH_MAX_ATTEMPTS = int(os.getenv("PUBLISH_MAX_ATTEMPTS", 3))
+PUBLISH_SHUTDOWN_TIMEOUT = float(os.getenv("PUBLISH_SHUTDOWN_TIMEOUT", 5))
+
+
+class Publisher:
+    """
+    Long-lived asyncio publisher.
+
+    publish() only enqueues the message and returns a future, so a request
+    handler never waits on RabbitMQ. A background task drains the queue in
+    micro-batches; each batch goes out on a pooled confirm-mode channel and
+    every message's future resolves once the broker has confirmed it.
+    Failed messages are retried, then dropped with an error.
+    """
+
+    def __init__(self):
+        self.connection: Optional[aio_pika.abc.AbstractRobustConnection] = None
+        self.channels: Optional[asyncio.Queue] = None
+        self.pending: Optional[asyncio.Queue] = None
+        self.declared = set()
+        self.tasks = set()
+        self.runner: Optional[asyncio.Task] = None
+        self.counters = {"published": 0, "batches": 0, "retries": 0, "failed": 0}
+
+    async def start(self):
+        """Start connecting in the background; messages are buffered until connected"""
+        self.pending = asyncio.Queue(maxsize=PUBLISH_QUEUE_MAX)
+        self.runner = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Flush what is buffered (bounded by PUBLISH_SHUTDOWN_TIMEOUT) and disconnect"""
+        if self.runner is None:
+            return
         try:
-            creds = pika.PlainCredentials(RABBIT_USER, RABBIT_PASS)
-            params = pika.ConnectionParameters(
-                host=RABBIT_HOST,
-                credentials=creds,
-                heartbeat=600,
-                blocked_connection_timeout=300
+            await asyncio.wait_for(self._drain(), PUBLISH_SHUTDOWN_TIMEOUT)
+        except asyncio.TimeoutError:
+            print(f"⚠️ Dropping {self.pending.qsize()} unpublished messages on shutdown")
+        self.runner.cancel()
+        if self.connection:
+            await self.connection.close()
+        print("✓ RabbitMQ publisher stopped")
+
+    def is_connected(self) -> bool:
+        return self.connection is not None and not self.connection.is_closed
+
+    def publish(self, queue: str, message: dict, priority: int = 0) -> asyncio.Future:
+        """Enqueue a persistent message; raises asyncio.QueueFull when the buffer is full"""
+        future = asyncio.get_running_loop().create_future()
+        self.pending.put_nowait((queue, json.dumps(message).encode(), priority, future, 1))
+        return future
+
+    async def _connect(self):
+        while True:
+            try:
+                self.connection = await aio_pika.connect_robust(
+                    host=RABBIT_HOST, login=RABBIT_USER, password=RABBIT_PASS, heartbeat=600
+                )
+                break
+            except Exception as e:
+                print(f"⚠️ RabbitMQ connection failed ({e}), retrying...")
+                await asyncio.sleep(2)
+
+        self.channels = asyncio.Queue()
+        for _ in range(PUBLISH_CHANNELS):
+            self.channels.put_nowait(await self.connection.channel(publisher_confirms=True))
+        print(f"✅ RabbitMQ publisher connected ({PUBLISH_CHANNELS} channels)")
+
+    async def _run(self):
+        await self._connect()
+        while True:
+            batch = [await self.pending.get()]
+            if PUBLISH_BATCH_WINDOW:
+                await asyncio.sleep(PUBLISH_BATCH_WINDOW)
+            while len(batch) < PUBLISH_BATCH_SIZE and not self.pending.empty():
+                batch.append(self.pending.get_nowait())
+
+            channel = await self.channels.get()
+            task = asyncio.create_task(self._publish_batch(channel, batch))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def _publish_batch(self, channel, batch: list):
+        """Publish a batch on one channel; confirms are awaited together, not one by one"""
+        try:
+            for queue in {item[0] for item in batch} - self.declared:
+                await channel.declare_queue(queue, durable=True)
+                self.declared.add(queue)
+
+            results = await asyncio.gather(
+                *(channel.default_exchange.publish(
+                    aio_pika.Message(
+                        body,
+                        content_type="application/json",
+                        delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+                        priority=priority,
+                    ),
+                    routing_key=queue,
+                ) for queue, body, priority, _, _ in batch),
+                return_exceptions=True,
             )
-            conn = pika.BlockingConnection(params)
-            return conn, conn.channel()
         except Exception as e:
-            retry_count += 1
-            if retry_count < max_retries:
-                print(f"⚠️ RabbitMQ connection attempt {retry_count}/{max_retries} failed, retrying...")
-                time.sleep(2)
+            results = [e] * len(batch)
+        finally:
+            # Robust channels reopen themselves after a reconnect
+            self.channels.put_nowait(channel)
+
+        self.counters["batches"] += 1
+        for item, result in zip(batch, results):
+            queue, body, priority, future, attempt = item
+            if not isinstance(result, Exception):
+                self.counters["published"] += 1
+                if not future.done():
+                    future.set_result(None)
+            elif attempt < PUBLISH_MAX_ATTEMPTS:
+                self.counters["retries"] += 1
+                asyncio.get_running_loop().call_later(
+                    0.1 * attempt, self._requeue, (queue, body, priority, future, attempt + 1)
+                )
             else:
-                print(f"❌ Failed to connect to RabbitMQ after {max_retries} attempts")
-                raise
-
-def publish_notification(message: dict, queue="notifications", priority: str = "normal"):
-    """Publish notification to queue"""
-    try:
-        # Add priority if not present
-        if "priority" not in message:
-            message["priority"] = priority
-        
-        # Add channel if not present
-        if "channel" not in message:
-            message["channel"] = "in-app"
-        
-        conn, ch = get_channel()
-        ch.queue_declare(queue=queue, durable=True)
-        ch.basic_publish(
-            exchange="",
-            routing_key=queue,
-            body=json.dumps(message),
-            properties=pika.BasicProperties(
-                delivery_mode=2,  # Persistent message
-                priority=1 if priority == "high" else 0
-            )
-        )
-        conn.close()
-        print(f"✅ Published notification to queue '{queue}'")
-    except Exception as e:
-        print(f"❌ Failed to publish notification: {e}")
-        raise
-
-def publish_error(message: dict, queue="transaction_errors"):
-    """Publish transaction error to error queue"""
-    try:
-        conn, ch = get_channel()
-        ch.queue_declare(queue=queue, durable=True)
-        ch.basic_publish(
-            exchange="",
-            routing_key=queue,
-            body=json.dumps(message),
-            properties=pika.BasicProperties(delivery_mode=2)
-        )
-        conn.close()
-        print(f"✅ Published error to queue '{queue}'")
-    except Exception as e:
-        print(f"❌ Failed to publish error: {e}")
-        raise
\ No newline at end of file
+                self.counters["failed"] += 1
+                print(f"❌ Failed to publish to '{queue}' after {attempt} attempts: {result}")
+                if not future.done():
+                    future.set_exception(result)
+                    future.exception()  # nobody may be awaiting it
+
+    def _requeue(self, item):
+        try:
+            self.pending.put_nowait(item)
+        except asyncio.QueueFull:
+            self.counters["failed"] += 1
+            print(f"❌ Dropping message for '{item[0]}': publish buffer full")
+
+    async def _drain(self):
+        while not self.pending.empty() or self.tasks:
+            await asyncio.sleep(0.01)
+
+
+publisher = Publisher()
+
@@ -0,0 +1,213 @@
+"""
+Per-account daily rollups and as-of balances.
+
+Every posting also updates one `account_daily` document per account and UTC
+day ("<accountNumber>:<YYYY-MM-DD>"): credits, debits and the number of
+entries, incremented in the posting's transaction. The opening balance is
+set by the first posting of the day. A split-balance account gets one
+document per bucket and day instead ("...:<YYYY-MM-DD>:<i>", no opening),
+so its rollups do not become the single hot document its buckets avoid.
+
+A checkpoint worker later stamps each finished day with its `closing`
+balance, read in a snapshot transaction as the account balance minus
+everything rolled up after that day. An as-of balance is then the nearest
+checkpoint at or before the date plus the rollups between them, or, if the
+account has no checkpoint yet, the current balance minus the rollups after
+the date. Both read one document per active day, never the transactions.
+
+In ledger mode the rollup is written once when the entry is finished, not
+atomically with the balance; scripts/backfill_account_daily.py rebuilds
+finished days from account_entries.
+"""
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+from pymongo.read_concern import ReadConcern
+from .db import accounts, account_daily, leases, db
+from . import buckets, history
+import asyncio
+import datetime
+import os
+import random
+import uuid
+
+CHECKPOINT_INTERVAL = float(os.getenv("CHECKPOINT_INTERVAL", 600))
+CHECKPOINT_BATCH = int(os.getenv("CHECKPOINT_BATCH", 500))
+CHECKPOINT_LEASE_SECONDS = float(os.getenv("CHECKPOINT_LEASE_SECONDS", 60))
+
+
+def day_of(ts: datetime.datetime) -> datetime.datetime:
+    return datetime.datetime.combine(ts.date(), datetime.time.min)
+
+
+def rollup_id(number: str, day: datetime.datetime) -> str:
+    return f"{number}:{day:%Y-%m-%d}"
+
+
+def rollup_updates(txs: list, opening: dict, split: dict) -> list:
+    """Upserts adding transaction documents to their accounts' daily rollups (split: number -> buckets)"""
+    totals = {}  # (accountNumber, day) -> {"credits", "debits", "count"}
+    for tx in txs:
+        for e in history.entries(tx):
+            t = totals.setdefault((e["accountNumber"], day_of(e["createdAt"])),
+                                  {"credits": 0, "debits": 0, "count": 0})
+            t["credits" if e["direction"] == "credit" else "debits"] += e["amount"]
+            t["count"] += 1
+
+    updates = []
+    for (number, day), inc in totals.items():
+        if number in split:
+            _id, on_insert = f"{rollup_id(number, day)}:{random.randrange(split[number])}", {"day": day}
+        else:
+            _id, on_insert = rollup_id(number, day), {"day": day}
+            if number in opening:
+                on_insert["opening"] = opening[number]
+        updates.append(UpdateOne(
+            {"_id": _id, "accountNumber": number}, {"$setOnInsert": on_insert, "$inc": inc}, upsert=True
+        ))
+    return updates
+
+
+async def apply(txs: list, opening: dict, found: dict, session=None):
+    split = {n: a["buckets"] for n, a in found.items() if a.get("buckets")}
+    updates = rollup_updates(txs, opening, split)
+    if updates:
+        await account_daily.bulk_write(updates, ordered=False, session=session)
+
+
+async def current_balance(number: str, session=None):
+    """Balance of an account now (bucket total for split accounts), or None if it does not exist"""
+    a = await accounts.find_one({"accountNumber": number}, session=session)
+    if a is None:
+        return None
+    split = await buckets.read_buckets({number: a}, session)
+    return buckets.total(split[number]) if number in split else a.get("balance", 0)
+
+
+def days(number: str, day_filter: dict, order: int, session=None):
+    """Totals and checkpoint per day (merging the bucket documents of split accounts)"""
+    return account_daily.aggregate([
+        {"$match": {"accountNumber": number, "day": day_filter}},
+        {"$group": {
+            "_id": "$day",
+            "credits": {"$sum": "$credits"},
+            "debits": {"$sum": "$debits"},
+            "count": {"$sum": "$count"},
+            "closing": {"$max": "$closing"},
+        }},
+        {"$addFields": {"net": {"$subtract": ["$credits", "$debits"]}}},
+        {"$sort": {"_id": order}},
+    ], session=session)
+
+
+async def balance_as_of(number: str, day: datetime.date):
+    """Closing balance of `day`, or None if the account does not exist"""
+    end = datetime.datetime.combine(day, datetime.time.min)
+    moved = 0.0
+    # Back from `day` to the nearest checkpoint
+    async for d in days(number, {"$lte": end}, -1):
+        if d.get("closing") is not None:
+            return d["closing"] + moved
+        moved += d["net"]
+
+    # No checkpoint before it: back from the next checkpoint, or from the current balance
+    moved = 0.0
+    async for d in days(number, {"$gt": end}, 1):
+        moved += d["net"]
+        if d.get("closing") is not None:
+            return d["closing"] - moved
+    balance = await current_balance(number)
+    return balance - moved if balance is not None else None
+
+
+async def summary(number: str, start: datetime.date, end: datetime.date) -> dict:
+    """Opening and closing balance of [start, end] with the daily totals in between"""
+    opening = await balance_as_of(number, start - datetime.timedelta(days=1))
+    if opening is None:
+        return None
+    totals = await days(number, {"$gte": datetime.datetime.combine(start, datetime.time.min),
+                                 "$lte": datetime.datetime.combine(end, datetime.time.min)}, 1).to_list(None)
+
+    credits = sum(d["credits"] for d in totals)
+    debits = sum(d["debits"] for d in totals)
+    return {
+        "accountNumber": number,
+        "from": start.isoformat(),
+        "to": end.isoformat(),
+        "opening": opening,
+        "credits": credits,
+        "debits": debits,
+        "count": sum(d["count"] for d in totals),
+        "closing": opening + credits - debits,
+        "days": [
+            {"day": d["_id"].date().isoformat(), "credits": d["credits"], "debits": d["debits"], "count": d["count"]}
+            for d in totals
+        ],
+    }
+
+
+class Checkpointer:
+    """Stamps finished days with their closing balance (one instance at a time, by lease)"""
+
+    def __init__(self):
+        self.owner = f"{os.getenv('HOSTNAME', 'transaction-service')}:{uuid.uuid4().hex[:8]}"
+        self.task = None
+        self.counters = {"checkpoints": 0}
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+
+    async def run(self):
+        print(f"✅ Rollup checkpointer started ({self.owner})")
+        while True:
+            try:
+                if await self.acquire_lease():
+                    while await self.checkpoint() == CHECKPOINT_BATCH:
+                        pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"⚠️ Rollup checkpoint error: {e}")
+            await asyncio.sleep(CHECKPOINT_INTERVAL)
+
+    async def acquire_lease(self) -> bool:
+        now = datetime.datetime.utcnow()
+        try:
+            await leases.find_one_and_update(
+                {"_id": "rollup-checkpoint", "$or": [{"owner": self.owner}, {"until": {"$lt": now}}]},
+                {"$set": {"owner": self.owner,
+                          "until": now + datetime.timedelta(seconds=CHECKPOINT_LEASE_SECONDS)}},
+                upsert=True,
+            )
+            return True
+        except DuplicateKeyError:
+            return False
+
+    async def checkpoint(self) -> int:
+        """Checkpoint one batch of finished days; returns how many were found"""
+        today = day_of(datetime.datetime.utcnow())
+        pending = await account_daily.find(
+            {"day": {"$lt": today}, "closing": {"$exists": False}}, {"accountNumber": 1, "day": 1}
+        ).to_list(CHECKPOINT_BATCH)
+
+        for doc in pending:
+            # Balance and later rollups from one snapshot, so a posting is in both or in neither
+            async with await db.client.start_session() as session:
+                async with session.start_transaction(read_concern=ReadConcern("snapshot")):
+                    # None for a deleted account: nothing to anchor, but no longer pending
+                    balance = await current_balance(doc["accountNumber"], session)
+                    if balance is not None:
+                        async for later in days(doc["accountNumber"], {"$gt": doc["day"]}, 1, session):
+                            balance -= later["net"]
+            await account_daily.update_one(
+                {"_id": doc["_id"], "accountNumber": doc["accountNumber"]},
+                {"$set": {"closing": balance, "checkpointedAt": datetime.datetime.utcnow()}}
+            )
+            self.counters["checkpoints"] += 1
+        return len(pending)
+
+
+checkpointer = Checkpointer()
@@ -1,14 +1,17 @@
-from fastapi import APIRouter, HTTPException, Query, Depends, Request
+from fastapi import APIRouter, HTTPException, Query, Depends, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
 from slowapi import Limiter
 from slowapi.util import get_remote_address
-from bson import ObjectId
-from ..db import accounts, transactions, db
-from ..schemas import TransferIn, TransactionOut, DepositIn, WithdrawIn
-from ..publisher import publish_notification, publish_error
+from pymongo import ReturnDocument
+from ..db import transactions, account_entries, schedules
+from ..schemas import TransferIn, TransactionOut, DepositIn, WithdrawIn, ScheduleIn
+from ..outbox import add_error, relay
+from ..posting import DEPOSIT, WITHDRAW, Posting, posting_engine
 from ..auth import verify_token
-from ..cache import cache, invalidate_cache
+from ..idempotency import IDEMPOTENCY_HEADER, IDEMPOTENCY_KEY_MAX_LENGTH, idempotent
+from ..ownership import ownership
+from .. import bulk, export, history, ids, rollups, scheduler
 import datetime
-import uuid
 
 router = APIRouter(
     prefix="/api/transactions",
@@ -23,8 +26,11 @@ limiter = Limiter(key_func=get_remote_address)
 # ============================
 @router.post("/deposit")
 @limiter.limit("10/minute")
-async def deposit(request: Request, payload: DepositIn, user=Depends(verify_token)):
+async def deposit(request: Request, payload: DepositIn, user=Depends(verify_token),
+                  idem=Depends(idempotent("deposit"))):
     """Deposit money into user's own account (or any account for admin)"""
+    if idem.replay is not None:
+        return idem.replay
     
     print("=" * 60)
     print("DEPOSIT REQUEST DEBUG INFO")
@@ -33,119 +39,48 @@ async def deposit(request: Request, payload: DepositIn, user=Depends(verify_toke
     print(f"To account: {payload.accountNumber}")
     print(f"Amount: {payload.amount}")
 
-    cache_key = f"account:number:{payload.accountNumber}"
-    
-    account = cache.get(cache_key)
-    if not account:
-        account = await accounts.find_one({"accountNumber": payload.accountNumber})
-        if account:
-            cache.set(cache_key, dict(account), ttl=300)
-
-    if not account:
-        print(f"ERROR: Account not found")
-        raise HTTPException(404, "Account not found")
-
-    print(f"Account Data: {account}")
-
-    account_user_id = str(account.get("userId", ""))
-    token_user_id = str(user.get("user_id", ""))
-    user_role = user.get("role", "")
-    
-    print(f"Account userId: '{account_user_id}'")
-    print(f"Token userId: '{token_user_id}'")
-    print(f"User role: '{user_role}'")
-
-    # User can only deposit to their own account (except admin)
-    if user_role != "admin" and account_user_id != token_user_id:
-        error_msg = (
-            f"Forbidden: can only deposit to your own account. "
-            f"Account '{payload.accountNumber}' belongs to user '{account_user_id}', "
-            f"but you are user '{token_user_id}'"
-        )
-        print(f"ERROR: {error_msg}")
-        raise HTTPException(403, error_msg)
-    
-    # Log if admin is depositing to another user's account
-    if user_role == "admin" and account_user_id != token_user_id:
-        print(f"⚠️ ADMIN DEPOSIT: Admin {token_user_id} depositing to user {account_user_id}'s account")
-
-    if account.get("status") != "active":
-        print(f"ERROR: Account status is {account.get('status')}")
-        raise HTTPException(400, "Account not active")
-
     if payload.amount <= 0:
         print(f"ERROR: Invalid amount: {payload.amount}")
         raise HTTPException(400, "Amount must be greater than 0")
 
-    tx_id = f"DEP-{uuid.uuid4().hex[:12]}"
+    tx_id = ids.new_id("DEP")
     print(f"Generated transaction ID: {tx_id}")
 
     try:
-        async with await db.client.start_session() as session:
-            async with session.start_transaction():
-                result = await accounts.update_one(
-                    {"accountNumber": payload.accountNumber},
-                    {"$inc": {"balance": payload.amount}},
-                    session=session
-                )
-
-                if result.modified_count == 0:
-                    raise Exception("Failed to update account balance")
-
-                tx_doc = {
-                    "txId": tx_id,
-                    "fromAccount": "DEPOSIT",
-                    "toAccount": payload.accountNumber,
-                    "amount": payload.amount,
-                    "currency": payload.currency,
-                    "status": "SUCCESS",
-                    "type": "DEPOSIT",
-                    "description": payload.description or "Account deposit",
-                    "createdAt": datetime.datetime.utcnow(),
-                }
-
-                await transactions.insert_one(tx_doc, session=session)
-
-        invalidate_cache(f"account:number:{payload.accountNumber}")
-        cache.set(f"transaction:id:{tx_id}", tx_doc, ttl=600)
-
-        try:
-            publish_notification({
-                "userId": str(account["userId"]),
-                "type": "DEPOSIT_SUCCESS",
-                "payload": {
-                    "message": f"Successfully deposited {payload.amount} {payload.currency} to account {payload.accountNumber}",
-                    "txId": tx_id,
-                    "amount": payload.amount,
-                    "currency": payload.currency
-                },
-                "createdAt": datetime.datetime.utcnow().isoformat(),
-                "priority": "normal"
-            })
-        except Exception as e:
-            print(f"Notification failure: {e}")
+        # Ownership, status and the balance update are handled by the
+        # account's posting queue (see posting.py)
+        response = await posting_engine.submit(Posting(
+            DEPOSIT, DEPOSIT, payload.accountNumber, payload.amount, payload.currency,
+            user, tx_id, payload.description, idem
+        ))
 
         print("✓ Deposit successful!")
         print("=" * 60)
         
-        return {
-            "status": "success",
-            "txId": tx_id,
-            "message": f"Successfully deposited {payload.amount} {payload.currency}",
-            "newBalance": account.get("balance", 0) + payload.amount
-        }
+        return response
+
+    except HTTPException as e:
+        print(f"ERROR: {e.detail}")
+        print("=" * 60)
+        raise
 
     except Exception as e:
+        # A concurrent request with the same Idempotency-Key got there first
+        replay = await idem.recover(e)
+        if replay is not None:
+            return replay
+
         print(f"ERROR: Deposit failed - {str(e)}")
         print("=" * 60)
         
         try:
-            publish_error({
+            await add_error({
                 "txId": tx_id,
                 "error": str(e),
                 "type": "DEPOSIT_FAILED",
                 "timestamp": datetime.datetime.utcnow().isoformat(),
-            })
+            }, key=payload.accountNumber)
+            relay.wake()
         except:
             pass
             
@@ -157,8 +92,11 @@ async def deposit(request: Request, payload: DepositIn, user=Depends(verify_toke
 # ============================
 @router.post("/withdraw")
 @limiter.limit("10/minute")
-async def withdraw(request: Request, payload: WithdrawIn, user=Depends(verify_token)):
+async def withdraw(request: Request, payload: WithdrawIn, user=Depends(verify_token),
+                   idem=Depends(idempotent("withdraw"))):
     """Withdraw money from user's own account (or any account for admin)"""
+    if idem.replay is not None:
+        return idem.replay
     
     print("=" * 60)
     print("WITHDRAW REQUEST DEBUG INFO")
@@ -167,124 +105,47 @@ async def withdraw(request: Request, payload: WithdrawIn, user=Depends(verify_to
     print(f"From account: {payload.accountNumber}")
     print(f"Amount: {payload.amount}")
 
-    cache_key = f"account:number:{payload.accountNumber}"
-    
-    account = cache.get(cache_key)
-    if not account:
-        account = await accounts.find_one({"accountNumber": payload.accountNumber})
-        if account:
-            cache.set(cache_key, dict(account), ttl=300)
-
-    if not account:
-        print(f"ERROR: Account not found")
-        raise HTTPException(404, "Account not found")
-
-    print(f"Account Data: {account}")
-
-    account_user_id = str(account.get("userId", ""))
-    token_user_id = str(user.get("user_id", ""))
-    user_role = user.get("role", "")
-    
-    print(f"Account userId: '{account_user_id}'")
-    print(f"Token userId: '{token_user_id}'")
-    print(f"User role: '{user_role}'")
-
-    # User can only withdraw from their own account (except admin)
-    if user_role != "admin" and account_user_id != token_user_id:
-        error_msg = (
-            f"Forbidden: can only withdraw from your own account. "
-            f"Account '{payload.accountNumber}' belongs to user '{account_user_id}', "
-            f"but you are user '{token_user_id}'"
-        )
-        print(f"ERROR: {error_msg}")
-        raise HTTPException(403, error_msg)
-    
-    # Log if admin is withdrawing from another user's account
-    if user_role == "admin" and account_user_id != token_user_id:
-        print(f"⚠️ ADMIN WITHDRAW: Admin {token_user_id} withdrawing from user {account_user_id}'s account")
-
-    if account.get("status") != "active":
-        print(f"ERROR: Account status is {account.get('status')}")
-        raise HTTPException(400, "Account not active")
-
     if payload.amount <= 0:
         print(f"ERROR: Invalid amount: {payload.amount}")
         raise HTTPException(400, "Amount must be greater than 0")
 
-    # Check sufficient balance
-    if account.get("balance", 0) < payload.amount:
-        print(f"ERROR: Insufficient funds - balance: {account.get('balance', 0)}, required: {payload.amount}")
-        raise HTTPException(400, "Insufficient funds")
-
-    tx_id = f"WDR-{uuid.uuid4().hex[:12]}"
+    tx_id = ids.new_id("WDR")
     print(f"Generated transaction ID: {tx_id}")
 
     try:
-        async with await db.client.start_session() as session:
-            async with session.start_transaction():
-                result = await accounts.update_one(
-                    {"accountNumber": payload.accountNumber},
-                    {"$inc": {"balance": -payload.amount}},
-                    session=session
-                )
-
-                if result.modified_count == 0:
-                    raise Exception("Failed to update account balance")
-
-                tx_doc = {
-                    "txId": tx_id,
-                    "fromAccount": payload.accountNumber,
-                    "toAccount": "WITHDRAW",  # Special marker for withdrawals
-                    "amount": payload.amount,
-                    "currency": payload.currency,
-                    "status": "SUCCESS",
-                    "type": "WITHDRAW",
-                    "description": payload.description or "Account withdrawal",
-                    "createdAt": datetime.datetime.utcnow(),
-                }
-
-                await transactions.insert_one(tx_doc, session=session)
-
-        invalidate_cache(f"account:number:{payload.accountNumber}")
-        cache.set(f"transaction:id:{tx_id}", tx_doc, ttl=600)
-
-        try:
-            publish_notification({
-                "userId": str(account["userId"]),
-                "type": "WITHDRAW_SUCCESS",
-                "payload": {
-                    "message": f"Successfully withdrew {payload.amount} {payload.currency} from account {payload.accountNumber}",
-                    "txId": tx_id,
-                    "amount": payload.amount,
-                    "currency": payload.currency
-                },
-                "createdAt": datetime.datetime.utcnow().isoformat(),
-                "priority": "normal"
-            })
-        except Exception as e:
-            print(f"Notification failure: {e}")
+        # Status, ownership and balance are checked by the conditional debit,
+        # so there is no read beforehand and no overdraft race
+        response = await posting_engine.submit(Posting(
+            WITHDRAW, payload.accountNumber, WITHDRAW, payload.amount, payload.currency,
+            user, tx_id, payload.description, idem
+        ))
 
         print("✓ Withdrawal successful!")
         print("=" * 60)
         
-        return {
-            "status": "success",
-            "txId": tx_id,
-            "message": f"Successfully withdrew {payload.amount} {payload.currency}",
-            "newBalance": account.get("balance", 0) - payload.amount
-        }
+        return response
+
+    except HTTPException as e:
+        print(f"ERROR: {e.detail}")
+        print("=" * 60)
+        raise
 
     except Exception as e:
+        replay = await idem.recover(e)
+        if replay is not None:
+            return replay
+
         print(f"ERROR: Withdrawal failed - {str(e)}")
         print("=" * 60)
         
         try:
-            publish_error({
+            await add_error({
                 "txId": tx_id,
                 "error": str(e),
                 "type": "WITHDRAW_FAILED",
                 "timestamp": datetime.datetime.utcnow().isoformat(),
-            })
+            }, key=payload.accountNumber)
+            relay.wake()
         except:
             pass
             
@@ -296,7 +157,10 @@ async def withdraw(request: Request, payload: WithdrawIn, user=Depends(verify_to
 # ============================
 @router.post("/transfer")
 @limiter.limit("30/minute")
-async def transfer(request: Request, payload: TransferIn, user=Depends(verify_token)):
+async def transfer(request: Request, payload: TransferIn, user=Depends(verify_token),
+                   idem=Depends(idempotent("transfer"))):
+    if idem.replay is not None:
+        return idem.replay
 
     print("=" * 60)
     print("TRANSFER REQUEST DEBUG INFO")
@@ -306,134 +170,141 @@ async def transfer(request: Request, payload: TransferIn, user=Depends(verify_to
     print(f"To account: {payload.toAccount}")
     print(f"Amount: {payload.amount}")
 
-    from_cache_key = f"account:number:{payload.fromAccount}"
-    to_cache_key = f"account:number:{payload.toAccount}"
-
-    a_from = cache.get(from_cache_key)
-    a_to = cache.get(to_cache_key)
-
-    if not a_from:
-        a_from = await accounts.find_one({"accountNumber": payload.fromAccount})
-        if a_from:
-            cache.set(from_cache_key, dict(a_from), ttl=300)
-
-    if not a_to:
-        a_to = await accounts.find_one({"accountNumber": payload.toAccount})
-        if a_to:
-            cache.set(to_cache_key, dict(a_to), ttl=300)
-
-    if not a_from or not a_to:
-        print(f"ERROR: Account not found - from: {a_from is not None}, to: {a_to is not None}")
-        raise HTTPException(404, "Account not found")
-
-    print(f"From Account Data: {a_from}")
-    print(f"To Account Data: {a_to}")
-
-    from_user_id = str(a_from.get("userId", ""))
-    token_user_id = str(user.get("user_id", ""))
-    user_role = user.get("role", "")
-    
-    print(f"Account userId: '{from_user_id}' (type: {type(a_from.get('userId'))})")
-    print(f"Token userId: '{token_user_id}' (type: {type(user.get('user_id'))})")
-    print(f"User role: '{user_role}'")
-    print(f"Match: {from_user_id == token_user_id}")
-
-    if user_role != "admin" and from_user_id != token_user_id:
-        error_msg = (
-            f"Forbidden: can only transfer from your own account. "
-            f"Account '{payload.fromAccount}' belongs to user '{from_user_id}', "
-            f"but you are user '{token_user_id}'"
-        )
-        print(f"ERROR: {error_msg}")
-        raise HTTPException(403, error_msg)
-
-    if a_from.get("status") != "active":
-        print(f"ERROR: Sender account status is {a_from.get('status')}")
-        raise HTTPException(400, "Sender account not active")
-
-    if a_to.get("status") != "active":
-        print(f"ERROR: Receiver account status is {a_to.get('status')}")
-        raise HTTPException(400, "Receiver account not active")
-
-    if a_from.get("balance", 0) < payload.amount:
-        print(f"ERROR: Insufficient funds - balance: {a_from.get('balance', 0)}, required: {payload.amount}")
-        raise HTTPException(400, "Insufficient funds")
-
-    tx_id = f"TXN-{uuid.uuid4().hex[:12]}"
+    tx_id = ids.new_id("TXN")
     print(f"Generated transaction ID: {tx_id}")
 
     try:
-        async with await db.client.start_session() as session:
-            async with session.start_transaction():
-
-                await accounts.update_one(
-                    {"accountNumber": payload.fromAccount},
-                    {"$inc": {"balance": -payload.amount}},
-                    session=session
-                )
-
-                await accounts.update_one(
-                    {"accountNumber": payload.toAccount},
-                    {"$inc": {"balance": payload.amount}},
-                    session=session
-                )
-
-                tx_doc = {
-                    "txId": tx_id,
-                    "fromAccount": payload.fromAccount,
-                    "toAccount": payload.toAccount,
-                    "amount": payload.amount,
-                    "currency": payload.currency,
-                    "status": "SUCCESS",
-                    "type": "TRANSFER",
-                    "createdAt": datetime.datetime.utcnow(),
-                }
-
-                await transactions.insert_one(tx_doc, session=session)
-
-        invalidate_cache(f"account:number:{payload.fromAccount}")
-        invalidate_cache(f"account:number:{payload.toAccount}")
-        cache.set(f"transaction:id:{tx_id}", tx_doc, ttl=600)
-
-        try:
-            publish_notification({
-                "userId": str(a_from["userId"]),
-                "type": "TRANSACTION_SENT",
-                "payload": {
-                    "message": f"Sent {payload.amount} {payload.currency} to {payload.toAccount}",
-                    "txId": tx_id
-                },
-                "createdAt": datetime.datetime.utcnow().isoformat()
-            })
-
-            publish_notification({
-                "userId": str(a_to["userId"]),
-                "type": "TRANSACTION_RECEIVED",
-                "payload": {
-                    "message": f"Received {payload.amount} {payload.currency} from {payload.fromAccount}",
-                    "txId": tx_id
-                },
-                "createdAt": datetime.datetime.utcnow().isoformat()
-            })
-
-        except Exception as e:
-            print(f"Notification failure: {e}")
+        response = await posting_engine.submit(Posting(
+            "TRANSFER", payload.fromAccount, payload.toAccount, payload.amount, payload.currency,
+            user, tx_id, idem=idem
+        ))
 
         print("✓ Transfer successful!")
         print("=" * 60)
-        return {"status": "success", "txId": tx_id}
+        return response
+
+    except HTTPException as e:
+        print(f"ERROR: {e.detail}")
+        print("=" * 60)
+        raise
 
     except Exception as e:
+        replay = await idem.recover(e)
+        if replay is not None:
+            return replay
+
         print(f"ERROR: Transfer failed - {str(e)}")
         print("=" * 60)
-        publish_error({
-            "txId": tx_id,
-            "error": str(e),
-            "timestamp": datetime.datetime.utcnow().isoformat(),
-        })
+        try:
+            await add_error({
+                "txId": tx_id,
+                "error": str(e),
+                "timestamp": datetime.datetime.utcnow().isoformat(),
+            }, key=payload.fromAccount)
+            relay.wake()
+        except:
+            pass
+
         raise HTTPException(400, f"Transfer failed: {str(e)}")
 
 
+# ============================
+#        BULK TRANSFERS
+# ============================
+@router.post("/bulk")
+@limiter.limit("5/minute")
+async def bulk_transfer(request: Request, user=Depends(verify_token), run_async: bool = Query(False, alias="async")):
+    """Post a CSV or NDJSON file of transfers; results stream back per row, or ?async=true returns a job id"""
+    fmt = bulk.format_of(request.headers.get("content-type"))
+    key = request.headers.get(IDEMPOTENCY_HEADER)
+    if key is not None and not 0 < len(key) <= IDEMPOTENCY_KEY_MAX_LENGTH:
+        raise HTTPException(400, f"{IDEMPOTENCY_HEADER} must be 1-{IDEMPOTENCY_KEY_MAX_LENGTH} characters")
+
+    if run_async:
+        job = await bulk.job_runner.create(request.stream(), fmt, user, key)
+        return JSONResponse({"jobId": job["_id"], "status": job["status"]}, status_code=202)
+
+    # Read the whole body before responding: the streamed response's disconnect
+    # listener would otherwise receive (and drop) the rest of the upload
+    file = await bulk.spool(request.stream())
+    run = bulk.BulkRun(user, key)
+    return StreamingResponse(
+        bulk.ndjson(run.results(bulk.spooled(file), fmt), run),
+        media_type="application/x-ndjson",
+        headers={"X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("/bulk/{job_id}")
+@limiter.limit("60/minute")
+async def bulk_job(request: Request, job_id: str, user=Depends(verify_token)):
+    """Status and counters of a bulk job"""
+    return await bulk.job_runner.get(job_id, user)
+
+
+@router.get("/bulk/{job_id}/results")
+@limiter.limit("10/minute")
+async def bulk_job_results(request: Request, job_id: str, user=Depends(verify_token), after: int = Query(0, ge=0)):
+    """Row results of a bulk job written so far, after row `after`"""
+    await bulk.job_runner.get(job_id, user)
+    return StreamingResponse(bulk.job_runner.results(job_id, after), media_type="application/x-ndjson",
+                             headers={"X-Accel-Buffering": "no"})
+
+
+# ============================
+#    SCHEDULED TRANSFERS
+# ============================
+@router.post("/schedules", status_code=201)
+@limiter.limit("30/minute")
+async def create_schedule(request: Request, payload: ScheduleIn, user=Depends(verify_token)):
+    """Schedule a one-off, daily or monthly transfer from your own account (or any account for admin)"""
+    if user.get("role") != "admin" and not await ownership.owns_any(user["user_id"], (payload.fromAccount,)):
+        raise HTTPException(403, "Forbidden: can only schedule transfers from your own account")
+
+    doc = scheduler.schedule_doc(payload, user)
+    await schedules.insert_one(doc)
+    return scheduler.schedule_out(doc)
+
+
+@router.get("/schedules")
+@limiter.limit("60/minute")
+async def list_schedules(request: Request, user=Depends(verify_token), status: str | None = None,
+                         limit: int = Query(100, ge=1, le=500)):
+    """Your schedules, newest first"""
+    query = {"userId": str(user["user_id"])}
+    if status:
+        query["status"] = status
+    docs = await schedules.find(query).sort("createdAt", -1).to_list(limit)
+    return [scheduler.schedule_out(d) for d in docs]
+
+
+@router.get("/schedules/{schedule_id}")
+@limiter.limit("60/minute")
+async def get_schedule(request: Request, schedule_id: str, user=Depends(verify_token)):
+    doc = await schedules.find_one({"_id": schedule_id})
+    if not doc:
+        raise HTTPException(404, "Schedule not found")
+    if user.get("role") != "admin" and doc["userId"] != str(user["user_id"]):
+        raise HTTPException(403, "Forbidden")
+    return scheduler.schedule_out(doc)
+
+
+@router.delete("/schedules/{schedule_id}")
+@limiter.limit("30/minute")
+async def cancel_schedule(request: Request, schedule_id: str, user=Depends(verify_token)):
+    """Cancel a schedule; a run already claimed by the scheduler may still be posted"""
+    query = {"_id": schedule_id, "status": scheduler.ACTIVE}
+    if user.get("role") != "admin":
+        query["userId"] = str(user["user_id"])
+    doc = await schedules.find_one_and_update(
+        query, {"$set": {"status": scheduler.CANCELLED, "cancelledAt": datetime.datetime.utcnow()}},
+        return_document=ReturnDocument.AFTER
+    )
+    if not doc:
+        raise HTTPException(404, "Active schedule not found")
+    return scheduler.schedule_out(doc)
+
+
 # ============================
 #    LIST MY TRANSACTIONS
 # ============================
@@ -441,42 +312,146 @@ async def transfer(request: Request, payload: TransferIn, user=Depends(verify_to
 @limiter.limit("60/minute")
 async def list_transactions(
     request: Request,
+    response: Response,
     user=Depends(verify_token),
     fromAccount: str | None = None,
     toAccount: str | None = None,
-    limit: int = Query(50, le=200)
+    limit: int = Query(50, ge=1, le=200),
+    cursor: str | None = None
 ):
-    query = {}
-
+    """Newest first; pass a page's X-Next-Cursor header as `cursor` to get the next page"""
+    user_acc_nums = None
     if user.get("role") != "admin":
-        user_acc_nums = []
-        async for acc in accounts.find({"userId": user["user_id"]}):
-            user_acc_nums.append(acc["accountNumber"])
+        user_acc_nums = await ownership.accounts_of(user["user_id"])
+        requested = [n for n in (fromAccount, toAccount) if n]
+        if requested and not ownership.owned_in(user_acc_nums, requested):
+            user_acc_nums = await ownership.accounts_of(user["user_id"], refresh=True)
 
         if not user_acc_nums:
             return []
 
-        query["$or"] = [
-            {"fromAccount": {"$in": user_acc_nums}},
-            {"toAccount": {"$in": user_acc_nums}},
-        ]
-
-    if fromAccount:
-        query["fromAccount"] = fromAccount
-
-    if toAccount:
-        query["toAccount"] = toAccount
-
-    cur = transactions.find(query).sort("createdAt", -1).limit(limit)
+    # Read the history of one account (one shard); the other side filters it
+    if fromAccount and (user_acc_nums is None or fromAccount in user_acc_nums):
+        query = {"accountNumber": fromAccount, "direction": "debit"}
+        if toAccount:
+            query["toAccount"] = toAccount
+    elif toAccount and (user_acc_nums is None or toAccount in user_acc_nums):
+        query = {"accountNumber": toAccount, "direction": "credit"}
+        if fromAccount:
+            query["fromAccount"] = fromAccount
+    elif fromAccount or toAccount:
+        return []
+    elif user_acc_nums is not None:
+        query = {"accountNumber": {"$in": sorted(user_acc_nums)}}
+    else:
+        query = None  # admin, all transactions
+
+    if query is None:
+        docs, next_cursor = await history.page(transactions, {}, cursor, limit)
+    else:
+        docs, next_cursor = await history.page(account_entries, query, cursor, limit)
+    if next_cursor:
+        response.headers[history.CURSOR_HEADER] = next_cursor
+
+    # A transfer between two of the user's accounts has an entry on each
+    seen = {history.cursor_tx(cursor)} if cursor else set()
     result = []
-    async for tx in cur:
-        tx["id"] = str(tx["_id"])
+    for tx in docs:
+        if tx["txId"] in seen:
+            continue
+        seen.add(tx["txId"])
+        tx["id"] = str(tx.pop("transactionId", None) or tx["_id"])
         tx.pop("_id", None)
         result.append(tx)
 
     return result
 
 
+# ============================
+#    EXPORT STATEMENT
+# ============================
+@router.get("/export")
+@limiter.limit("10/minute")
+async def export_transactions(
+    request: Request,
+    user=Depends(verify_token),
+    accountNumber: list[str] | None = Query(None),
+    start: datetime.date | None = Query(None, alias="from"),
+    end: datetime.date | None = Query(None, alias="to"),
+    format: str = "ndjson"
+):
+    """Stream every transaction of the given accounts (default: all of yours) in [from, to], oldest first"""
+    if format not in export.formats():
+        raise HTTPException(400, f"format must be one of: {', '.join(export.formats())}")
+
+    numbers = accountNumber
+    if user.get("role") != "admin":
+        owned = await ownership.accounts_of(user["user_id"])
+        if numbers and not set(numbers) <= owned:
+            owned = await ownership.accounts_of(user["user_id"], refresh=True)
+            if not set(numbers) <= owned:
+                raise HTTPException(403, "Forbidden: can only export your own accounts")
+        numbers = numbers or sorted(owned)
+        if not numbers:
+            raise HTTPException(404, "No accounts to export")
+
+    query = export.date_range(start, end)
+    if numbers:
+        collection = account_entries
+        query["accountNumber"] = {"$in": numbers}
+    else:
+        collection = transactions  # admin, all transactions
+    cursor = collection.find(query, export.PROJECTION).sort([("createdAt", 1), ("_id", 1)])
+
+    filename = f"statement-{start or 'all'}-{end or 'now'}.{format}"
+    return StreamingResponse(
+        export.encode(format, cursor),
+        media_type=export.MEDIA_TYPES[format],
+        # X-Accel-Buffering: nginx passes the rows on instead of spooling the export
+        headers={"Content-Disposition": f'attachment; filename="{filename}"', "X-Accel-Buffering": "no"},
+    )
+
+
+# ============================
+#    STATEMENT SUMMARY
+# ============================
+@router.get("/summary")
+@limiter.limit("60/minute")
+async def statement_summary(
+    request: Request,
+    accountNumber: str,
+    start: datetime.date = Query(..., alias="from"),
+    end: datetime.date = Query(..., alias="to"),
+    user=Depends(verify_token)
+):
+    """Opening and closing balance, credits, debits and daily totals of an account over [from, to]"""
+    if end < start:
+        raise HTTPException(400, "'to' must not be before 'from'")
+    if user.get("role") != "admin" and not await ownership.owns_any(user["user_id"], (accountNumber,)):
+        raise HTTPException(403, "Forbidden")
+
+    result = await rollups.summary(accountNumber, start, end)
+    if result is None:
+        raise HTTPException(404, "Account not found")
+    return result
+
+
+# ============================
+#    BALANCE AS OF DATE
+# ============================
+@router.get("/balance-as-of")
+@limiter.limit("60/minute")
+async def balance_as_of(request: Request, accountNumber: str, date: datetime.date, user=Depends(verify_token)):
+    """Balance of an account at the end of `date` (UTC)"""
+    if user.get("role") != "admin" and not await ownership.owns_any(user["user_id"], (accountNumber,)):
+        raise HTTPException(403, "Forbidden")
+
+    balance = await rollups.balance_as_of(accountNumber, date)
+    if balance is None:
+        raise HTTPException(404, "Account not found")
+    return {"accountNumber": accountNumber, "date": date.isoformat(), "balance": balance}
+
+
 # ============================
 #    GET TRANSACTION BY ID
 # ============================
@@ -489,11 +464,7 @@ async def get_transaction(request: Request, transaction_id: str, user=Depends(ve
         raise HTTPException(404, "Transaction not found")
 
     if user.get("role") != "admin":
-        user_accounts = []
-        async for acc in accounts.find({"userId": user["user_id"]}):
-            user_accounts.append(acc["accountNumber"])
-
-        if tx["fromAccount"] not in user_accounts and tx["toAccount"] not in user_accounts:
+        if not await ownership.owns_any(user["user_id"], (tx["fromAccount"], tx["toAccount"])):
             raise HTTPException(403, "Forbidden")
 
     tx["id"] = str(tx["_id"])
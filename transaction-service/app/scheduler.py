@@ -0,0 +1,211 @@
+"""
+Scheduled and recurring transfers.
+
+A schedule in the `schedules` collection is a transfer to make once, daily
+or monthly from `startAt` (the time of day, and for monthly schedules the
+day of the month, come from it; the 31st falls back to the last day of
+shorter months) until an optional `endAt`. `nextRunAt` is the next run due.
+
+Every instance runs the scheduler loop; due schedules are claimed in
+batches rather than by one global lease, so several replicas share a
+month-end peak:
+
+  - up to SCHEDULER_BATCH due, unclaimed schedules are stamped with this
+    instance and a claim token by one update_many, and read back by token;
+  - each claimed schedule's run is submitted to the posting engine, whose
+    per-account queues batch the runs of one source account into one
+    transaction;
+  - the schedules are then advanced by one bulk_write, filtered on the
+    claim, so an instance whose claim expired cannot advance them.
+
+A run is posted with the idempotency key "schedule:<id>:<runAt>", recorded
+in the posting's transaction: if an instance dies between posting and
+advancing, the next claim replays the recorded result instead of moving the
+money twice. A schedule advances one run per claim, so runs missed while
+no instance was up are caught up in order, one pass at a time.
+
+Rejected runs (insufficient funds, frozen account) are recorded on the
+schedule and skipped; runs that failed for any other reason keep their
+`nextRunAt` and are retried once the claim expires.
+"""
+from bson import ObjectId
+from calendar import monthrange
+from fastapi import HTTPException
+from pymongo import UpdateOne
+from .db import schedules
+from .idempotency import Idempotency
+from .posting import Posting, posting_engine
+from . import ids
+import asyncio
+import datetime
+import json
+import os
+import uuid
+
+SCHEDULER_INTERVAL = float(os.getenv("SCHEDULER_INTERVAL", 5.0))
+SCHEDULER_BATCH = int(os.getenv("SCHEDULER_BATCH", 1000))
+SCHEDULER_CLAIM_SECONDS = float(os.getenv("SCHEDULER_CLAIM_SECONDS", 120))
+
+ACTIVE, COMPLETED, CANCELLED = "active", "completed", "cancelled"
+
+
+def utc(ts: datetime.datetime) -> datetime.datetime:
+    """Naive UTC, as stored by the rest of the service"""
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return ts
+
+
+def next_run(schedule: dict, run_at: datetime.datetime):
+    """The run after `run_at`, or None when the schedule is finished"""
+    if schedule["frequency"] == "daily":
+        following = run_at + datetime.timedelta(days=1)
+    elif schedule["frequency"] == "monthly":
+        year, month = divmod(run_at.month, 12)
+        year, month = run_at.year + year, month + 1
+        day = min(schedule["startAt"].day, monthrange(year, month)[1])
+        following = run_at.replace(year=year, month=month, day=day)
+    else:
+        return None
+    if schedule.get("endAt") and following > schedule["endAt"]:
+        return None
+    return following
+
+
+def schedule_doc(payload, user: dict) -> dict:
+    start = utc(payload.startAt)
+    end = utc(payload.endAt) if payload.endAt else None
+    if end and end < start:
+        raise HTTPException(400, "endAt must not be before startAt")
+    return {
+        "_id": ids.new_id("SCH"),
+        "userId": str(user.get("user_id")),
+        "role": user.get("role"),
+        "fromAccount": payload.fromAccount,
+        "toAccount": payload.toAccount,
+        "amount": payload.amount,
+        "currency": payload.currency,
+        "frequency": payload.frequency,
+        "startAt": start,
+        "endAt": end,
+        "nextRunAt": start,
+        "status": ACTIVE,
+        "runs": 0,
+        "failures": 0,
+        "createdAt": datetime.datetime.utcnow(),
+    }
+
+
+def schedule_out(doc: dict) -> dict:
+    doc = {k: v for k, v in doc.items() if k not in ("claimedBy", "claimToken", "claimedUntil")}
+    doc["id"] = doc.pop("_id")
+    return doc
+
+
+class Scheduler:
+    def __init__(self):
+        self.owner = f"{os.getenv('HOSTNAME', 'transaction-service')}:{uuid.uuid4().hex[:8]}"
+        self.task = None
+        self.counters = {"claimed": 0, "posted": 0, "replayed": 0, "rejected": 0, "retried": 0, "completed": 0}
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+
+    async def run(self):
+        print(f"✅ Scheduler started ({self.owner})")
+        while True:
+            try:
+                while await self.run_due() == SCHEDULER_BATCH:
+                    pass  # more is due
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"⚠️ Scheduler error: {e}")
+            await asyncio.sleep(SCHEDULER_INTERVAL)
+
+    async def claim(self, now: datetime.datetime) -> list:
+        """Claim up to SCHEDULER_BATCH due schedules, oldest run first"""
+        due = {"status": ACTIVE, "nextRunAt": {"$lte": now},
+               "$or": [{"claimedUntil": None}, {"claimedUntil": {"$lt": now}}]}
+        candidates = [d["_id"] async for d in schedules.find(due, {"_id": 1})
+                      .sort("nextRunAt", 1).limit(SCHEDULER_BATCH)]
+        if not candidates:
+            return []
+
+        token = ObjectId()
+        await schedules.update_many(
+            {"_id": {"$in": candidates}, **due},
+            {"$set": {"claimedBy": self.owner, "claimToken": token,
+                      "claimedUntil": now + datetime.timedelta(seconds=SCHEDULER_CLAIM_SECONDS)}}
+        )
+        # Another instance may have claimed some of them in between
+        return await schedules.find({"_id": {"$in": candidates}, "claimToken": token}).to_list(None)
+
+    async def run_due(self) -> int:
+        """Post one run of each claimed schedule; returns how many were claimed"""
+        now = datetime.datetime.utcnow()
+        claimed = await self.claim(now)
+        if not claimed:
+            return 0
+        self.counters["claimed"] += len(claimed)
+
+        outcomes = await asyncio.gather(*[self.execute(s) for s in claimed])
+        updates = [self.advance(s, outcome, now) for s, outcome in zip(claimed, outcomes)]
+        await schedules.bulk_write(updates, ordered=False)
+        return len(claimed)
+
+    async def execute(self, schedule: dict):
+        """Response of the schedule's due run, or the HTTPException it was rejected with"""
+        run_at = schedule["nextRunAt"]
+        user = {"user_id": schedule["userId"], "role": schedule.get("role")}
+        idem = Idempotency("schedule", user, f"schedule:{schedule['_id']}:{run_at.isoformat()}",
+                           [schedule["fromAccount"], schedule["toAccount"], schedule["amount"]])
+        try:
+            return await posting_engine.submit(Posting(
+                "TRANSFER", schedule["fromAccount"], schedule["toAccount"], schedule["amount"],
+                schedule["currency"], user, ids.new_id("TXN"), idem=idem
+            ))
+        except HTTPException as e:
+            return e
+        except Exception as e:
+            # Posted by an earlier claim that did not get to advance the schedule
+            replay = await idem.recover(e)
+            if replay is not None:
+                self.counters["replayed"] += 1
+                return json.loads(replay.body)
+            print(f"⚠️ Schedule {schedule['_id']} run at {run_at} failed: {e}")
+            return e
+
+    def advance(self, schedule: dict, outcome, now: datetime.datetime) -> UpdateOne:
+        claim = {"_id": schedule["_id"], "claimToken": schedule["claimToken"]}
+        release = {"claimedBy": "", "claimToken": "", "claimedUntil": ""}
+        run_at = schedule["nextRunAt"]
+
+        if isinstance(outcome, Exception) and (
+            not isinstance(outcome, HTTPException) or outcome.status_code >= 500
+        ):
+            # Keep the run and the claim: it is retried once the claim expires
+            self.counters["retried"] += 1
+            return UpdateOne(claim, {"$set": {"lastError": str(outcome), "lastErrorAt": now}})
+
+        following = next_run(schedule, run_at)
+        fields = {"nextRunAt": following, "lastRunAt": run_at}
+        if following is None:
+            fields["status"] = COMPLETED
+            self.counters["completed"] += 1
+        if isinstance(outcome, HTTPException):
+            self.counters["rejected"] += 1
+            fields["lastResult"] = {"status": "error", "code": outcome.status_code, "detail": outcome.detail}
+            inc = {"runs": 1, "failures": 1}
+        else:
+            self.counters["posted"] += 1
+            fields["lastResult"] = outcome
+            inc = {"runs": 1}
+        return UpdateOne(claim, {"$set": fields, "$inc": inc, "$unset": release})
+
+
+scheduler = Scheduler()
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Optional
+from typing import Literal, Optional
 from datetime import datetime
 
 # ============================
@@ -27,6 +27,16 @@ class TransferIn(BaseModel):
     amount: float = Field(..., gt=0, description="Amount to transfer (must be positive)")
     currency: str = Field(default="USD", description="Currency code")
 
+class ScheduleIn(BaseModel):
+    """Schema for a scheduled or recurring transfer"""
+    fromAccount: str = Field(..., description="Source account number")
+    toAccount: str = Field(..., description="Destination account number")
+    amount: float = Field(..., gt=0, description="Amount of each transfer (must be positive)")
+    currency: str = Field(default="USD", description="Currency code")
+    frequency: Literal["once", "daily", "monthly"] = Field(..., description="How often the transfer runs")
+    startAt: datetime = Field(..., description="First run; sets the time of day (and day of month) of later runs")
+    endAt: Optional[datetime] = Field(None, description="No runs after this time")
+
 class TransactionOut(BaseModel):
     """Schema for transaction output"""
     id: str
@@ -0,0 +1,137 @@
+"""
+Shared runner for Mongo transactions.
+
+run(op, callback) runs `callback(session)` in a transaction and commits it,
+retrying the way the driver's with_transaction does, but with jittered
+exponential backoff and a deadline of our own:
+
+  - TransientTransactionError (write conflicts, a shard stepping down, a
+    cross-shard commit aborted): abort and run the callback again;
+  - UnknownTransactionCommitResult: commit again (commit is idempotent), the
+    callback must not run twice for a commit that may have succeeded.
+
+Once TX_DEADLINE has passed the error is returned to the caller as a 503
+with Retry-After instead of a failed request; for a commit whose result is
+still unknown, the 503 asks for a retry with the same Idempotency-Key. The callback may therefore
+run several times and must not have side effects outside the session.
+
+Retries, write conflicts and commit latency are counted per operation type
+and shown on /stats.
+"""
+from collections import deque
+from fastapi import HTTPException
+from pymongo.errors import PyMongoError
+from .db import db
+import asyncio
+import os
+import random
+import time
+
+TX_DEADLINE = float(os.getenv("TX_DEADLINE", 10.0))
+TX_BACKOFF_BASE = float(os.getenv("TX_BACKOFF_BASE", 0.005))
+TX_BACKOFF_MAX = float(os.getenv("TX_BACKOFF_MAX", 0.5))
+TX_LATENCY_SAMPLES = int(os.getenv("TX_LATENCY_SAMPLES", 1000))
+
+WRITE_CONFLICT = 112
+
+
+def has_label(error: Exception, label: str) -> bool:
+    return isinstance(error, PyMongoError) and error.has_error_label(label)
+
+
+class OperationStats:
+    def __init__(self):
+        self.counters = {"transactions": 0, "committed": 0, "failed": 0, "retries": 0,
+                         "write_conflicts": 0, "commit_retries": 0, "deadline_exceeded": 0}
+        self.commit_latency = deque(maxlen=TX_LATENCY_SAMPLES)
+
+    def snapshot(self) -> dict:
+        ordered = sorted(self.commit_latency)
+        latency = {}
+        if ordered:
+            latency = {f"p{q}_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * q / 100))] * 1000, 2)
+                       for q in (50, 95, 99)}
+        return {**self.counters, "commit_latency": latency}
+
+
+class TransactionRunner:
+    def __init__(self):
+        self.stats = {}  # operation type -> OperationStats
+
+    async def run(self, op: str, callback):
+        """Result of `callback(session)` once its transaction committed"""
+        stats = self.stats.setdefault(op, OperationStats())
+        stats.counters["transactions"] += 1
+        deadline = time.monotonic() + TX_DEADLINE
+        attempt = 0
+
+        async with await db.client.start_session() as session:
+            while True:
+                attempt += 1
+                session.start_transaction()
+                try:
+                    result = await callback(session)
+                except Exception as e:
+                    if session.in_transaction:
+                        await session.abort_transaction()
+                    if has_label(e, "TransientTransactionError"):
+                        await self.retry(stats, e, attempt, deadline)
+                        continue
+                    stats.counters["failed"] += 1
+                    raise
+
+                try:
+                    await self.commit(session, stats, deadline)
+                    return result
+                except PyMongoError as e:
+                    if has_label(e, "TransientTransactionError"):
+                        await self.retry(stats, e, attempt, deadline)
+                        continue
+                    stats.counters["failed"] += 1
+                    raise
+
+    async def commit(self, session, stats: OperationStats, deadline: float):
+        attempt = 0
+        while True:
+            attempt += 1
+            start = time.monotonic()
+            try:
+                await session.commit_transaction()
+                stats.commit_latency.append(time.monotonic() - start)
+                stats.counters["committed"] += 1
+                return
+            except PyMongoError as e:
+                if not has_label(e, "UnknownTransactionCommitResult"):
+                    raise
+                if time.monotonic() >= deadline:
+                    # The commit may have gone through: not a failure the client may act on
+                    stats.counters["deadline_exceeded"] += 1
+                    stats.counters["failed"] += 1
+                    raise HTTPException(503, "Transaction outcome unknown, retry with the same Idempotency-Key",
+                                        headers={"Retry-After": "1"})
+                stats.counters["commit_retries"] += 1
+                await asyncio.sleep(self.backoff(attempt))
+
+    async def retry(self, stats: OperationStats, error: PyMongoError, attempt: int, deadline: float):
+        """Back off before the next attempt, or give up with a 503 past the deadline"""
+        if getattr(error, "code", None) == WRITE_CONFLICT:
+            stats.counters["write_conflicts"] += 1
+        delay = self.backoff(attempt)
+        if time.monotonic() + delay >= deadline:
+            stats.counters["deadline_exceeded"] += 1
+            stats.counters["failed"] += 1
+            raise HTTPException(503, "Too many concurrent updates to this account, please retry",
+                                headers={"Retry-After": "1"})
+        stats.counters["retries"] += 1
+        await asyncio.sleep(delay)
+
+    @staticmethod
+    def backoff(attempt: int) -> float:
+        """Full jitter: uniform in [0, min(max, base * 2^attempt)]"""
+        return random.uniform(0, min(TX_BACKOFF_MAX, TX_BACKOFF_BASE * 2 ** attempt))
+
+    def snapshot(self) -> dict:
+        return {op: stats.snapshot() for op, stats in self.stats.items()}
+
+
+txrunner = TransactionRunner()
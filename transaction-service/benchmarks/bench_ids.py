@@ -0,0 +1,81 @@
+"""
+Benchmark: random vs. time-ordered transaction ids.
+
+  generate  ids per second from one thread: "TXN-" + uuid4().hex[:12] (the
+            old ids) vs. app.ids.new_id("TXN")
+  insert    documents per second inserted with insert_many into a scratch
+            collection with a unique txId index (like txId_unique on
+            banking.transactions), then the size of that index; random ids
+            land on random index pages, time-ordered ones at the right edge
+
+The insert phase is only meaningful once the index outgrows the WiredTiger
+cache; raise --docs until it does on the machine under test.
+
+Usage (from transaction-service/):
+    MONGO_URI=mongodb://localhost:27017 python -m benchmarks.bench_ids [--ids 1000000] [--docs 2000000]
+"""
+import argparse
+import os
+import time
+import uuid
+from pymongo import ASCENDING, MongoClient
+from app import ids
+
+MONGO_URI = os.getenv("MONGO_URI", "mongodb://mongos:27017")
+BENCH_DB = "bench_ids"
+
+GENERATORS = {
+    "random": lambda: f"TXN-{uuid.uuid4().hex[:12]}",
+    "ordered": lambda: ids.new_id("TXN"),
+}
+
+
+def generate(name, count):
+    make = GENERATORS[name]
+    start = time.perf_counter()
+    for _ in range(count):
+        make()
+    elapsed = time.perf_counter() - start
+    print(f"{name:<10}{count / elapsed:>14,.0f} ids/s{elapsed / count * 1e9:>10,.0f} ns/id")
+
+
+def insert(db, name, count, batch):
+    collection = db[f"tx_{name}"]
+    collection.drop()
+    collection.create_index([("txId", ASCENDING)], unique=True, name="txId_unique")
+    make = GENERATORS[name]
+
+    start = time.perf_counter()
+    for done in range(0, count, batch):
+        collection.insert_many(
+            [{"txId": make(), "amount": 1.0} for _ in range(min(batch, count - done))], ordered=False
+        )
+    elapsed = time.perf_counter() - start
+
+    size = db.command("collStats", collection.name)["indexSizes"]["txId_unique"]
+    print(f"{name:<10}{count / elapsed:>14,.0f} docs/s{size / 2 ** 20:>12,.1f} MiB txId index")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ids", type=int, default=1000000)
+    parser.add_argument("--docs", type=int, default=2000000)
+    parser.add_argument("--batch", type=int, default=1000)
+    args = parser.parse_args()
+
+    print("-- generate --")
+    for name in GENERATORS:
+        generate(name, args.ids)
+
+    client = MongoClient(MONGO_URI)
+    db = client[BENCH_DB]
+    print("-- insert --")
+    try:
+        for name in GENERATORS:
+            insert(db, name, args.docs, args.batch)
+    finally:
+        client.drop_database(BENCH_DB)
+
+
+if __name__ == "__main__":
+    main()
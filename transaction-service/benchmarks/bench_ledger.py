@@ -0,0 +1,144 @@
+"""
+Benchmark: cross-shard transfers, Mongo transaction vs. two-phase ledger.
+
+Runs random transfers between accounts of a scratch database, sharded like
+`banking.accounts` (hashed accountNumber) so most transfers span two shards,
+from several threads at once, and reports throughput and latency
+percentiles for:
+
+  transaction  start_transaction: conditional debit and credit, insert of
+               the transaction document, commit (the default posting path
+               for a lone posting)
+  ledger       PENDING entry, marked debit, DEBITED, marked credit,
+               CREDITED, insert of the transaction document, marker pull,
+               POSTED (POSTING_MODE=ledger); every step touches one shard
+
+Run it against the 3-shard cluster from docker-compose.yml (through mongos);
+on a plain replica set the collection is not sharded and both paths stay on
+one shard.
+
+Usage (from transaction-service/):
+    MONGO_URI=mongodb://localhost:27017 python benchmarks/bench_ledger.py [--transfers 5000] [--threads 32]
+"""
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import datetime
+import os
+import random
+import statistics
+import time
+import uuid
+from pymongo import MongoClient, ReturnDocument
+from pymongo.errors import OperationFailure, PyMongoError
+
+MONGO_URI = os.getenv("MONGO_URI", "mongodb://mongos:27017")
+BENCH_DB = "bench_ledger"
+
+
+def pick(accounts):
+    return random.sample(accounts, 2)
+
+
+def transaction_transfer(client, db, accounts, amount):
+    a_from, a_to = pick(accounts)
+    while True:
+        try:
+            with client.start_session() as session:
+                with session.start_transaction():
+                    if db.accounts.find_one_and_update(
+                        {"accountNumber": a_from, "status": "active", "balance": {"$gte": amount}},
+                        {"$inc": {"balance": -amount}}, session=session
+                    ) is None:
+                        raise RuntimeError("rejected")
+                    db.accounts.update_one({"accountNumber": a_to, "status": "active"},
+                                           {"$inc": {"balance": amount}}, session=session)
+                    db.transactions.insert_one({"txId": f"TXN-{uuid.uuid4().hex[:12]}", "amount": amount},
+                                               session=session)
+            return
+        except PyMongoError as e:
+            if not e.has_error_label("TransientTransactionError"):
+                raise
+
+
+def ledger_transfer(client, db, accounts, amount):
+    a_from, a_to = pick(accounts)
+    tx_id = f"TXN-{uuid.uuid4().hex[:12]}"
+
+    def step(current, new):
+        db.ledger.update_one({"_id": tx_id, "status": current},
+                             {"$set": {"status": new, "updatedAt": datetime.datetime.utcnow()}})
+
+    db.ledger.insert_one({"_id": tx_id, "status": "PENDING", "debit": a_from, "credit": a_to,
+                          "amount": amount, "updatedAt": datetime.datetime.utcnow()})
+    if db.accounts.find_one_and_update(
+        {"accountNumber": a_from, "status": "active", "balance": {"$gte": amount}, "pendingTx": {"$ne": tx_id}},
+        {"$inc": {"balance": -amount}, "$push": {"pendingTx": tx_id}},
+        return_document=ReturnDocument.AFTER
+    ) is None:
+        step("PENDING", "FAILED")
+        raise RuntimeError("rejected")
+    step("PENDING", "DEBITED")
+    db.accounts.update_one({"accountNumber": a_to, "status": "active", "pendingTx": {"$ne": tx_id}},
+                           {"$inc": {"balance": amount}, "$push": {"pendingTx": tx_id}})
+    step("DEBITED", "CREDITED")
+    db.transactions.insert_one({"txId": tx_id, "amount": amount})
+    db.accounts.update_many({"accountNumber": {"$in": [a_from, a_to]}, "pendingTx": tx_id},
+                            {"$pull": {"pendingTx": tx_id}})
+    step("CREDITED", "POSTED")
+
+
+def run(name, fn, client, db, accounts, transfers, threads):
+    db.accounts.delete_many({})
+    db.transactions.delete_many({})
+    db.ledger.delete_many({})
+    db.accounts.insert_many([
+        {"accountNumber": n, "userId": "bench", "status": "active", "balance": float(transfers)} for n in accounts
+    ])
+
+    def timed(_):
+        start = time.perf_counter()
+        fn(client, db, accounts, 1.0)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        latencies = sorted(pool.map(timed, range(transfers)))
+    elapsed = time.perf_counter() - start
+
+    p50 = statistics.median(latencies) * 1000
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000
+    print(f"{name:<12}{transfers / elapsed:>10.0f}{p50:>10.2f}{p99:>10.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--transfers", type=int, default=5000)
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--accounts", type=int, default=200)
+    args = parser.parse_args()
+
+    client = MongoClient(MONGO_URI, maxPoolSize=args.threads * 2)
+    db = client[BENCH_DB]
+    try:
+        client.admin.command("enableSharding", BENCH_DB)
+        client.admin.command("shardCollection", f"{BENCH_DB}.accounts", key={"accountNumber": "hashed"})
+        client.admin.command("shardCollection", f"{BENCH_DB}.ledger", key={"_id": "hashed"})
+        client.admin.command("shardCollection", f"{BENCH_DB}.transactions", key={"txId": "hashed"})
+    except OperationFailure as e:
+        print(f"(collections not sharded: {e})")
+    # Collections must exist before they are written to inside a transaction
+    for name in ("accounts", "transactions", "ledger"):
+        if name not in db.list_collection_names():
+            db.create_collection(name)
+
+    accounts = [f"BENCH-{i:05d}" for i in range(args.accounts)]
+    print(f"{'path':<12}{'tx/s':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    try:
+        run("transaction", transaction_transfer, client, db, accounts, args.transfers, args.threads)
+        run("ledger", ledger_transfer, client, db, accounts, args.transfers, args.threads)
+    finally:
+        client.drop_database(BENCH_DB)
+
+
+if __name__ == "__main__":
+    main()
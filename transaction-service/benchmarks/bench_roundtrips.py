@@ -0,0 +1,122 @@
+"""
+Benchmark: Mongo round trips per transfer, read-check-update vs. conditional debit.
+
+Runs the same transfers two ways against a scratch database and counts the
+commands sent to mongos with a pymongo CommandListener:
+
+  legacy       find_one x2, then unconditional $inc x2, insert, commit
+               (plus up to 2 Redis GETs when the accounts came from cache;
+               not counted here)
+  conditional  find_one_and_update x2 with status/balance/owner in the
+               filter, insert, commit; the accounts are only read when an
+               update matches nothing
+
+Needs a MongoDB that supports transactions (replica set or sharded cluster).
+
+Usage (from transaction-service/):
+    MONGO_URI=mongodb://localhost:27017 python benchmarks/bench_roundtrips.py [--transfers 500]
+"""
+from collections import Counter
+import argparse
+import os
+import time
+import uuid
+from pymongo import MongoClient, ReturnDocument, monitoring
+
+MONGO_URI = os.getenv("MONGO_URI", "mongodb://mongos:27017")
+BENCH_DB = "bench_roundtrips"
+
+
+class CommandCounter(monitoring.CommandListener):
+    def __init__(self):
+        self.commands = Counter()
+        self.enabled = False
+
+    def started(self, event):
+        if self.enabled:
+            self.commands[event.command_name] += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def legacy_transfer(client, db, amount):
+    a_from = db.accounts.find_one({"accountNumber": "BENCH-FROM"})
+    a_to = db.accounts.find_one({"accountNumber": "BENCH-TO"})
+    if a_from["status"] != "active" or a_to["status"] != "active" or a_from["balance"] < amount:
+        raise RuntimeError("rejected")
+
+    with client.start_session() as session:
+        with session.start_transaction():
+            db.accounts.update_one({"accountNumber": "BENCH-FROM"}, {"$inc": {"balance": -amount}}, session=session)
+            db.accounts.update_one({"accountNumber": "BENCH-TO"}, {"$inc": {"balance": amount}}, session=session)
+            db.transactions.insert_one({"txId": f"TXN-{uuid.uuid4().hex[:12]}", "amount": amount}, session=session)
+
+
+def conditional_transfer(client, db, amount):
+    with client.start_session() as session:
+        with session.start_transaction():
+            a_from = db.accounts.find_one_and_update(
+                {"accountNumber": "BENCH-FROM", "status": "active", "balance": {"$gte": amount}, "userId": "bench"},
+                {"$inc": {"balance": -amount}},
+                return_document=ReturnDocument.AFTER,
+                session=session,
+            )
+            a_to = db.accounts.find_one_and_update(
+                {"accountNumber": "BENCH-TO", "status": "active"},
+                {"$inc": {"balance": amount}},
+                return_document=ReturnDocument.AFTER,
+                session=session,
+            )
+            if a_from is None or a_to is None:
+                list(db.accounts.find({"accountNumber": {"$in": ["BENCH-FROM", "BENCH-TO"]}}, session=session))
+                raise RuntimeError("rejected")
+            db.transactions.insert_one({"txId": f"TXN-{uuid.uuid4().hex[:12]}", "amount": amount}, session=session)
+
+
+def run(name, fn, client, db, counter, transfers):
+    db.accounts.delete_many({})
+    db.accounts.insert_many([
+        {"accountNumber": "BENCH-FROM", "userId": "bench", "status": "active", "balance": float(transfers)},
+        {"accountNumber": "BENCH-TO", "userId": "bench", "status": "active", "balance": 0.0},
+    ])
+
+    counter.commands.clear()
+    counter.enabled = True
+    start = time.perf_counter()
+    for _ in range(transfers):
+        fn(client, db, 1.0)
+    elapsed = time.perf_counter() - start
+    counter.enabled = False
+
+    per_transfer = sum(counter.commands.values()) / transfers
+    detail = ", ".join(f"{cmd}={n / transfers:g}" for cmd, n in sorted(counter.commands.items()))
+    print(f"{name:<12}{per_transfer:>10.1f}{elapsed / transfers * 1000:>12.2f}   {detail}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--transfers", type=int, default=500)
+    args = parser.parse_args()
+
+    counter = CommandCounter()
+    client = MongoClient(MONGO_URI, event_listeners=[counter])
+    db = client[BENCH_DB]
+    # Collections must exist before they are written to inside a transaction
+    for name in ("accounts", "transactions"):
+        if name not in db.list_collection_names():
+            db.create_collection(name)
+
+    print(f"{'path':<12}{'cmds/tx':>10}{'ms/tx':>12}   per command")
+    try:
+        run("legacy", legacy_transfer, client, db, counter, args.transfers)
+        run("conditional", conditional_transfer, client, db, counter, args.transfers)
+    finally:
+        client.drop_database(BENCH_DB)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""
+Benchmark: month-end peak, N schedules due at the same moment.
+
+Seeds a scratch database with N monthly schedules due now, paying out of a
+few source accounts into many destination accounts, then drains them from
+several threads at once, each standing in for one service replica and
+doing what app/scheduler.py does per batch:
+
+  claim    find due ids, update_many with a claim token, read back by token
+  post     one transaction per source account in the batch: $inc per
+           account by bulk_write, insert of the transaction and
+           idempotency documents (what the posting engine's batches write)
+  advance  bulk_write of nextRunAt, filtered on the claim token
+
+and reports schedules per second, the time spent in each phase, and whether
+any schedule was run twice (transactions written vs. schedules).
+
+Run it against the 3-shard cluster from docker-compose.yml (through mongos).
+
+Usage (from transaction-service/):
+    MONGO_URI=mongodb://localhost:27017 python -m benchmarks.bench_scheduler [--schedules 1000000] [--replicas 4]
+"""
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import datetime
+import os
+import threading
+import time
+from bson import ObjectId
+from pymongo import InsertOne, MongoClient, UpdateOne
+from pymongo.errors import OperationFailure, PyMongoError
+from app import ids
+
+MONGO_URI = os.getenv("MONGO_URI", "mongodb://mongos:27017")
+BENCH_DB = "bench_scheduler"
+
+
+def seed(db, count, sources, destinations):
+    now = datetime.datetime.utcnow()
+    db.accounts.insert_many([{"accountNumber": f"SRC-{i:04d}", "balance": 1e12, "status": "active"}
+                             for i in range(sources)])
+    db.accounts.insert_many([{"accountNumber": f"DST-{i:06d}", "balance": 0.0, "status": "active"}
+                             for i in range(destinations)])
+    db.schedules.create_index([("status", 1), ("nextRunAt", 1)])
+    for start in range(0, count, 10000):
+        db.schedules.insert_many([{
+            "_id": ids.new_id("SCH"),
+            "fromAccount": f"SRC-{i % sources:04d}",
+            "toAccount": f"DST-{i % destinations:06d}",
+            "amount": 1.0,
+            "frequency": "monthly",
+            "nextRunAt": now,
+            "status": "active",
+        } for i in range(start, min(count, start + 10000))], ordered=False)
+
+
+def claim(db, owner, batch, now):
+    due = {"status": "active", "nextRunAt": {"$lte": now},
+           "$or": [{"claimedUntil": None}, {"claimedUntil": {"$lt": now}}]}
+    candidates = [d["_id"] for d in db.schedules.find(due, {"_id": 1}).sort("nextRunAt", 1).limit(batch)]
+    if not candidates:
+        return []
+    token = ObjectId()
+    db.schedules.update_many({"_id": {"$in": candidates}, **due},
+                             {"$set": {"claimedBy": owner, "claimToken": token,
+                                       "claimedUntil": now + datetime.timedelta(minutes=2)}})
+    return list(db.schedules.find({"_id": {"$in": candidates}, "claimToken": token}))
+
+
+def post(client, db, claimed):
+    by_source = defaultdict(list)
+    for s in claimed:
+        by_source[s["fromAccount"]].append(s)
+    for source, runs in by_source.items():
+        deltas = defaultdict(float)
+        for s in runs:
+            deltas[source] -= s["amount"]
+            deltas[s["toAccount"]] += s["amount"]
+        while True:
+            try:
+                with client.start_session() as session:
+                    with session.start_transaction():
+                        db.accounts.bulk_write([UpdateOne({"accountNumber": n}, {"$inc": {"balance": d}})
+                                                for n, d in deltas.items()], ordered=False, session=session)
+                        db.transactions.bulk_write([InsertOne({
+                            "txId": ids.new_id("TXN"), "fromAccount": source, "toAccount": s["toAccount"],
+                            "amount": s["amount"], "createdAt": datetime.datetime.utcnow(),
+                        }) for s in runs], ordered=False, session=session)
+                        db.idempotency.insert_many([{"_id": f"bench:schedule:{s['_id']}:{s['nextRunAt'].isoformat()}"}
+                                                    for s in runs], ordered=False, session=session)
+                break
+            except PyMongoError as e:
+                if not e.has_error_label("TransientTransactionError"):
+                    raise
+
+
+def advance(db, claimed):
+    db.schedules.bulk_write([UpdateOne(
+        {"_id": s["_id"], "claimToken": s["claimToken"]},
+        {"$set": {"nextRunAt": s["nextRunAt"] + datetime.timedelta(days=30), "lastRunAt": s["nextRunAt"]},
+         "$unset": {"claimedBy": "", "claimToken": "", "claimedUntil": ""}, "$inc": {"runs": 1}}
+    ) for s in claimed], ordered=False)
+
+
+def replica(client, db, name, batch, phases, lock):
+    owner = f"bench-{name}"
+    done = 0
+    while True:
+        now = datetime.datetime.utcnow()
+        marks = [time.perf_counter()]
+        claimed = claim(db, owner, batch, now)
+        if not claimed:
+            return done
+        marks.append(time.perf_counter())
+        post(client, db, claimed)
+        marks.append(time.perf_counter())
+        advance(db, claimed)
+        marks.append(time.perf_counter())
+        with lock:
+            for phase, (a, b) in zip(("claim", "post", "advance"), zip(marks, marks[1:])):
+                phases[phase] += b - a
+        done += len(claimed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--schedules", type=int, default=1000000)
+    parser.add_argument("--replicas", type=int, default=4)
+    parser.add_argument("--batch", type=int, default=1000)
+    parser.add_argument("--sources", type=int, default=100)
+    parser.add_argument("--destinations", type=int, default=100000)
+    args = parser.parse_args()
+
+    client = MongoClient(MONGO_URI, maxPoolSize=args.replicas * 4)
+    db = client[BENCH_DB]
+    try:
+        client.admin.command("enableSharding", BENCH_DB)
+        client.admin.command("shardCollection", f"{BENCH_DB}.accounts", key={"accountNumber": "hashed"})
+        client.admin.command("shardCollection", f"{BENCH_DB}.schedules", key={"_id": "hashed"})
+        client.admin.command("shardCollection", f"{BENCH_DB}.transactions", key={"txId": "hashed"})
+        client.admin.command("shardCollection", f"{BENCH_DB}.idempotency", key={"_id": "hashed"})
+    except OperationFailure as e:
+        print(f"(collections not sharded: {e})")
+    # Collections must exist before they are written to inside a transaction
+    for name in ("accounts", "transactions", "idempotency", "schedules"):
+        if name not in db.list_collection_names():
+            db.create_collection(name)
+
+    try:
+        start = time.perf_counter()
+        seed(db, args.schedules, args.sources, args.destinations)
+        print(f"seeded {args.schedules:,} schedules in {time.perf_counter() - start:.1f}s")
+
+        phases, lock = defaultdict(float), threading.Lock()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(args.replicas) as pool:
+            done = sum(pool.map(lambda i: replica(client, db, i, args.batch, phases, lock), range(args.replicas)))
+        elapsed = time.perf_counter() - start
+
+        busy = sum(phases.values()) or 1
+        print(f"{done:,} runs by {args.replicas} replicas in {elapsed:.1f}s: {done / elapsed:,.0f} schedules/s")
+        print("  " + ", ".join(f"{p} {t / busy:.0%}" for p, t in phases.items()))
+        written = db.transactions.estimated_document_count()
+        if written == args.schedules:
+            print(f"  ✓ {written:,} transactions: every schedule ran once")
+        else:
+            print(f"  ⚠️ {written:,} transactions for {args.schedules:,} schedules")
+    finally:
+        client.drop_database(BENCH_DB)
+
+
+if __name__ == "__main__":
+    main()
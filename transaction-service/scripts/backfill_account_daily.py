@@ -0,0 +1,103 @@
+"""
+Rebuild `account_daily` rollups and checkpoints from `account_entries`.
+
+For each account, its entries before today (UTC) are grouped by day, and the
+days are walked back from the current balance: each day gets its credits,
+debits and count, its opening balance and a `closing` checkpoint. The balance,
+today's entries and the history are read from one snapshot per account, so
+postings made while the job runs do not skew the result. Today is left to
+the live updates, so the job can run while the service is posting.
+
+Run scripts/backfill_account_entries.py first if transactions predate the
+per-account history.
+
+Usage (from transaction-service/):
+    MONGO_URI=mongodb://localhost:27017 python -m scripts.backfill_account_daily [--account ACC-001]
+"""
+import argparse
+import datetime
+import os
+from pymongo import MongoClient, ReplaceOne
+from app.rollups import day_of, rollup_id
+
+MONGO_URI = os.getenv("MONGO_URI", "mongodb://mongos:27017")
+
+
+def signed_amount():
+    return {"$cond": [{"$eq": ["$direction", "credit"]}, "$amount", {"$multiply": ["$amount", -1]}]}
+
+
+def current_balance(db, number, session):
+    a = db.accounts.find_one({"accountNumber": number}, session=session)
+    if a is None:
+        return None
+    if not a.get("buckets"):
+        return a.get("balance", 0.0)
+    keys = [f"{number}:{i}" for i in range(a["buckets"])]
+    return sum(b.get("balance", 0.0) for b in db.account_buckets.find({"bucketKey": {"$in": keys}}, session=session))
+
+
+def rebuild(client, db, number, today) -> int:
+    with client.start_session(snapshot=True) as session:
+        balance = current_balance(db, number, session)
+        if balance is None:
+            return 0
+        for t in db.account_entries.aggregate([
+            {"$match": {"accountNumber": number, "createdAt": {"$gte": today}}},
+            {"$group": {"_id": None, "net": {"$sum": signed_amount()}}},
+        ], session=session):
+            balance -= t["net"]
+
+        days = list(db.account_entries.aggregate([
+            {"$match": {"accountNumber": number, "createdAt": {"$lt": today}}},
+            {"$group": {
+                "_id": {"$dateTrunc": {"date": "$createdAt", "unit": "day"}},
+                "credits": {"$sum": {"$cond": [{"$eq": ["$direction", "credit"]}, "$amount", 0]}},
+                "debits": {"$sum": {"$cond": [{"$eq": ["$direction", "debit"]}, "$amount", 0]}},
+                "count": {"$sum": 1},
+            }},
+            {"$sort": {"_id": -1}},
+        ], session=session, allowDiskUse=True))
+
+    now = datetime.datetime.utcnow()
+    writes = []
+    closing = balance
+    for d in days:
+        opening = closing - (d["credits"] - d["debits"])
+        writes.append(ReplaceOne(
+            {"_id": rollup_id(number, d["_id"]), "accountNumber": number},
+            {"accountNumber": number, "day": d["_id"], "credits": d["credits"], "debits": d["debits"],
+             "count": d["count"], "opening": opening, "closing": closing, "checkpointedAt": now},
+            upsert=True
+        ))
+        closing = opening
+    if writes:
+        db.account_daily.bulk_write(writes, ordered=False)
+    # Per-bucket documents of finished days are now merged into the day document
+    db.account_daily.delete_many({"accountNumber": number, "day": {"$lt": today}, "_id": {"$regex": r":\d{4}-\d{2}-\d{2}:\d+$"}})
+    return len(days)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--account", action="append", help="only these accounts (repeatable)")
+    args = parser.parse_args()
+
+    client = MongoClient(MONGO_URI)
+    db = client.get_database("banking")
+    today = day_of(datetime.datetime.utcnow())
+
+    numbers = args.account or [
+        g["_id"] for g in db.account_entries.aggregate([{"$group": {"_id": "$accountNumber"}}], allowDiskUse=True)
+    ]
+    total = 0
+    for i, number in enumerate(numbers, 1):
+        total += rebuild(client, db, number, today)
+        if i % 100 == 0:
+            print(f"  {i}/{len(numbers)} accounts, {total} days")
+
+    print(f"✓ Backfill complete: {total} days for {len(numbers)} accounts")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""
+Backfill `account_entries` from `transactions`.
+
+Transactions written before the per-account history existed have no
+entries, so they are missing from GET /api/transactions. This walks
+`transactions` in _id order and inserts their entries in batches. Entry ids
+are derived from the txId, so the job can be stopped and run again (or run
+while the service is posting) without creating duplicates.
+
+Usage (from transaction-service/):
+    MONGO_URI=mongodb://localhost:27017 python -m scripts.backfill_account_entries [--batch 1000]
+"""
+import argparse
+import os
+from pymongo import MongoClient
+from pymongo.errors import BulkWriteError
+from app.history import entries
+
+MONGO_URI = os.getenv("MONGO_URI", "mongodb://mongos:27017")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch", type=int, default=1000)
+    args = parser.parse_args()
+
+    db = MongoClient(MONGO_URI).get_database("banking")
+    last_id, scanned, inserted = None, 0, 0
+    while True:
+        query = {"_id": {"$gt": last_id}} if last_id is not None else {}
+        batch = list(db.transactions.find(query).sort("_id", 1).limit(args.batch))
+        if not batch:
+            break
+        last_id = batch[-1]["_id"]
+        scanned += len(batch)
+
+        docs = [e for tx in batch if tx.get("createdAt") for e in entries(tx)]
+        try:
+            inserted += len(db.account_entries.insert_many(docs, ordered=False).inserted_ids)
+        except BulkWriteError as e:
+            if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+                raise
+            inserted += e.details.get("nInserted", 0)
+        print(f"  scanned {scanned} transactions, inserted {inserted} entries")
+
+    print(f"✓ Backfill complete: {inserted} entries for {scanned} transactions")
+
+
+if __name__ == "__main__":
+    main()
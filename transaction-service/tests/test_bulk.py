@@ -0,0 +1,80 @@
+"""
+Bulk transfers through the real route: the request body must reach the row
+parser, and every row must get its own result line, in file order.
+
+The posting engine is replaced by a stub that accepts amounts up to 100 and
+rejects larger ones, so no MongoDB or Redis is needed.
+"""
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+from app.main import app
+from app.auth import verify_token
+from app import bulk
+import asyncio
+import json
+import pytest
+
+USER = {"user_id": "u1", "role": "user"}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    async def submit(p):
+        if p.amount > 100:
+            raise HTTPException(400, "Insufficient funds")
+        return {"status": "success", "txId": p.tx_id, "newBalance": 1000 - p.amount}
+
+    monkeypatch.setattr(bulk.posting_engine, "submit", submit)
+    app.dependency_overrides[verify_token] = lambda: USER
+    yield TestClient(app)
+    app.dependency_overrides.clear()
+
+
+def post(client, body: bytes, content_type: str) -> list:
+    response = client.post("/api/transactions/bulk", content=body, headers={"Content-Type": content_type})
+    assert response.status_code == 200
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+def test_csv_rows_are_posted_and_reported_in_order(client):
+    body = (
+        "fromAccount,toAccount,amount,currency\n"
+        "ACC-1,ACC-2,10,USD\n"
+        "ACC-1,ACC-3,not-a-number,USD\n"
+        "ACC-1,ACC-4,500,\n"
+        "ACC-1,ACC-5,20.5,EUR\n"
+    ).encode()
+    *rows, summary = post(client, body, "text/csv")
+
+    assert [r["row"] for r in rows] == [1, 2, 3, 4]
+    assert [r["status"] for r in rows] == ["success", "error", "error", "success"]
+    assert rows[1]["code"] == 422
+    assert rows[2] == {"row": 3, "status": "error", "code": 400, "detail": "Insufficient funds"}
+    assert rows[3]["newBalance"] == 979.5
+    assert summary == {"summary": {"rows": 4, "succeeded": 2, "failed": 2}}
+
+
+def test_ndjson_rows_are_posted_and_reported_in_order(client):
+    lines = [{"fromAccount": "ACC-1", "toAccount": f"ACC-{i}", "amount": i} for i in range(2, 202)]
+    body = ("\n".join(json.dumps(line) for line in lines) + "\n{not json}\n").encode()
+    *rows, summary = post(client, body, "application/x-ndjson")
+
+    assert [r["row"] for r in rows] == list(range(1, 202))
+    assert all(r["status"] == "success" for r in rows[:99])
+    assert all(r["code"] == 400 for r in rows[99:200])
+    assert rows[200]["code"] == 422 and rows[200]["detail"].startswith("invalid JSON")
+    assert summary == {"summary": {"rows": 201, "succeeded": 99, "failed": 102}}
+
+
+def test_undecodable_row_is_reported_on_its_own():
+    async def stream():
+        yield b"fromAccount,toAccount,amount\nACC-1,ACC-2,1"
+        yield b"0\nACC-1,\xff\xfe,5\nACC-1,ACC-3,7\n"
+
+    async def collect():
+        return [r async for r in bulk.records(stream(), "csv")]
+
+    rows = asyncio.run(collect())
+    assert rows[0] == (1, {"fromAccount": "ACC-1", "toAccount": "ACC-2", "amount": "10"})
+    assert rows[1][0] == 2 and rows[1][1].startswith("invalid UTF-8")
+    assert rows[2] == (3, {"fromAccount": "ACC-1", "toAccount": "ACC-3", "amount": "7"})